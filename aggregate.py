@@ -0,0 +1,252 @@
+"""
+Vectorized deck aggregation.
+
+Each card is reduced to a compact representation when it is fetched: its color
+identity as a WUBRG bitmask and an is_land flag. Decks are then turned into flat
+NumPy arrays and the color identity counts and mana curve are computed with
+bincounts, for one deck or for thousands of decks at once.
+"""
+import numpy as np
+
+
+COLORS = ['W', 'U', 'B', 'R', 'G', 'C']
+COLOR_BITS = {color: 1 << index for index, color in enumerate(COLORS[:5])}
+
+# Top mana curve bucket, which also holds every higher mana value
+MAX_CURVE_CMC = 16
+
+# Bit i of a color mask is COLORS[i]
+_BIT_INDEXES = np.arange(5, dtype=np.uint8)
+
+
+def colorMask(identity):
+    """
+    Packs a color identity list like ['U', 'R'] into a WUBRG bitmask
+    """
+    mask = 0
+    for color in identity or []:
+        if color in COLOR_BITS:
+            mask |= COLOR_BITS[color]
+        else:
+            print(f"Warning: Unexpected color identity '{color}'")
+    return mask
+
+
+def isLandType(typeLine):
+    return bool(typeLine) and 'Land' in typeLine
+
+
+def compactFields(card):
+    """
+    The precomputed fields stored alongside each fetched card
+    """
+    return {
+        'color_mask': colorMask(card.get('color_identity')),
+        'is_land': isLandType(card.get('type_line')),
+    }
+
+
+class DeckArrays:
+    """
+    Columnar view of one or more decks: one row per card entry
+    """
+
+    def __init__(self, deckIndex, colorMasks, isLand, cmc, quantity, numDecks):
+        self.deckIndex = deckIndex
+        self.colorMasks = colorMasks
+        self.isLand = isLand
+        self.cmc = cmc
+        self.quantity = quantity
+        self.numDecks = numDecks
+
+    @classmethod
+    def fromDecks(cls, decks):
+        """
+        Builds the arrays from a list of decks, each a list of card dicts
+        """
+        rows = [(deckNumber, card) for deckNumber, cards in enumerate(decks)
+                for card in cards]
+        count = len(rows)
+        deckIndex = np.empty(count, dtype=np.int64)
+        colorMasks = np.empty(count, dtype=np.uint8)
+        isLand = np.empty(count, dtype=bool)
+        cmc = np.empty(count, dtype=np.float64)
+        quantity = np.empty(count, dtype=np.int64)
+
+        for row, (deckNumber, card) in enumerate(rows):
+            # Cards cached before the compact fields existed get them computed here
+            if 'color_mask' not in card:
+                card = {**card, **compactFields(card)}
+            deckIndex[row] = deckNumber
+            colorMasks[row] = card['color_mask']
+            isLand[row] = card['is_land']
+            cmc[row] = np.nan if card.get('cmc') is None else card['cmc']
+            quantity[row] = card.get('quantity', 1)
+
+        return cls(deckIndex, colorMasks, isLand, cmc, quantity, len(decks))
+
+    @classmethod
+    def fromCards(cls, cards):
+        return cls.fromDecks([cards])
+
+
+def colorIdentityMatrix(arrays, includeLands=False):
+    """
+    Returns a (numDecks, 6) array of color identity counts in WUBRGC order
+
+    Each card adds its quantity to every color in its identity; colorless
+    nonland cards count towards C. Lands are skipped unless includeLands.
+    """
+    counted = np.ones_like(arrays.isLand) if includeLands else ~arrays.isLand
+    weights = np.where(counted, arrays.quantity, 0)
+
+    # (rows, 5) matrix of identity bits, plus a colorless column
+    bits = (arrays.colorMasks[:, None] >> _BIT_INDEXES) & 1
+    colorless = (arrays.colorMasks == 0) & ~arrays.isLand
+    hits = np.concatenate([bits.astype(bool), colorless[:, None]], axis=1)
+
+    rowIndex, colorIndex = np.nonzero(hits)
+    cells = arrays.deckIndex[rowIndex] * len(COLORS) + colorIndex
+    counts = np.bincount(cells, weights=weights[rowIndex],
+                         minlength=arrays.numDecks * len(COLORS))
+    return counts.astype(np.int64).reshape(arrays.numDecks, len(COLORS))
+
+
+def manaCurveMatrix(arrays):
+    """
+    Returns a (numDecks, maxCmc + 1) array of nonland card counts per CMC,
+    with mana values above MAX_CURVE_CMC counted in its column
+    """
+    spells = ~arrays.isLand & ~np.isnan(arrays.cmc)
+    cmc = np.minimum(arrays.cmc[spells], MAX_CURVE_CMC).astype(np.int64)
+    width = int(cmc.max()) + 1 if cmc.size else 1
+    cells = arrays.deckIndex[spells] * width + cmc
+    counts = np.bincount(cells, weights=arrays.quantity[spells],
+                         minlength=arrays.numDecks * width)
+    return counts.astype(np.int64).reshape(arrays.numDecks, width)
+
+
+def colorCountsDict(row):
+    """
+    Turns one row of colorIdentityMatrix into {color: count}, dropping zeros
+    """
+    return {color: int(count) for color, count in zip(COLORS, row) if count > 0}
+
+
+def colorPercentages(filteredIDCount):
+    totalIDPoints = sum(filteredIDCount.values())
+    if totalIDPoints == 0:
+        return {}
+    return {k: (v / totalIDPoints) * 100 for k, v in filteredIDCount.items()}
+
+
+def manaCurveDict(row):
+    """
+    Turns one row of manaCurveMatrix into {cmc: count}, dropping zeros
+    """
+    return {cmc: int(count) for cmc, count in enumerate(row) if count > 0}
+
+
+def analyzeCards(cards):
+    """
+    Aggregates a single deck's card list
+
+    Returns (filteredIDCount, IDPercentage, cmcIntDict) as used by the response
+    """
+    arrays = DeckArrays.fromCards(cards)
+    filteredIDCount = colorCountsDict(colorIdentityMatrix(arrays)[0])
+    cmcIntDict = manaCurveDict(manaCurveMatrix(arrays)[0])
+    return filteredIDCount, colorPercentages(filteredIDCount), cmcIntDict
+
+
+class RunningTotals:
+    """
+    Color identity counts and mana curve of one deck, kept up to date as cards
+    are added or removed instead of being recomputed from the whole list
+
+    Follows the same rules as colorIdentityMatrix / manaCurveMatrix: lands are
+    left out, and colorless nonland cards count towards C.
+    """
+
+    def __init__(self):
+        self.colorCounts = np.zeros(len(COLORS), dtype=np.int64)
+        self.curve = {}
+
+    def copy(self):
+        totals = RunningTotals()
+        totals.colorCounts = self.colorCounts.copy()
+        totals.curve = dict(self.curve)
+        return totals
+
+    def add(self, card, quantity):
+        """
+        Adds `quantity` copies of a card (negative to remove them)
+        """
+        if 'color_mask' not in card:
+            card = {**card, **compactFields(card)}
+        if card['is_land']:
+            return
+        mask = card['color_mask']
+        if mask:
+            self.colorCounts[:5] += quantity * ((mask >> _BIT_INDEXES) & 1)
+        else:
+            self.colorCounts[5] += quantity
+        if card.get('cmc') is not None:
+            cmc = min(int(card['cmc']), MAX_CURVE_CMC)
+            self.curve[cmc] = self.curve.get(cmc, 0) + quantity
+
+    def results(self):
+        """
+        (filteredIDCount, IDPercentage, cmcIntDict), as returned by analyzeCards
+        """
+        filteredIDCount = colorCountsDict(self.colorCounts)
+        cmcIntDict = {cmc: count for cmc, count in sorted(self.curve.items())
+                      if count > 0}
+        return filteredIDCount, colorPercentages(filteredIDCount), cmcIntDict
+
+
+def cardInclusion(decks):
+    """
+    Field-wide card stats over a list of decks (each a list of card dicts)
+
+    Returns one entry per card name with how many decks play it, the fraction
+    of decks that do, and the average number of copies in those decks
+    """
+    names = {}
+    deckIndex = []
+    cardIndex = []
+    quantity = []
+    for deckNumber, cards in enumerate(decks):
+        for card in cards:
+            deckIndex.append(deckNumber)
+            cardIndex.append(names.setdefault(card['name'], len(names)))
+            quantity.append(card.get('quantity', 1))
+
+    if not names:
+        return []
+
+    numDecks, numCards = len(decks), len(names)
+    copies = np.bincount(np.asarray(deckIndex) * numCards + np.asarray(cardIndex),
+                         weights=np.asarray(quantity),
+                         minlength=numDecks * numCards).reshape(numDecks, numCards)
+    playedIn = (copies > 0).sum(axis=0)
+    totalCopies = copies.sum(axis=0)
+
+    inclusion = [{
+        'name': name,
+        'decks': int(playedIn[index]),
+        'inclusion_rate': float(playedIn[index] / numDecks),
+        'average_copies': float(totalCopies[index] / playedIn[index]),
+    } for name, index in names.items()]
+    inclusion.sort(key=lambda entry: (-entry['decks'], entry['name']))
+    return inclusion
+
+
+def averageRow(matrix, labels):
+    """
+    Column means of an aggregate matrix as {label: mean}, dropping zeros
+    """
+    if matrix.shape[0] == 0:
+        return {}
+    means = matrix.mean(axis=0)
+    return {label: float(mean) for label, mean in zip(labels, means) if mean > 0}
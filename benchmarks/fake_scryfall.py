@@ -0,0 +1,150 @@
+"""
+Local stand-in for the parts of the Scryfall API the analyzer uses.
+
+Serves GET /cards/named?exact= and POST /cards/collection from the fixture
+cards in fixtures/cards.json, with a configurable delay per request and a
+share of requests answered 429 (with Retry-After) like the real API does when
+a client goes over its rate limit. GET /stats returns the request counters.
+
+    python benchmarks/fake_scryfall.py --port 8765 --latency 50 --throttle-rate 0.05
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "fixtures", "cards.json")
+
+
+def loadCards(path=FIXTURES_PATH):
+    """
+    Fixture cards keyed by lowercased name, and by face name for
+    double-faced and split cards
+    """
+    with open(path, 'r', encoding='utf-8') as fixtureFile:
+        cards = json.load(fixtureFile)
+    byName = {}
+    for card in cards:
+        byName[card['name'].lower()] = card
+        for face in card.get('card_faces') or []:
+            byName.setdefault(face['name'].lower(), card)
+    return byName
+
+
+class FakeScryfall(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, cards, latency=0.0, throttleRate=0.0, retryAfter=1):
+        super().__init__(address, FakeScryfallHandler)
+        self.cards = cards
+        self.latency = latency
+        self.throttleRate = throttleRate
+        self.retryAfter = retryAfter
+        self.counts = {'named': 0, 'collection': 0, 'throttled': 0, 'identifiers': 0}
+        self.countsLock = threading.Lock()
+
+    def count(self, name, amount=1):
+        with self.countsLock:
+            self.counts[name] += amount
+
+
+class FakeScryfallHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def sendJson(self, status, obj, headers=None):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def throttled(self):
+        """
+        Sleeps for the configured latency, then answers 429 for a share of requests
+        """
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        if server.throttleRate and random.random() < server.throttleRate:
+            server.count('throttled')
+            self.sendJson(429, {'object': 'error', 'status': 429,
+                                'details': "Too many requests"},
+                          headers={'Retry-After': str(server.retryAfter)})
+            return True
+        return False
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/stats":
+            with self.server.countsLock:
+                return self.sendJson(200, dict(self.server.counts))
+        if url.path != "/cards/named":
+            return self.sendJson(404, {'object': 'error', 'status': 404})
+
+        self.server.count('named')
+        if self.throttled():
+            return
+        name = parse_qs(url.query).get('exact', [''])[0]
+        card = self.server.cards.get(name.lower())
+        if card is None:
+            return self.sendJson(404, {'object': 'error', 'status': 404,
+                                       'details': f"No card named {name!r}"})
+        self.sendJson(200, card)
+
+    def do_POST(self):
+        if urlsplit(self.path).path != "/cards/collection":
+            return self.sendJson(404, {'object': 'error', 'status': 404})
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length) or b'{}')
+
+        self.server.count('collection')
+        if self.throttled():
+            return
+        identifiers = payload.get('identifiers', [])
+        self.server.count('identifiers', len(identifiers))
+        found = []
+        notFound = []
+        for identifier in identifiers:
+            card = self.server.cards.get(identifier.get('name', '').lower())
+            if card is None:
+                notFound.append(identifier)
+            else:
+                found.append(card)
+        self.sendJson(200, {'object': 'list', 'not_found': notFound, 'data': found})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake Scryfall API for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="milliseconds added to every card request")
+    parser.add_argument("--throttle-rate", type=float, default=0.0,
+                        help="share of card requests answered 429 (0-1)")
+    parser.add_argument("--retry-after", type=int, default=1,
+                        help="Retry-After seconds sent with 429 responses")
+    args = parser.parse_args()
+
+    server = FakeScryfall((args.host, args.port), loadCards(),
+                          latency=args.latency / 1000.0,
+                          throttleRate=args.throttle_rate,
+                          retryAfter=args.retry_after)
+    print(f"Fake Scryfall listening on http://{args.host}:{server.server_port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
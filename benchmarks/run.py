@@ -0,0 +1,352 @@
+"""
+Load benchmark for the deck analyzer.
+
+Starts the fake Scryfall server (fake_scryfall.py) and the app under test
+(main.py, or the serverless api/main.py with --app api) pointed at it, then
+drives /analyze-deck and /upload-decklist with the decklists in decklists/ at
+increasing concurrency. Each level reports throughput, p50/p95/p99 latency and
+the peak RSS of the server and its worker processes. Results are saved as JSON
+under results/ and can be compared against an earlier run:
+
+    python benchmarks/run.py --concurrency 1,4,16 --requests 200
+    python benchmarks/run.py --latency 80 --throttle-rate 0.05 --compare results/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+DECKLISTS_DIR = os.path.join(BENCH_DIR, "decklists")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+# Where each app lives and the prefix of its routes
+APPS = {
+    'main': {'cwd': REPO_DIR, 'prefix': ""},
+    'api': {'cwd': os.path.join(REPO_DIR, "mtg-deck-analyzer", "api"), 'prefix': "/api"},
+}
+
+ENDPOINTS = ('analyze', 'upload')
+
+
+def freePort():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def waitReady(url, timeout=60):
+    """
+    Polls url until it answers, returns the seconds it took
+    """
+    started = time.perf_counter()
+    while True:
+        try:
+            httpx.get(url, timeout=1)
+            return time.perf_counter() - started
+        except httpx.TransportError:
+            if time.perf_counter() - started > timeout:
+                raise RuntimeError(f"{url} didn't come up within {timeout}s")
+            time.sleep(0.05)
+
+
+def processTree(pid):
+    """
+    pid and all of its descendants (Linux only)
+    """
+    pids = [pid]
+    for parent in pids:
+        try:
+            for tid in os.listdir(f"/proc/{parent}/task"):
+                with open(f"/proc/{parent}/task/{tid}/children") as childrenFile:
+                    pids.extend(int(child) for child in childrenFile.read().split())
+        except OSError:
+            continue
+    return pids
+
+
+def treeRss(pid):
+    """
+    Resident memory in bytes of a process and its descendants, None if unknown
+    """
+    total = 0
+    for member in processTree(pid):
+        try:
+            with open(f"/proc/{member}/status") as statusFile:
+                for line in statusFile:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+    return total or None
+
+
+class RssSampler:
+    """
+    Samples the RSS of a process tree in the background, keeping the peak
+    """
+
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = treeRss(self.pid)
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def loadCorpus(directory=DECKLISTS_DIR):
+    corpus = []
+    for fileName in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, fileName), 'r', encoding='utf-8') as deckFile:
+            corpus.append((fileName, deckFile.read()))
+    return corpus
+
+
+def percentile(sortedValues, fraction):
+    if not sortedValues:
+        return None
+    position = min(len(sortedValues) - 1, int(round(fraction * (len(sortedValues) - 1))))
+    return sortedValues[position]
+
+
+def sendRequest(client, prefix, endpoint, deck, charts):
+    fileName, text = deck
+    if endpoint == 'analyze':
+        return client.post(f"{prefix}/analyze-deck", params={'charts': charts},
+                           json={'decklist': text})
+    return client.post(f"{prefix}/upload-decklist", params={'charts': charts},
+                       files={'file': (fileName, text.encode(), 'text/plain')})
+
+
+async def runLevel(baseUrl, prefix, endpoint, concurrency, requestCount, corpus,
+                   charts, serverPid):
+    """
+    Sends requestCount requests with at most `concurrency` in flight
+    """
+    latencies = []
+    statuses = {}
+    nextRequest = iter(range(requestCount))
+
+    async def worker(client):
+        for number in nextRequest:
+            deck = corpus[number % len(corpus)]
+            started = time.perf_counter()
+            try:
+                response = await sendRequest(client, prefix, endpoint, deck, charts)
+                status = str(response.status_code)
+            except httpx.HTTPError as error:
+                status = type(error).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=baseUrl, timeout=300, limits=limits) as client:
+        with RssSampler(serverPid) as sampler:
+            started = time.perf_counter()
+            await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+            elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'endpoint': endpoint,
+        'concurrency': concurrency,
+        'requests': requestCount,
+        'statuses': statuses,
+        'errors': requestCount - statuses.get('200', 0),
+        'seconds': elapsed,
+        'throughput_rps': requestCount / elapsed,
+        'latency_ms': {
+            'mean': 1000 * sum(latencies) / len(latencies),
+            'p50': 1000 * percentile(latencies, 0.50),
+            'p95': 1000 * percentile(latencies, 0.95),
+            'p99': 1000 * percentile(latencies, 0.99),
+            'max': 1000 * latencies[-1],
+        },
+        'peak_rss_mb': sampler.peak / 2**20 if sampler.peak else None,
+    }
+
+
+def gitCommit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def printLevel(level):
+    latency = level['latency_ms']
+    rss = f"{level['peak_rss_mb']:.0f} MB" if level['peak_rss_mb'] else "n/a"
+    print(f"{level['endpoint']:>8} c={level['concurrency']:<4} "
+          f"{level['throughput_rps']:8.1f} req/s  p50 {latency['p50']:8.1f} ms  "
+          f"p95 {latency['p95']:8.1f} ms  p99 {latency['p99']:8.1f} ms  "
+          f"rss {rss}  errors {level['errors']}", flush=True)
+
+
+def compareResults(baseline, current):
+    """
+    Prints throughput and p95 changes per (endpoint, concurrency) level
+    """
+    before = {(level['endpoint'], level['concurrency']): level
+              for level in baseline['levels']}
+    print(f"\nCompared with {baseline.get('git_commit')} ({baseline.get('timestamp')}):")
+    for level in current['levels']:
+        old = before.get((level['endpoint'], level['concurrency']))
+        if old is None:
+            continue
+        throughput = level['throughput_rps'] / old['throughput_rps'] - 1
+        p95 = level['latency_ms']['p95'] / old['latency_ms']['p95'] - 1
+        print(f"{level['endpoint']:>8} c={level['concurrency']:<4} "
+              f"throughput {throughput:+7.1%}  p95 {p95:+7.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the deck analyzer")
+    parser.add_argument("--app", choices=sorted(APPS), default='main')
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS),
+                        help="comma separated, any of: " + ", ".join(ENDPOINTS))
+    parser.add_argument("--concurrency", default="1,4,16,32",
+                        help="comma separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=100,
+                        help="requests per endpoint and concurrency level")
+    parser.add_argument("--charts", default='png', choices=['none', 'svg', 'png'])
+    parser.add_argument("--decklists", default=DECKLISTS_DIR)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--latency", type=float, default=50.0,
+                        help="fake Scryfall latency per request in milliseconds")
+    parser.add_argument("--throttle-rate", type=float, default=0.0,
+                        help="share of fake Scryfall requests answered 429")
+    parser.add_argument("--rate-limit", type=float, default=10.0,
+                        help="SCRYFALL_RATE_LIMIT for the app under test")
+    parser.add_argument("--response-cache", action='store_true',
+                        help="keep the whole-response cache on (off by default so "
+                             "every request runs the pipeline)")
+    parser.add_argument("--no-warmup", action='store_true',
+                        help="don't send each decklist once before measuring")
+    parser.add_argument("--server-log", default=os.devnull,
+                        help="file for the app's stdout/stderr")
+    parser.add_argument("--output", help="results file (default results/<app>-<time>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    corpus = loadCorpus(args.decklists)
+    endpoints = [name.strip() for name in args.endpoints.split(",") if name.strip()]
+    levels = [int(level) for level in args.concurrency.split(",")]
+    app = APPS[args.app]
+
+    with tempfile.TemporaryDirectory(prefix="mtg-bench-") as tmpDir, \
+            open(args.server_log, 'ab') as serverLog:
+        fakePort = freePort()
+        fake = subprocess.Popen(
+            [sys.executable, os.path.join(BENCH_DIR, "fake_scryfall.py"),
+             "--port", str(fakePort), "--latency", str(args.latency),
+             "--throttle-rate", str(args.throttle_rate)],
+            stdout=subprocess.DEVNULL)
+
+        appPort = freePort()
+        env = dict(os.environ,
+                   SCRYFALL_API_URL=f"http://127.0.0.1:{fakePort}",
+                   SCRYFALL_RATE_LIMIT=str(args.rate_limit),
+                   SCRYFALL_RATE_STATE_PATH=os.path.join(tmpDir, "rate.state"),
+                   MTG_CARD_CACHE_PATH=os.path.join(tmpDir, "cards.sqlite3"),
+                   MTG_CARD_INDEX_PATH=os.path.join(tmpDir, "no_index.bin"),
+                   MTG_CHART_DIR=os.path.join(tmpDir, "charts"))
+        if not args.response_cache:
+            env['MTG_RESPONSE_CACHE_TTL'] = "0"
+
+        serverStarted = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+             "--port", str(appPort), "--workers", str(args.workers),
+             "--log-level", "warning"],
+            cwd=app['cwd'], env=env, stdout=serverLog, stderr=serverLog)
+
+        try:
+            waitReady(f"http://127.0.0.1:{fakePort}/stats")
+            baseUrl = f"http://127.0.0.1:{appPort}"
+            waitReady(baseUrl + app['prefix'] + "/")
+            startupSeconds = time.perf_counter() - serverStarted
+            print(f"{args.app} ready in {startupSeconds:.2f}s", flush=True)
+
+            # The first analysis pays for lazy setup and a cold card cache
+            with httpx.Client(base_url=baseUrl, timeout=300) as client:
+                started = time.perf_counter()
+                sendRequest(client, app['prefix'], 'analyze', corpus[0], args.charts)
+                firstRequestSeconds = time.perf_counter() - started
+                if not args.no_warmup:
+                    for deck in corpus:
+                        sendRequest(client, app['prefix'], 'analyze', deck, args.charts)
+
+            results = []
+            for endpoint in endpoints:
+                for concurrency in levels:
+                    level = asyncio.run(runLevel(
+                        baseUrl, app['prefix'], endpoint, concurrency, args.requests,
+                        corpus, args.charts, server.pid))
+                    printLevel(level)
+                    results.append(level)
+
+            upstream = httpx.get(f"http://127.0.0.1:{fakePort}/stats").json()
+        finally:
+            server.terminate()
+            fake.terminate()
+            server.wait()
+            fake.wait()
+
+    report = {
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'git_commit': gitCommit(),
+        'app': args.app,
+        'config': {
+            'charts': args.charts, 'workers': args.workers, 'requests': args.requests,
+            'latency_ms': args.latency, 'throttle_rate': args.throttle_rate,
+            'rate_limit': args.rate_limit, 'response_cache': args.response_cache,
+            'warmup': not args.no_warmup,
+            'decklists': [fileName for fileName, _ in corpus],
+        },
+        'startup_seconds': startupSeconds,
+        'first_request_seconds': firstRequestSeconds,
+        'upstream': upstream,
+        'levels': results,
+    }
+
+    outputPath = args.output or os.path.join(
+        RESULTS_DIR, f"{args.app}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(outputPath)), exist_ok=True)
+    with open(outputPath, 'w') as outputFile:
+        json.dump(report, outputFile, indent=2)
+    print(f"Results saved to {outputPath}")
+
+    if args.compare:
+        with open(args.compare) as baselineFile:
+            compareResults(json.load(baselineFile), report)
+
+
+if __name__ == "__main__":
+    main()
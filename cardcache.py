@@ -0,0 +1,334 @@
+"""
+Persistent card cache that sits in front of the Scryfall lookups.
+
+Cards are stored in a small SQLite file keyed by normalized card name, with an
+in-memory LRU in front of it so a repeat deck never touches the disk or the
+network. Entries expire after a configurable TTL and the file is kept under a
+maximum number of rows by evicting the least recently used cards. Memory hits
+are written back to the file's last use times in batches, so the hottest
+cards aren't the first ones evicted.
+
+The file also counts how often each card is looked up, which outlives the
+cards' entries and the server process, so a restarted server knows which cards
+to warm up (see warmup.py).
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Re-exported, card names are normalized the same way in decklists and the cache
+from decklist import normalizeCardName  # noqa: F401
+
+
+DEFAULT_CACHE_PATH = "card_cache.sqlite3"
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60  # Card data rarely changes, a week is plenty
+DEFAULT_MAX_ENTRIES = 50000
+DEFAULT_MEMORY_SIZE = 4096
+# Stores between two checks of the row count against maxEntries
+EVICT_EVERY = 100
+
+
+class LRUCache:
+    """
+    Small thread-safe LRU mapping with hit/miss counters
+
+    Bounded by entry count, and optionally by total size in bytes when
+    maxBytes is given (each value's size comes from sizeOf)
+    """
+
+    def __init__(self, maxsize, maxBytes=None, sizeOf=len):
+        self.maxsize = maxsize
+        self.maxBytes = maxBytes
+        self.sizeOf = sizeOf
+        self.currentBytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._data:
+                self._removeLocked(key)
+            self._data[key] = value
+            if self.maxBytes is not None:
+                self.currentBytes += self.sizeOf(value)
+            while self._data and (len(self._data) > self.maxsize or self._overBytes()):
+                self._removeLocked(next(iter(self._data)))
+                self.evictions += 1
+
+    def _overBytes(self):
+        return self.maxBytes is not None and self.currentBytes > self.maxBytes
+
+    def _removeLocked(self, key):
+        value = self._data.pop(key)
+        if self.maxBytes is not None:
+            self.currentBytes -= self.sizeOf(value)
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            return self._removeLocked(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.currentBytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def stats(self):
+        total = self.hits + self.misses
+        stats = {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': (self.hits / total) if total else 0.0,
+        }
+        if self.maxBytes is not None:
+            stats['bytes'] = self.currentBytes
+            stats['max_bytes'] = self.maxBytes
+        return stats
+
+
+class CardCache:
+    """
+    Two-level card store: in-memory LRU backed by a SQLite file
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL_SECONDS,
+                 maxEntries=DEFAULT_MAX_ENTRIES, memorySize=DEFAULT_MEMORY_SIZE,
+                 evictEvery=EVICT_EVERY):
+        self.path = path
+        self.ttl = ttl
+        self.maxEntries = maxEntries
+        self.evictEvery = evictEvery
+        self.memory = LRUCache(memorySize)
+        self._lock = threading.Lock()
+        # {key: time} of memory hits not written to the file yet
+        self._touched = {}
+        self._puts = 0
+        self.diskHits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # WAL lets several uvicorn workers read while one of them writes
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS cards (
+                   key TEXT PRIMARY KEY,
+                   data TEXT NOT NULL,
+                   fetched_at REAL NOT NULL,
+                   last_used REAL NOT NULL
+               )""")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS cards_last_used ON cards (last_used)")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS card_uses (
+                   key TEXT PRIMARY KEY,
+                   uses INTEGER NOT NULL,
+                   last_used REAL NOT NULL
+               )""")
+        self._conn.commit()
+
+    @classmethod
+    def from_env(cls):
+        """
+        Builds the cache from MTG_CARD_CACHE_* environment variables
+        """
+        return cls(
+            path=os.environ.get("MTG_CARD_CACHE_PATH", DEFAULT_CACHE_PATH),
+            ttl=float(os.environ.get("MTG_CARD_CACHE_TTL", DEFAULT_TTL_SECONDS)),
+            maxEntries=int(os.environ.get(
+                "MTG_CARD_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+            memorySize=int(os.environ.get(
+                "MTG_CARD_CACHE_MEMORY_SIZE", DEFAULT_MEMORY_SIZE)),
+        )
+
+    def get(self, cardname):
+        """
+        Returns a copy of the cached card dict, or None on a miss or expired entry
+        """
+        key = normalizeCardName(cardname)
+        now = time.time()
+
+        entry = self.memory.get(key)
+        if entry is not None:
+            fetchedAt, data = entry
+            if now - fetchedAt < self.ttl:
+                self._touched[key] = now
+                return dict(data)
+            self.memory.pop(key)
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, fetched_at FROM cards WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            data, fetchedAt = json.loads(row[0]), row[1]
+            if now - fetchedAt >= self.ttl:
+                self._conn.execute("DELETE FROM cards WHERE key = ?", (key,))
+                self._conn.commit()
+                self.expired += 1
+                self.misses += 1
+                return None
+
+            self._conn.execute(
+                "UPDATE cards SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.diskHits += 1
+
+        self.memory.put(key, (fetchedAt, data))
+        return dict(data)
+
+    def put(self, cardname, data, aliases=(), fetchedAt=None):
+        """
+        Stores card data under its lookup name (and any aliases such as the
+        canonical Scryfall name) in both cache levels, as fetched at
+        `fetchedAt` (now by default)
+        """
+        now = time.time()
+        if fetchedAt is None:
+            fetchedAt = now
+        stored = {k: v for k, v in data.items() if k != 'quantity'}
+        keys = {normalizeCardName(name) for name in (cardname, *aliases) if name}
+        payload = json.dumps(stored)
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cards (key, data, fetched_at, last_used) "
+                "VALUES (?, ?, ?, ?)",
+                [(key, payload, fetchedAt, now) for key in keys])
+            self._puts += 1
+            if self._puts % self.evictEvery == 0:
+                self._evictLocked()
+            self._conn.commit()
+
+        for key in keys:
+            self.memory.put(key, (fetchedAt, stored))
+
+    def _flushTouchedLocked(self):
+        touched, self._touched = self._touched, {}
+        if touched:
+            self._conn.executemany(
+                "UPDATE cards SET last_used = MAX(last_used, ?) WHERE key = ?",
+                [(usedAt, key) for key, usedAt in list(touched.items())])
+
+    def flushTouched(self):
+        """
+        Writes the last use times of memory hits to the file
+        """
+        with self._lock:
+            self._flushTouchedLocked()
+            self._conn.commit()
+
+    def _evictLocked(self):
+        # Memory hits count as uses, so write them before picking what to drop
+        self._flushTouchedLocked()
+        count = self._conn.execute("SELECT COUNT(*) FROM cards").fetchone()[0]
+        overflow = count - self.maxEntries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM cards WHERE key IN "
+                "(SELECT key FROM cards ORDER BY last_used ASC LIMIT ?)", (overflow,))
+            self.evictions += overflow
+
+    def recordUses(self, counts):
+        """
+        Adds {card name: lookups} to the lookup counts kept on disk
+        """
+        if not counts:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO card_uses (key, uses, last_used) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET uses = uses + excluded.uses, "
+                "last_used = excluded.last_used",
+                [(normalizeCardName(name), count, now) for name, count in counts.items()])
+            self._conn.commit()
+
+    def hotKeys(self, limit, since=0.0):
+        """
+        The `limit` most looked up card keys among those used after `since`
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key FROM card_uses WHERE last_used >= ? "
+                "ORDER BY uses DESC LIMIT ?", (since, limit)).fetchall()
+        return [row[0] for row in rows]
+
+    def fetchedAt(self, cardnames):
+        """
+        {key: fetch time} of the given cards that are stored on disk
+        """
+        keys = list({normalizeCardName(name) for name in cardnames})
+        found = {}
+        with self._lock:
+            # Stay under SQLite's limit on query parameters
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._conn.execute(
+                    "SELECT key, fetched_at FROM cards WHERE key IN (%s)"
+                    % ",".join("?" * len(batch)), batch).fetchall()
+                found.update(rows)
+        return found
+
+    def names(self):
+        """
+        Returns (lookup key, card name) for every card stored on disk
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT key, data FROM cards").fetchall()
+        return [(key, json.loads(data).get('name') or key) for key, data in rows]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM cards")
+            self._conn.commit()
+        self.memory.clear()
+
+    def stats(self):
+        with self._lock:
+            diskSize = self._conn.execute(
+                "SELECT COUNT(*) FROM cards").fetchone()[0]
+        memoryStats = self.memory.stats()
+        hits = memoryStats['hits'] + self.diskHits
+        total = hits + self.misses
+        return {
+            'memory_hits': memoryStats['hits'],
+            'disk_hits': self.diskHits,
+            'misses': self.misses,
+            'expired': self.expired,
+            'evictions': self.evictions + memoryStats['evictions'],
+            'memory_size': memoryStats['size'],
+            'disk_size': diskSize,
+            'hit_rate': (hits / total) if total else 0.0,
+        }
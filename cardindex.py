@@ -0,0 +1,295 @@
+"""
+Offline card index built from a Scryfall bulk-data dump.
+
+The Oracle Cards file (https://scryfall.com/docs/api/bulk-data) is parsed as a
+stream, one card object at a time, and written to a compact binary index:
+
+    header | key table (sorted) | card table | string blob
+
+The key table holds every normalized card name (and the face names of split and
+double-faced cards) sorted bytewise, each pointing into the card table. At
+startup the file is memory-mapped and the tables are viewed in place with NumPy,
+so nothing is parsed and lookups are a binary search over the mapped keys.
+
+Build an index with:
+
+    python cardindex.py oracle-cards.json card_index.bin
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from aggregate import COLORS, COLOR_BITS, colorMask, isLandType
+from cardcache import normalizeCardName
+
+
+DEFAULT_INDEX_PATH = "card_index.bin"
+
+MAGIC = b"MTGIDX\x00\x00"
+# Version 2 added mana costs and produced mana
+VERSION = 2
+HEADER = struct.Struct("<8sIII")  # magic, version, key count, card count
+
+KEY_DTYPE = np.dtype([('offset', '<u4'), ('length', '<u2'), ('card', '<u4')])
+CARD_DTYPE = np.dtype([
+    ('name_offset', '<u4'), ('name_length', '<u2'),
+    ('type_offset', '<u4'), ('type_length', '<u2'),
+    ('cost_offset', '<u4'), ('cost_length', '<u2'),
+    ('cmc', '<f4'), ('color_mask', 'u1'), ('produced_mask', 'u1'),
+])
+
+# Layouts that share names with real cards but aren't playable cards themselves
+SKIPPED_LAYOUTS = {'art_series', 'token', 'double_faced_token', 'emblem'}
+
+READ_CHUNK_SIZE = 1 << 20
+
+
+def iterJsonArray(fileObj, chunkSize=READ_CHUNK_SIZE):
+    """
+    Yields the objects of a top-level JSON array one at a time, reading the
+    file in chunks instead of loading the whole document
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    started = False
+    eof = False
+
+    while True:
+        # Skip whitespace and the array punctuation between objects
+        while position < len(buffer) and buffer[position] in " \t\r\n,[]":
+            if buffer[position] == '[':
+                started = True
+            position += 1
+
+        if position < len(buffer) and started:
+            try:
+                obj, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                yield obj
+                position = end
+                continue
+
+        if eof:
+            return
+
+        # Need more data: drop what's been consumed and read the next chunk
+        chunk = fileObj.read(chunkSize)
+        buffer = buffer[position:] + chunk
+        position = 0
+        eof = not chunk
+
+
+def cardRecord(card):
+    """
+    Pulls the indexed fields out of a bulk-data card object
+    """
+    faces = card.get('card_faces') or []
+    typeLine = card.get('type_line')
+    if typeLine is None and faces:
+        typeLine = " // ".join(face.get('type_line', '') for face in faces)
+    manaCost = card.get('mana_cost')
+    if manaCost is None and faces:
+        manaCost = faces[0].get('mana_cost')
+    return {
+        'name': card.get('name', ''),
+        'type_line': typeLine or '',
+        'mana_cost': manaCost or '',
+        'cmc': float(card.get('cmc') or 0.0),
+        'color_mask': colorMask(card.get('color_identity')),
+        # produced_mana can include C for colorless, only colors are kept
+        'produced_mask': colorMask([color for color in card.get('produced_mana') or []
+                                    if color in COLOR_BITS]),
+        'face_names': [face.get('name') for face in faces if face.get('name')],
+    }
+
+
+def maskColors(mask):
+    """
+    Unpacks a WUBRG bitmask back into a color list
+    """
+    return [color for bit, color in enumerate(COLORS[:5]) if mask & (1 << bit)]
+
+
+def buildIndex(bulkPath, indexPath=DEFAULT_INDEX_PATH):
+    """
+    Streams a Scryfall bulk-data JSON file and writes the binary index
+
+    Returns the number of cards indexed
+    """
+    records = []
+    keys = {}
+    faceKeys = {}
+
+    with open(bulkPath, 'r', encoding='utf-8') as bulkFile:
+        for card in iterJsonArray(bulkFile):
+            if card.get('layout') in SKIPPED_LAYOUTS or not card.get('name'):
+                continue
+            record = cardRecord(card)
+            cardNumber = len(records)
+            records.append(record)
+            keys.setdefault(normalizeCardName(record['name']), cardNumber)
+            for faceName in record['face_names']:
+                faceKeys.setdefault(normalizeCardName(faceName), cardNumber)
+
+    # Full names win over face names when they collide
+    for key, cardNumber in faceKeys.items():
+        keys.setdefault(key, cardNumber)
+
+    blob = bytearray()
+
+    def addString(text):
+        encoded = text.encode('utf-8')
+        offset = len(blob)
+        blob.extend(encoded)
+        return offset, len(encoded)
+
+    cardTable = np.zeros(len(records), dtype=CARD_DTYPE)
+    for cardNumber, record in enumerate(records):
+        nameOffset, nameLength = addString(record['name'])
+        typeOffset, typeLength = addString(record['type_line'])
+        costOffset, costLength = addString(record['mana_cost'])
+        cardTable[cardNumber] = (nameOffset, nameLength, typeOffset, typeLength,
+                                 costOffset, costLength, record['cmc'],
+                                 record['color_mask'], record['produced_mask'])
+
+    sortedKeys = sorted((key.encode('utf-8'), cardNumber)
+                        for key, cardNumber in keys.items())
+    keyTable = np.zeros(len(sortedKeys), dtype=KEY_DTYPE)
+    for keyNumber, (encodedKey, cardNumber) in enumerate(sortedKeys):
+        keyTable[keyNumber] = (len(blob), len(encodedKey), cardNumber)
+        blob.extend(encodedKey)
+
+    tmpPath = indexPath + ".tmp"
+    with open(tmpPath, 'wb') as indexFile:
+        indexFile.write(HEADER.pack(MAGIC, VERSION, len(keyTable), len(cardTable)))
+        indexFile.write(keyTable.tobytes())
+        indexFile.write(cardTable.tobytes())
+        indexFile.write(bytes(blob))
+    os.replace(tmpPath, indexPath)
+    return len(records)
+
+
+class CardIndex:
+    """
+    Read-only, memory-mapped view of an index written by buildIndex
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        with open(path, 'rb') as indexFile:
+            self._map = mmap.mmap(indexFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, keyCount, cardCount = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} card index")
+
+        keysStart = HEADER.size
+        cardsStart = keysStart + keyCount * KEY_DTYPE.itemsize
+        self.blobStart = cardsStart + cardCount * CARD_DTYPE.itemsize
+        self.keys = np.frombuffer(self._map, dtype=KEY_DTYPE,
+                                  count=keyCount, offset=keysStart)
+        self.cards = np.frombuffer(self._map, dtype=CARD_DTYPE,
+                                   count=cardCount, offset=cardsStart)
+
+    @classmethod
+    def from_env(cls):
+        """
+        Maps the index at MTG_CARD_INDEX_PATH (default card_index.bin), or
+        returns None when there isn't one (or it was built by an older version)
+        """
+        path = os.environ.get("MTG_CARD_INDEX_PATH", DEFAULT_INDEX_PATH)
+        if not os.path.exists(path):
+            return None
+        try:
+            return cls(path)
+        except ValueError as error:
+            print(f"Ignoring card index: {error}, rebuild it with cardindex.py")
+            return None
+
+    def __len__(self):
+        return len(self.cards)
+
+    def _string(self, offset, length):
+        start = self.blobStart + int(offset)
+        return self._map[start:start + int(length)]
+
+    def _find(self, encodedKey):
+        lo, hi = 0, len(self.keys)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry = self.keys[mid]
+            midKey = self._string(entry['offset'], entry['length'])
+            if midKey < encodedKey:
+                lo = mid + 1
+            elif midKey > encodedKey:
+                hi = mid
+            else:
+                return int(entry['card'])
+        return None
+
+    def get(self, cardname):
+        """
+        Looks a card up by name (or face name), returning the same dict shape
+        as scryfall.cardSummary, or None if it isn't indexed
+        """
+        cardNumber = self._find(normalizeCardName(cardname).encode('utf-8'))
+        if cardNumber is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+
+        card = self.cards[cardNumber]
+        mask = int(card['color_mask'])
+        typeLine = self._string(card['type_offset'], card['type_length']).decode('utf-8')
+        return {
+            'name': self._string(card['name_offset'], card['name_length']).decode('utf-8'),
+            'color_identity': maskColors(mask),
+            'type_line': typeLine,
+            'cmc': float(card['cmc']),
+            'mana_cost': self._string(card['cost_offset'], card['cost_length']).decode('utf-8'),
+            'produced_mana': maskColors(int(card['produced_mask'])),
+            'color_mask': mask,
+            'is_land': isLandType(typeLine),
+        }
+
+    def keyNames(self):
+        """
+        Yields every (lookup key, card name) pair, including face name keys
+        """
+        for entry in self.keys:
+            card = self.cards[int(entry['card'])]
+            yield (self._string(entry['offset'], entry['length']).decode('utf-8'),
+                   self._string(card['name_offset'], card['name_length']).decode('utf-8'))
+
+    def stats(self):
+        return {
+            'cards': len(self.cards),
+            'keys': len(self.keys),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the offline card index from a Scryfall bulk-data file")
+    parser.add_argument("bulk_file", help="Oracle Cards JSON from Scryfall bulk data")
+    parser.add_argument("index_file", nargs="?", default=DEFAULT_INDEX_PATH)
+    args = parser.parse_args()
+
+    count = buildIndex(args.bulk_file, args.index_file)
+    print(f"Indexed {count} cards into {args.index_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+Card lookup layer shared by the server and corpus.py.
+
+Names are resolved from the offline index, then the card cache, then Scryfall's
+/cards/collection endpoint, with concurrent lookups of the same card coalesced
+and names Scryfall reports as not found corrected against the fuzzy name index.
+Kept apart from main.py so resolving names doesn't import the web and plotting
+stack.
+"""
+import asyncio
+import threading
+
+import metrics
+import scryfall
+from cardcache import CardCache
+from cardindex import CardIndex
+from fuzzy import FuzzyIndex
+from singleflight import FAILED, RETRY, SingleFlight
+from warmup import CardWarmer
+
+
+# Persistent card store in front of Scryfall, configured by MTG_CARD_CACHE_* env vars
+cardCache = CardCache.from_env()
+
+# Memory-mapped offline index built from Scryfall bulk data (see cardindex.py),
+# used before the cache and the live API when MTG_CARD_INDEX_PATH exists
+cardIndex = CardIndex.from_env()
+
+# Coalesces concurrent upstream lookups of the same card across requests
+cardFlights = SingleFlight()
+
+# Preloads and refreshes the most used cards, configured by MTG_WARMUP_* env vars
+cardWarmer = CardWarmer.from_env(cardCache)
+
+# Trigram index over every card name we know of, filled on first use
+fuzzyIndex = FuzzyIndex.from_env()
+fuzzyIndexLoaded = False
+_fuzzyIndexLock = threading.Lock()
+
+
+def lookupLocal(cardname):
+    """
+    Looks a card up without the network: the offline index first, then the cache
+    """
+    if cardIndex is not None:
+        data = cardIndex.get(cardname)
+        if data is not None:
+            return data
+    return currentCard(cardCache.get(cardname))
+
+
+def currentCard(data):
+    """
+    Drops cached cards stored before mana costs were kept, so they're refetched
+    """
+    if data is not None and 'mana_cost' not in data:
+        return None
+    return data
+
+
+def getFuzzyIndex():
+    """
+    Returns the fuzzy name index, loading the offline index and cache names into
+    it the first time it's needed
+
+    Loading goes over every known name, so call it from a thread (the server
+    starts loading it in the background at startup)
+    """
+    global fuzzyIndexLoaded
+    with _fuzzyIndexLock:
+        if not fuzzyIndexLoaded:
+            if cardIndex is not None:
+                for key, name in cardIndex.keyNames():
+                    fuzzyIndex.add(name, key)
+            for key, name in cardCache.names():
+                fuzzyIndex.add(name, key)
+            fuzzyIndexLoaded = True
+    return fuzzyIndex
+
+
+def correctLocally(cardname):
+    """
+    Resolves a misspelled or partial card name to a known card without the
+    network, or returns None when there's no confident match
+    """
+    key = getFuzzyIndex().correct(cardname)
+    if key is None:
+        return None
+    data = lookupLocal(key)
+    if data is not None:
+        data['corrected'] = True
+    return data
+
+
+def suggestNames(cardnames):
+    """
+    Closest known card names for each name that couldn't be resolved
+    """
+    index = getFuzzyIndex()
+    return {cardName: index.suggest(cardName) for cardName in cardnames}
+
+
+def splitCached(cardnames):
+    """
+    Splits unique card names into (cached results, names still to fetch)
+    """
+    results = {}
+    misses = []
+    for cardName in dict.fromkeys(cardnames):
+        data = None
+        if cardIndex is not None:
+            data = cardIndex.get(cardName)
+            source = 'index'
+        if data is None:
+            data = currentCard(cardCache.get(cardName))
+            source = 'cache'
+        # Names missing from the offline index still go to scryfall, they may
+        # be cards newer than the bulk data rather than typos
+        if data is not None:
+            metrics.CARD_LOOKUPS.inc(source=source)
+            cardWarmer.recordLookup(cardName)
+            results[cardName] = data
+        else:
+            misses.append(cardName)
+    return results, misses
+
+
+def storeFetched(results, found, notFound, failed):
+    """
+    Caches the cards scryfall found and adds them to results. Names it reported
+    as not found get a local spelling correction; names whose request failed
+    are left out without one, since they may well be spelled right
+
+    Writes to the card cache and searches the fuzzy index, so the async path
+    runs it on a thread
+    """
+    for cardName, data in found.items():
+        cardCache.put(cardName, data, aliases=[data['name']])
+        fuzzyIndex.add(data['name'])
+        metrics.CARD_LOOKUPS.inc(source='scryfall')
+        cardWarmer.recordLookup(cardName)
+        results[cardName] = data
+    for cardName in notFound:
+        data = correctLocally(cardName)
+        if data is not None:
+            metrics.CARD_LOOKUPS.inc(source='corrected')
+            results[cardName] = data
+        else:
+            metrics.CARD_LOOKUPS.inc(source='not_found')
+            print(f"Not found on scryfall: '{cardName}'")
+    for cardName in failed:
+        metrics.CARD_LOOKUPS.inc(source='failed')
+        print(f"Couldn't fetch '{cardName}' from scryfall")
+
+
+def fetchMany(cardnames, failed=None):
+    """
+    Resolves a set of card names, serving what it can from the cache and
+    batching the rest into /cards/collection requests
+
+    Returns a dict of requested name -> card data (missing names are left out).
+    Names that couldn't be fetched because scryfall couldn't be reached are
+    added to the `failed` set when one is given
+    """
+    results, misses = splitCached(cardnames)
+    if misses:
+        found, notFound, failedNames = scryfall.fetchCollection(misses)
+        storeFetched(results, found, notFound, failedNames)
+        if failed is not None:
+            failed.update(failedNames)
+    return results
+
+
+async def iterManyAsync(cardnames, failed=None):
+    """
+    Resolves card names without blocking the event loop, yielding
+    {name: card data} chunks as they become available (cache hits first,
+    then each scryfall batch as it completes)
+
+    Names that couldn't be fetched because scryfall couldn't be reached are
+    added to the `failed` set when one is given
+    """
+    results, misses = splitCached(cardnames)
+    if results:
+        yield results
+
+    while misses:
+        # Names another request is already fetching are waited on, not refetched
+        owned, waiting = cardFlights.claim(misses)
+        try:
+            if owned:
+                async for found, notFound, failedNames in scryfall.iterCollectionAsync(owned):
+                    batch = {}
+                    await asyncio.to_thread(storeFetched, batch, found, notFound, failedNames)
+                    for cardName in [*found, *notFound]:
+                        cardFlights.resolve(cardName, batch.get(cardName))
+                    for cardName in failedNames:
+                        cardFlights.resolve(cardName, FAILED)
+                    if failed is not None:
+                        failed.update(failedNames)
+                    yield batch
+        finally:
+            cardFlights.release(owned)
+
+        misses = []
+        if waiting:
+            shared = await cardFlights.wait(waiting)
+            if failed is not None:
+                failed.update(cardName for cardName, data in shared.items()
+                              if data is FAILED)
+            yield {cardName: data for cardName, data in shared.items()
+                   if data not in (None, RETRY, FAILED)}
+            # The leader went away before fetching these, fetch them here
+            misses = [cardName for cardName, data in shared.items() if data is RETRY]
+
+
+async def fetchManyAsync(cardnames, failed=None):
+    """
+    Same as fetchMany but resolves the misses without blocking the event loop
+    """
+    results = {}
+    async for chunk in iterManyAsync(cardnames, failed):
+        results.update(chunk)
+    return results
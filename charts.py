@@ -0,0 +1,467 @@
+"""
+Chart rendering for the deck analysis.
+
+Charts are drawn with matplotlib's object-oriented Figure API instead of the
+global pyplot state machine, so several can be rendered at once. The three
+analysis charts are rendered in parallel by a worker pool with a bounded
+number of pending jobs (MTG_CHART_WORKERS / MTG_CHART_QUEUE_SIZE).
+
+Rendered charts are cached by a hash of their input and style, so decks that
+share an aggregate (e.g. the same mana curve) skip matplotlib entirely.
+
+Charts can be rendered as PNG or as SVG, which is much smaller for these
+simple plots.
+
+Rendered images are content addressed: their name is the cache key plus the
+format (e.g. "<sha256>.svg"), so they can be served at a permanent URL with
+immutable caching. Besides the in-memory LRU they're written to a directory
+shared by every worker process on the machine (MTG_CHART_DIR), next to the
+small spec (kind, data, format) each one was drawn from, so an image that was
+pruned or evicted is drawn again when its URL is requested. Specs are kept far
+longer than images (in memory as well, for when there's no chart directory),
+but once one is gone too its URL has expired. Files are written and pruned on
+threads, never on the event loop.
+"""
+import asyncio
+import base64
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import matplotlib
+matplotlib.use('Agg')  # Charts are only ever rendered to buffers
+from matplotlib.figure import Figure
+import numpy as np
+import pandas as pd
+import seaborn as sns
+
+import metrics
+from aggregate import MAX_CURVE_CMC
+from cardcache import LRUCache
+
+
+COLOR_MAP = {
+    'W': '#F9FAF9', 'U': '#ADD8E6', 'B': '#36454F', 'R': '#DC143C', 'G': '#7CFC00',
+    'C': '#A9A9A9'
+}
+
+# Everything that changes how a chart looks for the same input, part of the cache key
+CHART_STYLE = {'theme': 'darkgrid', 'palette': 'pastel', 'dpi': 150}
+
+CHART_FORMATS = ('png', 'svg')
+
+# Chart styling, applied once per process instead of on every request
+sns.set_theme(style=CHART_STYLE['theme'], palette=CHART_STYLE['palette'])
+# Keep SVG text as text instead of paths, which keeps the output small
+matplotlib.rcParams['svg.fonttype'] = 'none'
+# Same input, same bytes: a chart drawn again for its URL matches the original
+matplotlib.rcParams['svg.hashsalt'] = 'mtg-deck-analyzer'
+
+
+CONTENT_TYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+# Names of stored charts: hex content hash and format
+IMAGE_NAME = re.compile(r'^[0-9a-f]{64}\.(png|svg)$')
+
+# Subdirectory of the chart store holding the specs, and how many more specs
+# than images are kept (a spec is a few hundred bytes)
+SPEC_DIR = "specs"
+SPECS_PER_IMAGE = 20
+
+
+def figureToBytes(fig, fmt='png'):
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=fmt, bbox_inches='tight', dpi=CHART_STYLE['dpi'],
+                metadata={'Date': None} if fmt == 'svg' else None)
+    return buffer.getvalue()
+
+
+def draw_color_pie_chart(filteredIDCount):
+    """
+    Draws the color pie chart, returns the Figure (None without data)
+    """
+    if not filteredIDCount:
+        return None
+
+    labels = list(filteredIDCount.keys())
+    sizes = list(filteredIDCount.values())
+    plotColors = [COLOR_MAP.get(label, '#CCCCCC') for label in labels]
+
+    fig = Figure(figsize=(10, 8))
+    ax = fig.subplots()
+    ax.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=90, colors=plotColors,
+           wedgeprops={'edgecolor': 'black', 'linewidth': 0.5},
+           textprops={'fontsize': 12})
+    ax.set_title(
+        'Deck Color Identity Distribution (Per Nonland Card)', fontsize=16)
+    ax.axis('equal')
+
+    return fig
+
+
+def draw_mana_curve_chart(cmcIntDict):
+    """
+    Draws the mana curve chart, returns the Figure (None without data)
+    """
+    if not cmcIntDict:
+        return None
+
+    # Creates new Panda frame from cmcintdict, the top bucket also holds
+    # every higher mana value
+    costs = sorted(cmcIntDict)
+    labels = [f"{cmc}+" if cmc >= MAX_CURVE_CMC else str(cmc) for cmc in costs]
+    manaCurveData = pd.DataFrame({
+        'CMC': pd.Categorical(labels, categories=labels, ordered=True),
+        'Count': [cmcIntDict[cmc] for cmc in costs],
+    })
+
+    fig = Figure(figsize=(12, 6))
+    ax = fig.subplots()
+    sns.barplot(x='CMC', y='Count', data=manaCurveData,
+                palette='coolwarm', edgecolor='black', ax=ax)
+    ax.set_title(
+        'Mana Curve (Converted Mana Cost Distribution of Spells)', fontsize=16)
+    ax.set_xlabel('Converted Mana Cost (CMC)', fontsize=14)
+    ax.set_ylabel('Number of Spells', fontsize=14)
+    ax.tick_params(axis='x', rotation=0)
+    ax.grid(axis='y', linestyle='--', alpha=0.7)
+    fig.tight_layout()
+
+    return fig
+
+
+def draw_color_breakdown_chart(IDPercentage):
+    """
+    Draws the color breakdown chart, returns the Figure (None without data)
+    """
+    if not IDPercentage:
+        return None
+
+    IDPercentagedf = pd.DataFrame([IDPercentage])
+
+    orderedCol = [c for c in ['W', 'U', 'B', 'R',
+                              'G', 'C'] if c in IDPercentagedf.columns]
+    IDPercentagedf = IDPercentagedf[orderedCol]
+
+    currentPlotColors = [COLOR_MAP.get(
+        col, '#CCCCCC') for col in IDPercentagedf.columns]
+
+    fig = Figure(figsize=(10, 4))  # Single stacked bar
+    ax = fig.subplots()
+    IDPercentagedf.plot(
+        kind='barh',
+        stacked=True,
+        ax=ax,
+        color=currentPlotColors,
+        edgecolor='black',
+        linewidth=0.5
+    )
+    ax.set_title(
+        'Color Identity Breakdown (Percentage of Total Identity)', fontsize=16)
+    ax.set_xlabel('Percentage of Deck Color Identity', fontsize=14)
+    ax.set_ylabel('')  # No y-label needed for a single stacked bar
+    ax.set_xticks(np.arange(0, 101, 10))
+    ax.set_xlim(0, 100)
+    ax.legend(title='Color', bbox_to_anchor=(1.05, 1),
+              loc='upper left')  # Move legend outside
+    fig.tight_layout()
+
+    return fig
+
+
+CHART_RENDERERS = {
+    'color': draw_color_pie_chart,
+    'mana_curve': draw_mana_curve_chart,
+    'color_breakdown': draw_color_breakdown_chart,
+}
+
+
+def renderChart(kind, data, fmt='png'):
+    """
+    Worker entry point, renders a single chart by name to image bytes
+
+    Returns (image, {stage: seconds}) since stage timings measured in a
+    worker process have to be reported back to the server process
+    """
+    started = time.perf_counter()
+    fig = CHART_RENDERERS[kind](data)
+    drawn = time.perf_counter()
+    image = figureToBytes(fig, fmt)
+    timings = {
+        f'chart_{kind}_plot': drawn - started,
+        f'chart_{kind}_savefig': time.perf_counter() - drawn,
+    }
+    return image, timings
+
+
+def chartKey(kind, data, fmt='png', style=CHART_STYLE):
+    """
+    Canonical content hash of a chart's input and style
+
+    Items keep their order since the pie chart draws slices in dict order,
+    floats are rounded so tiny percentage differences still share an entry
+    """
+    items = [[str(k), round(v, 6) if isinstance(v, float) else v]
+             for k, v in (data or {}).items()]
+    canonical = json.dumps({'kind': kind, 'data': items, 'format': fmt, 'style': style},
+                           sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def imageName(kind, data, fmt='png'):
+    return f"{chartKey(kind, data, fmt)}.{fmt}"
+
+
+class ChartRenderer:
+    """
+    Renders charts on a pool of worker processes (or threads when workers is 0)
+    with at most `queueSize` jobs pending at once. Images are kept in an LRU
+    bounded to `cacheBytes`, and in `storeDir` (up to `storeFiles` images,
+    and SPECS_PER_IMAGE times as many specs) when one is set. Specs are also
+    kept in memory, SPECS_PER_IMAGE times as many as `cacheEntries`.
+    """
+
+    def __init__(self, workers=3, queueSize=32, cacheBytes=64 * 1024 * 1024,
+                 cacheEntries=4096, storeDir=None, storeFiles=20000):
+        self.workers = workers
+        self.queueSize = queueSize
+        self.cache = LRUCache(cacheEntries, maxBytes=cacheBytes)
+        # gzipped SVGs for clients that accept them
+        self.compressedCache = LRUCache(cacheEntries, maxBytes=cacheBytes // 4)
+        # {image name: (kind, data, format)} of recently drawn charts
+        self.specs = LRUCache(cacheEntries * SPECS_PER_IMAGE)
+        self.storeDir = storeDir
+        self.storeFiles = storeFiles
+        self._writes = 0
+        self._pruning = None
+        self._executor = None
+        self._slots = None
+        if storeDir:
+            os.makedirs(os.path.join(storeDir, SPEC_DIR), exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            workers=int(os.environ.get(
+                "MTG_CHART_WORKERS", min(3, os.cpu_count() or 1))),
+            queueSize=int(os.environ.get("MTG_CHART_QUEUE_SIZE", 32)),
+            cacheBytes=int(os.environ.get(
+                "MTG_CHART_CACHE_BYTES", 64 * 1024 * 1024)),
+            # Empty to keep charts in memory only
+            storeDir=os.environ.get(
+                "MTG_CHART_DIR", os.path.join(tempfile.gettempdir(), "mtg-charts")),
+            storeFiles=int(os.environ.get("MTG_CHART_DIR_MAX_FILES", 20000)),
+        )
+
+    @staticmethod
+    def _write(path, data):
+        tmpPath = f"{path}.{os.getpid()}.tmp"
+        with open(tmpPath, 'wb') as outFile:
+            outFile.write(data)
+        os.replace(tmpPath, path)
+
+    def _specPath(self, name):
+        return os.path.join(self.storeDir, SPEC_DIR, f"{name}.json")
+
+    def _store(self, name, image, kind, data, fmt):
+        """
+        Writes an image and its spec to the chart directory, run on a thread
+        """
+        self._write(os.path.join(self.storeDir, name), image)
+        spec = {'kind': kind, 'format': fmt, 'data': [[k, v] for k, v in data.items()]}
+        self._write(self._specPath(name), json.dumps(spec).encode())
+
+    def _pruneStore(self):
+        self._prune(self.storeDir, self.storeFiles)
+        self._prune(os.path.join(self.storeDir, SPEC_DIR), self.storeFiles * SPECS_PER_IMAGE)
+
+    async def store(self, name, image, kind, data, fmt):
+        self.specs.put(name, (kind, data, fmt))
+        if not self.storeDir:
+            return
+        await asyncio.to_thread(self._store, name, image, kind, data, fmt)
+
+        # Every so often drop the least recently written files over the limit,
+        # in the background since it lists the whole directory
+        self._writes += 1
+        if self._writes % 256 == 0 and (self._pruning is None or self._pruning.done()):
+            self._pruning = asyncio.ensure_future(asyncio.to_thread(self._pruneStore))
+
+    @staticmethod
+    def _prune(directory, maxFiles):
+        entries = []
+        for entry in os.scandir(directory):
+            try:
+                if entry.is_file():
+                    entries.append((entry.stat().st_mtime, entry.path))
+            except OSError:
+                continue
+        if len(entries) <= maxFiles:
+            return
+        entries.sort()
+        for _, path in entries[:len(entries) - maxFiles]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def load(self, name):
+        """
+        Image bytes for a stored chart name, or None if it isn't known
+        """
+        if not IMAGE_NAME.match(name):
+            return None
+        image = self.cache.get(name)
+        if image is None and self.storeDir:
+            try:
+                with open(os.path.join(self.storeDir, name), 'rb') as imageFile:
+                    image = imageFile.read()
+            except OSError:
+                return None
+            self.cache.put(name, image)
+        return image
+
+    def loadSpec(self, name):
+        """
+        (kind, data, format) a stored chart was drawn from, or None
+        """
+        spec = self.specs.get(name)
+        if spec is not None:
+            return spec
+        if not self.storeDir or not IMAGE_NAME.match(name):
+            return None
+        try:
+            with open(self._specPath(name), 'rb') as specFile:
+                spec = json.load(specFile)
+        except (OSError, ValueError):
+            return None
+        return spec['kind'], {k: v for k, v in spec['data']}, spec['format']
+
+    async def loadAsync(self, name):
+        """
+        Same as load, reading the chart directory on a thread
+        """
+        image = self.cache.get(name)
+        if image is None and self.storeDir:
+            image = await asyncio.to_thread(self.load, name)
+        return image
+
+    async def expired(self, names):
+        """
+        The chart names that can neither be served nor drawn again
+        """
+        unknown = [name for name in names
+                   if name not in self.cache and name not in self.specs]
+        if unknown and self.storeDir:
+            unknown = await asyncio.to_thread(
+                lambda: [name for name in unknown
+                         if not os.path.exists(self._specPath(name))])
+        return unknown
+
+    async def loadOrRender(self, name):
+        """
+        Image bytes for a chart name, drawn again from its spec when the image
+        was pruned or evicted. None when neither is known (the URL expired)
+        """
+        image = await self.loadAsync(name)
+        if image is not None:
+            return image
+        spec = self.specs.get(name)
+        if spec is None and self.storeDir:
+            spec = await asyncio.to_thread(self.loadSpec, name)
+        if spec is None:
+            return None
+        renderedName, image = await self.renderImage(*spec)
+        # With a different chart style it's no longer the image the URL named
+        return image if renderedName == name else None
+
+    def compress(self, name, image):
+        """
+        gzipped bytes of a chart image, cached by name
+        """
+        compressed = self.compressedCache.get(name)
+        if compressed is None:
+            compressed = gzip.compress(image)
+            self.compressedCache.put(name, compressed)
+        return compressed
+
+    def _getExecutor(self):
+        if self._executor is None:
+            if self.workers > 0:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=3)
+        return self._executor
+
+    async def renderImage(self, kind, data, fmt='png'):
+        """
+        Renders (or finds) a chart, returns (image name, image bytes), or
+        ("", b"") when there's nothing to draw
+        """
+        if not data:
+            return "", b""
+        name = imageName(kind, data, fmt)
+        image = await self.loadAsync(name)
+        if image is not None:
+            return name, image
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.queueSize)
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            image, timings = await loop.run_in_executor(
+                self._getExecutor(), renderChart, kind, data, fmt)
+        for stageName, seconds in timings.items():
+            metrics.record(stageName, seconds)
+        self.cache.put(name, image)
+        await self.store(name, image, kind, data, fmt)
+        return name, image
+
+    async def render(self, kind, data, fmt='png', inline=True):
+        """
+        Renders a chart, returns it base64 encoded, or its image name when
+        not inline
+        """
+        name, image = await self.renderImage(kind, data, fmt)
+        if not inline:
+            return name
+        with metrics.stage(f'chart_{kind}_base64'):
+            return base64.b64encode(image).decode()
+
+    async def renderAll(self, jobs, fmt='png', inline=True):
+        """
+        Renders a {kind: data} dict of charts in parallel, returns {kind: base64}
+        (or {kind: image name} when not inline)
+
+        fmt 'none' skips rendering and returns empty strings
+        """
+        if fmt == 'none':
+            return {kind: "" for kind in jobs}
+        return {kind: image async for kind, image in self.iterRender(jobs, fmt, inline)}
+
+    async def iterRender(self, jobs, fmt='png', inline=True):
+        """
+        Renders a {kind: data} dict of charts in parallel, yielding
+        (kind, base64 or image name) pairs in the order they finish
+        """
+        async def renderKind(kind):
+            return kind, await self.render(kind, jobs[kind], fmt, inline)
+
+        tasks = [asyncio.ensure_future(renderKind(kind)) for kind in jobs]
+        try:
+            for nextChart in asyncio.as_completed(tasks):
+                yield await nextChart
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
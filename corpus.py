@@ -0,0 +1,440 @@
+"""
+Offline analysis of a whole corpus of decklists.
+
+Takes a directory (searched recursively) or a .zip / .tar(.gz) archive of deck
+files and writes one row of aggregates per deck as columnar part files:
+
+    python corpus.py archive/decks/ --output corpus_out
+    python corpus.py decks.zip --output corpus_out --workers 8 --charts svg
+
+Decks are processed in chunks. Worker processes parse each chunk, the main
+process resolves the chunk's card names that haven't been seen yet through the
+server's lookup layer (offline index, card cache, then batched Scryfall requests
+under the shared rate limit), and the workers aggregate the decks with the same
+vectorized code as /analyze-decks. Every finished chunk is written as its own
+part file and recorded in a checkpoint, so an interrupted run picks up where it
+stopped when started again with the same arguments. Chunks with card names that
+couldn't be fetched (Scryfall unreachable) are written but not recorded, so the
+next run does them again.
+
+Part files are Parquet when pyarrow is installed, CSV otherwise.
+"""
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import tarfile
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+import aggregate
+import drawodds
+import manabase
+from cardcache import normalizeCardName
+from decklist import parseDecklist
+
+try:
+    import pyarrow  # noqa: F401, only needed by pandas for Parquet
+    PART_FORMAT = 'parquet'
+except ImportError:
+    PART_FORMAT = 'csv'
+
+
+DECK_PATTERNS = ('*.txt', '*.dec', '*.dck')
+CHUNK_SIZE = 500
+# Mana curve columns: curve_0 .. curve_6, then everything from 7 up
+CURVE_COLUMNS = 7
+CHECKPOINT_FILE = "checkpoint.json"
+# Further attempts at names Scryfall couldn't be reached for, and the pause
+# before each
+RESOLVE_RETRIES = 2
+RESOLVE_RETRY_PAUSE = 5.0
+
+# Fields of a resolved card the workers need
+CARD_FIELDS = ('name', 'type_line', 'cmc', 'mana_cost', 'color_identity',
+               'produced_mana', 'color_mask', 'is_land')
+
+
+def isDeckFile(name, patterns=DECK_PATTERNS):
+    baseName = os.path.basename(name)
+    return any(fnmatch.fnmatch(baseName.lower(), pattern) for pattern in patterns)
+
+
+def listDecks(source, patterns=DECK_PATTERNS):
+    """
+    Deck ids (paths relative to the directory, or archive member names),
+    sorted, except for tar archives where they're kept in archive order
+    """
+    if os.path.isdir(source):
+        found = []
+        for root, _, files in os.walk(source):
+            for fileName in files:
+                if isDeckFile(fileName, patterns):
+                    found.append(os.path.relpath(os.path.join(root, fileName), source))
+        return sorted(found)
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            return sorted(info.filename for info in archive.infolist()
+                          if not info.is_dir() and isDeckFile(info.filename, patterns))
+    if tarfile.is_tarfile(source):
+        with tarfile.open(source) as archive:
+            return [member.name for member in archive.getmembers()
+                    if member.isfile() and isDeckFile(member.name, patterns)]
+    raise ValueError(f"{source} is not a directory, zip or tar archive")
+
+
+def readTexts(source, deckIds):
+    """
+    {deck id: text} for a chunk of decks from a directory or zip archive
+    """
+    def decode(data):
+        return data.decode('utf-8-sig', errors='replace')
+
+    if os.path.isdir(source):
+        texts = {}
+        for deckId in deckIds:
+            with open(os.path.join(source, deckId), 'rb') as deckFile:
+                texts[deckId] = decode(deckFile.read())
+        return texts
+    with zipfile.ZipFile(source) as archive:
+        return {deckId: decode(archive.read(deckId)) for deckId in deckIds}
+
+
+def iterTarTexts(source, chunks, wanted):
+    """
+    Yields {deck id: text} for each wanted chunk number of a tar archive, in
+    order, reading the archive in one sequential pass since compressed tars
+    can't be read at random (the chunks follow the archive order)
+    """
+    number = 0
+    position = 0
+    texts = {}
+    with tarfile.open(source) as archive:
+        for member in archive:
+            if number >= len(chunks):
+                break
+            if member.name != chunks[number][position]:
+                continue
+            if number in wanted:
+                texts[member.name] = archive.extractfile(member).read().decode(
+                    'utf-8-sig', errors='replace')
+            position += 1
+            if position == len(chunks[number]):
+                if number in wanted:
+                    yield texts
+                number += 1
+                position = 0
+                texts = {}
+
+
+def parseChunk(source, deckIds, texts=None):
+    """
+    Worker: reads and parses a chunk of decks, returns [(deck id, entries)]
+    """
+    if texts is None:
+        texts = readTexts(source, deckIds)
+    return [(deckId, parseDecklist(texts[deckId])) for deckId in deckIds]
+
+
+def aggregateChunk(parsed, cards, chartFormat=None, chartDir=None):
+    """
+    Worker: per-deck aggregates for a parsed chunk, as {column: values}
+
+    cards maps normalized names to resolved card data; names missing from it
+    are counted as skipped
+    """
+    decks = []
+    skipped = []
+    for _, entries in parsed:
+        deckCards = []
+        missing = 0
+        for cardName, quantity in entries:
+            data = cards.get(normalizeCardName(cardName))
+            if data:
+                deckCards.append(dict(data, quantity=quantity))
+            else:
+                missing += 1
+        decks.append(deckCards)
+        skipped.append(missing)
+
+    arrays = aggregate.DeckArrays.fromDecks(decks)
+    colorMatrix = aggregate.colorIdentityMatrix(arrays)
+    curveMatrix = aggregate.manaCurveMatrix(arrays)
+    if curveMatrix.shape[1] > CURVE_COLUMNS:
+        curveMatrix = np.concatenate(
+            [curveMatrix[:, :CURVE_COLUMNS],
+             curveMatrix[:, CURVE_COLUMNS:].sum(axis=1, keepdims=True)], axis=1)
+    else:
+        curveMatrix = np.pad(curveMatrix, ((0, 0), (0, CURVE_COLUMNS + 1 - curveMatrix.shape[1])))
+
+    numDecks = len(decks)
+    deckSize = np.bincount(arrays.deckIndex, weights=arrays.quantity, minlength=numDecks)
+    lands = np.bincount(arrays.deckIndex, weights=arrays.quantity * arrays.isLand,
+                        minlength=numDecks)
+    spells = ~arrays.isLand & ~np.isnan(arrays.cmc)
+    spellCount = np.bincount(arrays.deckIndex[spells], weights=arrays.quantity[spells],
+                             minlength=numDecks)
+    spellCmc = np.bincount(arrays.deckIndex[spells],
+                           weights=(arrays.quantity * np.nan_to_num(arrays.cmc))[spells],
+                           minlength=numDecks)
+
+    columns = {
+        'deck': [deckId for deckId, _ in parsed],
+        'cards': deckSize.astype(np.int64),
+        'unique_cards': np.array([len(deckCards) for deckCards in decks], dtype=np.int64),
+        'skipped': np.array(skipped, dtype=np.int64),
+        'lands': lands.astype(np.int64),
+        'average_cmc': np.divide(spellCmc, spellCount, out=np.full(numDecks, np.nan),
+                                 where=spellCount > 0),
+    }
+    for position, color in enumerate(aggregate.COLORS):
+        columns[f'color_{color}'] = colorMatrix[:, position]
+    for cmc in range(CURVE_COLUMNS):
+        columns[f'curve_{cmc}'] = curveMatrix[:, cmc]
+    columns[f'curve_{CURVE_COLUMNS}_plus'] = curveMatrix[:, CURVE_COLUMNS]
+
+    # Exact draw odds and the mana base check, which are per deck
+    keepable = np.full(numDecks, np.nan)
+    landDrop4 = np.full(numDecks, np.nan)
+    worstOnCurve = np.full(numDecks, np.nan)
+    for index, deckCards in enumerate(decks):
+        size, landCount = int(deckSize[index]), int(lands[index])
+        if size >= drawodds.OPENING_HAND + drawodds.MAX_TURN:
+            odds = drawodds.exactOdds(size, landCount)
+            keepable[index] = odds['keepable_hand']
+            landDrop4[index] = odds['land_drops']['on_the_play'][4]
+        manaBase = manabase.analyzeManaBase(deckCards) if deckCards else None
+        if manaBase and manaBase['spells']:
+            worstOnCurve[index] = manaBase['spells'][0]['on_curve']
+    columns['keepable_hand'] = keepable
+    columns['land_drop_turn_4'] = landDrop4
+    columns['worst_on_curve'] = worstOnCurve
+
+    if chartFormat:
+        columns.update(renderCharts(decks, colorMatrix, curveMatrix, chartFormat, chartDir))
+    return columns
+
+
+def renderCharts(decks, colorMatrix, curveMatrix, chartFormat, chartDir):
+    """
+    Renders each deck's charts into chartDir, returns their file names as
+    {column: values}. Files already there (same content hash) are reused
+    """
+    # The plotting stack is only imported when charts are asked for
+    import charts
+
+    columns = {f'{kind}_chart': [] for kind in charts.CHART_RENDERERS}
+    for index in range(len(decks)):
+        filteredIDCount = aggregate.colorCountsDict(colorMatrix[index])
+        chartData = {
+            'color': filteredIDCount,
+            'mana_curve': aggregate.manaCurveDict(curveMatrix[index]),
+            'color_breakdown': aggregate.colorPercentages(filteredIDCount),
+        }
+        for kind, data in chartData.items():
+            name = charts.imageName(kind, data, chartFormat) if data else ""
+            if name and not os.path.exists(os.path.join(chartDir, name)):
+                image, _ = charts.renderChart(kind, data, chartFormat)
+                tmpPath = os.path.join(chartDir, f"{name}.{os.getpid()}.tmp")
+                with open(tmpPath, 'wb') as imageFile:
+                    imageFile.write(image)
+                os.replace(tmpPath, os.path.join(chartDir, name))
+            columns[f'{kind}_chart'].append(name)
+    return columns
+
+
+def resolveNames(names, cards, failed=None):
+    """
+    Resolves the names not in `cards` yet through the lookup layer shared with
+    the server (cardlookup.py) and adds them (None for names that weren't found)
+
+    Names Scryfall couldn't be reached for are left out of `cards`, so they're
+    asked for again, and added to `failed` when it's given
+    """
+    # Imported here so worker processes don't open the card cache and index
+    from cardlookup import fetchMany
+
+    unknown = [name for name in names if name not in cards]
+    if not unknown:
+        return 0
+    unreachable = set()
+    resolved = fetchMany(unknown, unreachable)
+    for name in unknown:
+        if name in unreachable:
+            continue
+        data = resolved.get(name)
+        cards[name] = {field: data[field] for field in CARD_FIELDS if field in data} \
+            if data else None
+    if failed is not None:
+        failed.update(unreachable)
+    return len(unknown)
+
+
+def writePart(columns, path):
+    import pandas as pd
+
+    frame = pd.DataFrame(columns)
+    tmpPath = f"{path}.tmp"
+    if PART_FORMAT == 'parquet':
+        frame.to_parquet(tmpPath, index=False)
+    else:
+        frame.to_csv(tmpPath, index=False)
+    os.replace(tmpPath, path)
+
+
+class Checkpoint:
+    """
+    Which chunks of a run are written, saved next to the part files
+    """
+
+    def __init__(self, path, run):
+        self.path = path
+        self.run = run
+        self.completed = set()
+
+    @classmethod
+    def load(cls, path, run):
+        checkpoint = cls(path, run)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as checkpointFile:
+                saved = json.load(checkpointFile)
+            if saved['run'] != run:
+                raise ValueError(
+                    f"{path} belongs to a different run (source, deck list or chunk "
+                    "size changed); use another --output or pass --restart")
+            checkpoint.completed = set(saved['completed'])
+        return checkpoint
+
+    def save(self):
+        tmpPath = f"{self.path}.tmp"
+        with open(tmpPath, 'w', encoding='utf-8') as checkpointFile:
+            json.dump({'run': self.run, 'completed': sorted(self.completed)}, checkpointFile)
+        os.replace(tmpPath, self.path)
+
+
+def analyzeCorpus(source, output, workers=None, chunkSize=CHUNK_SIZE,
+                  chartFormat=None, restart=False, patterns=DECK_PATTERNS):
+    """
+    Analyzes every deck file under `source` into part files in `output`,
+    skipping chunks a previous run already wrote. Returns the number of
+    decks analyzed by this run
+    """
+    deckIds = listDecks(source, patterns)
+    chunks = [deckIds[start:start + chunkSize]
+              for start in range(0, len(deckIds), chunkSize)]
+    os.makedirs(output, exist_ok=True)
+    chartDir = os.path.join(output, "charts") if chartFormat else None
+    if chartDir:
+        os.makedirs(chartDir, exist_ok=True)
+
+    run = {'source': os.path.abspath(source), 'decks': len(deckIds),
+           'deck_list': hashlib.sha256("\n".join(deckIds).encode()).hexdigest(),
+           'chunk_size': chunkSize, 'charts': chartFormat}
+    checkpointPath = os.path.join(output, CHECKPOINT_FILE)
+    if restart and os.path.exists(checkpointPath):
+        os.remove(checkpointPath)
+    checkpoint = Checkpoint.load(checkpointPath, run)
+    pending = [number for number in range(len(chunks)) if number not in checkpoint.completed]
+    print(f"{len(deckIds)} decks in {len(chunks)} chunks, {len(pending)} to do")
+
+    isTar = not os.path.isdir(source) and not zipfile.is_zipfile(source)
+    tarTexts = iterTarTexts(source, chunks, set(pending)) if isTar else None
+    workers = workers or os.cpu_count() or 1
+    cards = {}
+    # Names still failing after the retries, and the chunks left out of the
+    # checkpoint because of them
+    failedNames = set()
+    incomplete = []
+    started = time.perf_counter()
+    analyzed = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Parsing runs ahead on the pool while earlier chunks are resolved
+        def submitParse(number):
+            texts = next(tarTexts) if isTar else None
+            return executor.submit(parseChunk, source, chunks[number], texts)
+
+        lookahead = max(2, workers)
+        parsing = {number: submitParse(number) for number in pending[:lookahead]}
+        queued = pending[lookahead:]
+        aggregating = {}
+
+        for number in pending:
+            parsed = parsing.pop(number).result()
+            if queued:
+                nextNumber = queued.pop(0)
+                parsing[nextNumber] = submitParse(nextNumber)
+
+            names = list(dict.fromkeys(normalizeCardName(cardName)
+                                       for _, entries in parsed
+                                       for cardName, _ in entries))
+            failed = set()
+            fetched = resolveNames(names, cards, failed)
+            for _ in range(RESOLVE_RETRIES):
+                if not failed:
+                    break
+                time.sleep(RESOLVE_RETRY_PAUSE)
+                failed = set()
+                resolveNames(names, cards, failed)
+            failedNames |= failed
+            chunkCards = {name: cards[name] for name in names if cards.get(name)}
+            future = executor.submit(aggregateChunk, parsed, chunkCards, chartFormat, chartDir)
+            aggregating[future] = (number, len(parsed), fetched, bool(failed))
+
+            # Write finished chunks as they come, keeping a bounded backlog
+            while aggregating and (len(aggregating) >= lookahead or number == pending[-1]):
+                done, _ = wait(aggregating, return_when=FIRST_COMPLETED)
+                for finished in done:
+                    doneNumber, deckCount, fetchedCount, partial = aggregating.pop(finished)
+                    writePart(finished.result(), os.path.join(
+                        output, f"part-{doneNumber:05d}.{PART_FORMAT}"))
+                    if partial:
+                        incomplete.append(doneNumber)
+                    else:
+                        checkpoint.completed.add(doneNumber)
+                        checkpoint.save()
+                    analyzed += deckCount
+                    print(f"Chunk {doneNumber + 1}/{len(chunks)}: {deckCount} decks, "
+                          f"{fetchedCount} new card names "
+                          f"({analyzed / (time.perf_counter() - started):.0f} decks/s)")
+
+    if incomplete:
+        print(f"{len(failedNames)} card names couldn't be fetched from Scryfall "
+              f"({', '.join(sorted(failedNames)[:10])}), so {len(incomplete)} chunks miss "
+              f"them; run the same command again to redo those chunks")
+    return analyzed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Analyze a directory or archive of decklists into columnar files")
+    parser.add_argument("source", help="directory, .zip or .tar(.gz) of deck files")
+    parser.add_argument("--output", default="corpus_output",
+                        help="directory for the part files and the checkpoint")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes (default: one per core)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="decks per chunk / part file")
+    parser.add_argument("--charts", choices=['png', 'svg'], default=None,
+                        help="also render each deck's charts into <output>/charts")
+    parser.add_argument("--pattern", action='append', default=None,
+                        help="deck file name pattern (default *.txt, *.dec, *.dck)")
+    parser.add_argument("--restart", action='store_true',
+                        help="ignore the checkpoint and analyze everything again")
+    args = parser.parse_args()
+
+    try:
+        analyzed = analyzeCorpus(args.source, args.output, workers=args.workers,
+                                 chunkSize=args.chunk_size, chartFormat=args.charts,
+                                 restart=args.restart,
+                                 patterns=tuple(args.pattern or DECK_PATTERNS))
+    except ValueError as e:
+        parser.exit(1, f"{e}\n")
+    print(f"Analyzed {analyzed} decks into {args.output} ({PART_FORMAT} parts)")
+
+
+if __name__ == "__main__":
+    main()
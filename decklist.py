@@ -0,0 +1,245 @@
+"""
+Decklist text parsing and normalization.
+
+Understands plain "4 Card Name" lists as well as the common export formats:
+MTGA/MTGO style section headers (Deck, Sideboard (15), 15 Sideboard, ...),
+"4x" quantities, set codes and collector numbers ("(M21) 123"), foil markers,
+"SB:" sideboard lines and // or # comments. MTGO .txt exports have no headers
+and put the sideboard after a blank line, so in a list without headers made of
+a complete main deck and one more small block, that block is the sideboard.
+Only the cards of the deck itself (the main deck and the commander) are
+analyzed, with duplicate lines merged.
+"""
+import codecs
+import hashlib
+import os
+import re
+
+
+# No imports from the rest of the repository: this file is copied as is into
+# the serverless API (mtg-deck-analyzer/api/_decklist.py)
+
+# Largest decklist upload accepted, and how much of it is read at a time
+MAX_UPLOAD_BYTES = int(os.environ.get("MTG_MAX_UPLOAD_BYTES", 1024 * 1024))
+UPLOAD_CHUNK_BYTES = 64 * 1024
+
+# Longer lines can't be card names (the longest real one is ~140 characters)
+MAX_NAME_LENGTH = 200
+
+# Largest deck analyzed, the draw odds and mana base tables grow with its size
+MAX_DECK_CARDS = int(os.environ.get("MTG_MAX_DECK_CARDS", 250))
+
+SECTIONS = {
+    'deck': 'deck', 'main': 'deck', 'mainboard': 'deck', 'main deck': 'deck',
+    'commander': 'commander', 'commanders': 'commander',
+    'companion': 'companion',
+    'sideboard': 'sideboard',
+    'maybeboard': 'maybeboard', 'considering': 'maybeboard',
+    # MTGA exports start with an About section holding the deck's name
+    'about': 'about',
+}
+# Sections whose cards are part of the analyzed deck
+DECK_SECTIONS = ('deck', 'commander')
+
+# MTGO .txt exports: main decks of 40 (limited) or 60+ cards, sideboards of up
+# to 15, except a 100 card Commander deck's last one or two cards (its commanders)
+LIMITED_DECK = 40
+CONSTRUCTED_DECK = 60
+MAX_SIDEBOARD = 15
+COMMANDER_DECK = 100
+
+_SECTION = re.compile(r'^(?:\d+\s+)?([a-z ]+?)\s*(?:\(\d+\))?\s*:?$', re.IGNORECASE)
+_SIDEBOARD_PREFIX = re.compile(r'^SB:\s*', re.IGNORECASE)
+_QUANTITY = re.compile(r'^(\d+)\s*[xX]?\s+(.*)$')
+# Trailing printing details: "(M21) 123", "[M21]", "*F*"
+_PRINTING = re.compile(r'(?:\s+(?:\*[A-Z]+\*|[(\[][A-Za-z0-9]{2,6}[)\]](?:\s+[\w-]+)?))+$')
+_HAS_LETTER = re.compile(r'[^\W\d_]')
+
+
+def normalizeCardName(cardname):
+    """
+    Normalizes a card name so different spellings of the same lookup share a key
+    """
+    return " ".join(cardname.split()).casefold()
+
+
+class DecklistTooLarge(ValueError):
+    """
+    Raised when an upload goes over MAX_UPLOAD_BYTES
+    """
+
+    def __init__(self, maxBytes):
+        super().__init__(f"Decklist is larger than {maxBytes} bytes")
+        self.maxBytes = maxBytes
+
+
+class DecklistParser:
+    """
+    Incremental decklist parser: feed() it text as it arrives (lines may be
+    split across chunks), close() it, then read the merged entries()
+    """
+
+    def __init__(self):
+        self.section = 'deck'
+        # {(section, normalized name): [first spelling, total quantity]}
+        self.cards = {}
+        self.ignored = 0
+        self.sawHeader = False
+        # Blank line separated blocks of a list without headers, as
+        # {normalized name: [first spelling, quantity]}
+        self.blocks = [{}]
+        self._partial = ''
+
+    def feed(self, text):
+        lines = (self._partial + text).split('\n')
+        self._partial = lines.pop()
+        for line in lines:
+            self.parseLine(line)
+        return self
+
+    def close(self):
+        if self._partial:
+            self.parseLine(self._partial)
+            self._partial = ''
+        if self.trailingSideboard():
+            for key, (cardName, quantity) in self.blocks[-1].items():
+                entry = self.cards[('deck', key)]
+                entry[1] -= quantity
+                if entry[1] == 0:
+                    del self.cards[('deck', key)]
+                self.cards.setdefault(('sideboard', key), [cardName, 0])[1] += quantity
+            self.blocks = [{}]
+        return self
+
+    def trailingSideboard(self):
+        """
+        Whether the last block of a list without headers is an MTGO style
+        sideboard: the list is two blocks, the first a complete main deck
+        """
+        blocks = [block for block in self.blocks if block]
+        if self.sawHeader or len(blocks) != 2:
+            return False
+        main, trailing = (sum(quantity for _, quantity in block.values())
+                          for block in blocks)
+        if main + trailing == COMMANDER_DECK and trailing <= 2:
+            return False
+        return ((main == LIMITED_DECK or main >= CONSTRUCTED_DECK)
+                and trailing <= MAX_SIDEBOARD)
+
+    def parseLine(self, line):
+        line = line.strip()
+        if not line:
+            if self.blocks[-1]:
+                self.blocks.append({})
+            return
+        if line.startswith('//') or line.startswith('#'):
+            return
+
+        header = _SECTION.match(line)
+        if header and header.group(1).lower() in SECTIONS:
+            self.section = SECTIONS[header.group(1).lower()]
+            self.sawHeader = True
+            return
+        if self.section == 'about':
+            return
+
+        section = self.section
+        sideboard = _SIDEBOARD_PREFIX.match(line)
+        if sideboard:
+            section = 'sideboard'
+            line = line[sideboard.end():]
+
+        match = _QUANTITY.match(line)
+        if match:
+            quantity = int(match.group(1))
+            cardName = match.group(2)
+        else:
+            quantity = 1
+            cardName = line
+        cardName = _PRINTING.sub('', cardName.strip()).strip()
+
+        if (quantity <= 0 or len(cardName) > MAX_NAME_LENGTH
+                or not _HAS_LETTER.search(cardName)):
+            self.ignored += 1
+            return
+
+        key = normalizeCardName(cardName)
+        self.cards.setdefault((section, key), [cardName, 0])[1] += quantity
+        if section == 'deck' and not self.sawHeader:
+            self.blocks[-1].setdefault(key, [cardName, 0])[1] += quantity
+
+    def entries(self, sections=DECK_SECTIONS):
+        """
+        (cardName, quantity) pairs of the given sections in the order they
+        first appear, with repeated names merged
+        """
+        merged = {}
+        for (section, key), (cardName, quantity) in self.cards.items():
+            if section in sections:
+                merged.setdefault(key, [cardName, 0])[1] += quantity
+        return [(cardName, quantity) for cardName, quantity in merged.values()]
+
+
+def parseDecklist(decklist_text):
+    """
+    Splits decklist text into (cardName, quantity) pairs, one per distinct
+    card of the deck
+    """
+    return DecklistParser().feed(decklist_text).close().entries()
+
+
+async def parseUpload(upload, maxBytes=MAX_UPLOAD_BYTES, chunkSize=UPLOAD_CHUNK_BYTES):
+    """
+    Parses an uploaded decklist file as it's read, without holding the raw
+    upload in memory. Raises DecklistTooLarge past maxBytes
+    """
+    parser = DecklistParser()
+    decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+    received = 0
+    while True:
+        chunk = await upload.read(chunkSize)
+        if not chunk:
+            break
+        received += len(chunk)
+        if received > maxBytes:
+            raise DecklistTooLarge(maxBytes)
+        parser.feed(decoder.decode(chunk))
+    parser.feed(decoder.decode(b'', final=True))
+    return parser.close()
+
+
+def deckSize(entries):
+    """
+    Number of cards in parsed entries, counting every copy
+    """
+    return sum(quantity for _, quantity in entries)
+
+
+def formatDecklist(entries):
+    """
+    Decklist text for parsed entries, one "quantity name" line per card
+    """
+    return "\n".join(f"{quantity} {cardName}" for cardName, quantity in entries)
+
+
+def normalizeDecklist(entries):
+    """
+    Canonical form of a parsed decklist: duplicate names merged (case and
+    whitespace insensitive) and sorted by name
+    """
+    merged = {}
+    for cardName, quantity in entries:
+        key = normalizeCardName(cardName)
+        merged[key] = merged.get(key, 0) + quantity
+    return sorted(merged.items())
+
+
+def decklistKey(entries, *options):
+    """
+    Content hash of a normalized decklist plus any options that change the
+    analysis (e.g. the chart format)
+    """
+    canonical = "\n".join(f"{quantity} {name}"
+                          for name, quantity in normalizeDecklist(entries))
+    canonical += "\n#" + "|".join(str(option) for option in options)
+    return hashlib.sha256(canonical.encode()).hexdigest()
@@ -0,0 +1,143 @@
+"""
+Typo-tolerant card name lookup.
+
+Every known card name (including split and double-faced card face names) is
+broken into character trigrams and kept in an inverted index of NumPy arrays.
+A query is scored against all names sharing a trigram with a single bincount,
+so misspelled or partial names resolve locally without another round trip.
+"""
+import os
+import threading
+
+import numpy as np
+
+from cardcache import normalizeCardName
+
+
+def trigrams(text):
+    """
+    Character trigrams of a normalized name, padded so word starts weigh more
+    """
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FuzzyIndex:
+    """
+    Trigram index over card names
+
+    Names can be added at any time; the NumPy postings are rebuilt lazily on
+    the next search after new names arrive.
+    """
+
+    def __init__(self, minScore=0.4, autoScore=0.75, margin=0.1):
+        self.minScore = minScore
+        self.autoScore = autoScore
+        self.margin = margin
+        self.keys = []
+        self.names = []
+        self._keyIds = {}
+        self._pending = {}
+        self._sizes = []
+        self._postings = {}
+        self._sizeArray = np.zeros(0, dtype=np.int32)
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            minScore=float(os.environ.get("MTG_FUZZY_MIN_SCORE", 0.4)),
+            autoScore=float(os.environ.get("MTG_FUZZY_AUTO_SCORE", 0.75)),
+        )
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, name, key=None):
+        """
+        Indexes a lookup key (defaults to the normalized name) for a display name
+        """
+        key = key or normalizeCardName(name)
+        with self._lock:
+            if key in self._keyIds:
+                return
+            keyId = len(self.keys)
+            self._keyIds[key] = keyId
+            self.keys.append(key)
+            self.names.append(name)
+            grams = trigrams(key)
+            self._sizes.append(len(grams))
+            for gram in grams:
+                self._pending.setdefault(gram, []).append(keyId)
+            self._dirty = True
+
+    def _compile(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            for gram, ids in self._pending.items():
+                ids = np.asarray(ids, dtype=np.int32)
+                existing = self._postings.get(gram)
+                self._postings[gram] = ids if existing is None else np.concatenate(
+                    [existing, ids])
+            self._pending = {}
+            self._sizeArray = np.asarray(self._sizes, dtype=np.int32)
+            self._dirty = False
+
+    def search(self, query, limit=5):
+        """
+        Returns up to `limit` (name, key, score) matches, best first
+
+        The score is the Dice coefficient of the trigram sets, or for partial
+        names (the query's trigrams mostly contained in a longer name) a
+        slightly discounted containment ratio, whichever is higher
+        """
+        self._compile()
+        grams = trigrams(normalizeCardName(query))
+        postings = [self._postings[gram] for gram in grams if gram in self._postings]
+        if not postings:
+            return []
+
+        common = np.bincount(np.concatenate(postings), minlength=len(self._sizeArray))
+        candidates = np.nonzero(common)[0]
+        shared = common[candidates]
+        dice = 2.0 * shared / (len(grams) + self._sizeArray[candidates])
+        containment = shared / len(grams)
+        scores = np.maximum(dice, 0.9 * containment)
+
+        order = np.argsort(-scores, kind='stable')
+        matches = []
+        seenNames = set()
+        for position in order:
+            score = float(scores[position])
+            if score < self.minScore:
+                break
+            keyId = int(candidates[position])
+            name = self.names[keyId]
+            # Face names point at the same card as the full name, only list it once
+            if name in seenNames:
+                continue
+            seenNames.add(name)
+            matches.append((name, self.keys[keyId], score))
+            if len(matches) == limit:
+                break
+        return matches
+
+    def suggest(self, query, limit=5):
+        """
+        Likely card names for a name that couldn't be resolved
+        """
+        return [name for name, _, _ in self.search(query, limit)]
+
+    def correct(self, query):
+        """
+        Returns the lookup key of the card `query` almost certainly meant, or
+        None when there's no confident, unambiguous match
+        """
+        matches = self.search(query, limit=2)
+        if not matches or matches[0][2] < self.autoScore:
+            return None
+        if len(matches) > 1 and matches[0][2] - matches[1][2] < self.margin:
+            return None
+        return matches[0][1]
@@ -0,0 +1,152 @@
+"""
+Background analysis jobs.
+
+Jobs go into a bounded queue served by a fixed number of worker tasks, so a
+burst of submissions can't pile up unbounded work. When the queue is full the
+submission is rejected straight away and the caller is told when to retry.
+Finished results are kept for a while so clients can poll (or long-poll) them.
+"""
+import asyncio
+import math
+import os
+import time
+import uuid
+
+
+class QueueFull(Exception):
+    """
+    Raised by JobQueue.submit when no more jobs can be accepted right now
+    """
+
+    def __init__(self, retryAfter):
+        super().__init__("Job queue is full")
+        self.retryAfter = retryAfter
+
+
+class Job:
+    def __init__(self, work):
+        self.id = uuid.uuid4().hex
+        self.work = work
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.errorStatus = None
+        self.createdAt = time.time()
+        self.finishedAt = None
+        self.done = asyncio.Event()
+
+
+class JobQueue:
+    """
+    Bounded queue of async jobs served by `workers` worker tasks
+    """
+
+    def __init__(self, workers=4, queueSize=100, resultTTL=600):
+        self.workers = workers
+        self.queueSize = queueSize
+        self.resultTTL = resultTTL
+        self.jobs = {}
+        self._queue = None
+        self._tasks = []
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        # Moving average of job run time, used to estimate Retry-After
+        self.averageSeconds = 1.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            workers=int(os.environ.get("MTG_JOB_WORKERS", 4)),
+            queueSize=int(os.environ.get("MTG_JOB_QUEUE_SIZE", 100)),
+            resultTTL=float(os.environ.get("MTG_JOB_RESULT_TTL", 600)),
+        )
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.queueSize)
+        self._tasks = [asyncio.create_task(self._worker())
+                       for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def retryAfter(self):
+        """
+        Rough number of seconds until the queue has room again
+        """
+        backlog = self._queue.qsize() if self._queue is not None else 0
+        return max(1, math.ceil(self.averageSeconds * backlog / max(1, self.workers)))
+
+    def submit(self, work):
+        """
+        Queues `work` (a no-argument coroutine function) and returns its Job,
+        or raises QueueFull
+        """
+        self._expire()
+        job = Job(work)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise QueueFull(self.retryAfter())
+        self.jobs[job.id] = job
+        return job
+
+    async def wait(self, jobId, timeout):
+        """
+        Returns the job, waiting up to `timeout` seconds for it to finish.
+        Returns None for unknown (or expired) job ids
+        """
+        job = self.jobs.get(jobId)
+        if job is None:
+            return None
+        if timeout > 0 and not job.done.is_set():
+            try:
+                await asyncio.wait_for(job.done.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return job
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            job.status = 'running'
+            started = time.perf_counter()
+            try:
+                job.result = await job.work()
+                job.status = 'done'
+                self.completed += 1
+            except Exception as e:
+                job.status = 'failed'
+                job.error = getattr(e, 'detail', None) or str(e)
+                job.errorStatus = getattr(e, 'status_code', 500)
+                self.failed += 1
+            finally:
+                elapsed = time.perf_counter() - started
+                self.averageSeconds = 0.8 * self.averageSeconds + 0.2 * elapsed
+                job.finishedAt = time.time()
+                job.work = None
+                job.done.set()
+                self._queue.task_done()
+
+    def _expire(self):
+        cutoff = time.time() - self.resultTTL
+        expired = [jobId for jobId, job in self.jobs.items()
+                   if job.finishedAt is not None and job.finishedAt < cutoff]
+        for jobId in expired:
+            del self.jobs[jobId]
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'queued': self._queue.qsize() if self._queue is not None else 0,
+            'queue_size': self.queueSize,
+            'tracked_jobs': len(self.jobs),
+            'completed': self.completed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'average_seconds': self.averageSeconds,
+        }
@@ -1,20 +1,48 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Optional
-import io
-import base64
+from typing import List, Dict, Optional, Literal
+from contextlib import asynccontextmanager
+import asyncio
 import json
-
-import requests
-import pandas as pd
+import os
 import time
-import re  # For regular expressions to parse mana costs
-import matplotlib.pyplot as plt  # For plotting
-import seaborn as sns  # Import seaborn
-import numpy as np  # For numerical operations (e.g., filtering zeros for plot)
 
-app = FastAPI(title="MTG Deck Analyzer", version="1.0.0")
+import aggregate
+import drawodds
+import manabase
+import metrics
+import scryfall
+from cardcache import normalizeCardName
+from cardlookup import (cardCache, cardFlights, cardIndex, cardWarmer, fetchManyAsync,
+                        getFuzzyIndex, iterManyAsync, suggestNames)
+from jobs import JobQueue, QueueFull
+from charts import CONTENT_TYPES, IMAGE_NAME, ChartRenderer
+from decklist import (DecklistTooLarge, MAX_DECK_CARDS, MAX_UPLOAD_BYTES, deckSize,
+                      decklistKey, parseDecklist, parseUpload)
+from responsecache import ResponseCache
+from sessions import SessionStore, oddsKey
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await jobQueue.start()
+    # Hot cards are loaded in the background, then kept from expiring
+    cardWarmer.start(fetchManyAsync, busy=lambda: cardFlights.stats()['in_flight'] > 0)
+    # Misspelled names are corrected against every known name, indexed ahead
+    # of the first typo
+    fuzzyLoading = asyncio.ensure_future(asyncio.to_thread(getFuzzyIndex))
+    yield
+    # Release the pooled scryfall connections and chart workers on shutdown
+    await asyncio.gather(fuzzyLoading, return_exceptions=True)
+    await cardWarmer.stop()
+    await jobQueue.stop()
+    await scryfall.closeAsyncClient()
+    chartRenderer.shutdown()
+
+
+app = FastAPI(title="MTG Deck Analyzer", version="1.0.0", lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -23,8 +51,79 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let the browser devtools show the per-stage timings
+    expose_headers=["Server-Timing"],
 )
 
+
+class UploadLimit:
+    """
+    ASGI middleware capping the request body of decklist uploads while it
+    streams in, so neither a large Content-Length nor a chunked upload without
+    one gets spooled before the 413
+    """
+
+    def __init__(self, app, path="/upload-decklist",
+                 # Some room for the multipart boundaries and headers
+                 maxBytes=MAX_UPLOAD_BYTES + 16 * 1024):
+        self.app = app
+        self.path = path
+        self.maxBytes = maxBytes
+
+    def tooLarge(self):
+        return HTTPException(
+            status_code=413, detail=f"Decklist is larger than {MAX_UPLOAD_BYTES} bytes")
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] != self.path:
+            return await self.app(scope, receive, send)
+
+        declared = dict(scope['headers']).get(b'content-length', b'')
+        if declared.isdigit() and int(declared) > self.maxBytes:
+            error = self.tooLarge()
+            response = JSONResponse(status_code=error.status_code,
+                                    content={'detail': error.detail})
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limitedReceive():
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > self.maxBytes:
+                    # Raised while the form is read, answered by the app's
+                    # HTTPException handler
+                    raise self.tooLarge()
+            return message
+
+        await self.app(scope, limitedReceive, send)
+
+
+app.add_middleware(UploadLimit)
+
+
+@app.middleware("http")
+async def timeRequests(request: Request, call_next):
+    """
+    Times every request and returns its pipeline stage timings as a
+    Server-Timing header
+    """
+    timings = metrics.startRequest()
+    started = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - started
+
+    # Label by route template so /jobs/{job_id} doesn't make a series per job
+    route = request.scope.get('route')
+    metrics.REQUEST_SECONDS.observe(
+        elapsed, method=request.method,
+        route=route.path if route is not None else 'unmatched',
+        status=response.status_code)
+    response.headers['Server-Timing'] = metrics.serverTiming(timings, elapsed)
+    return response
+
 # Pydantic models for API
 
 
@@ -37,312 +136,918 @@ class CardResponse(BaseModel):
     color_identity: List[str]
     type_line: str
     cmc: float
+    mana_cost: Optional[str] = None
     quantity: int
 
 
+class DrawSimulation(BaseModel):
+    samples: int
+    seconds: float
+    # Share of games kept at 7, 6 and 5 cards
+    mulligans: Dict[int, float]
+    # {'land_drops': {turn: p}, 'curve_plays': {turn: p}} with mulligans
+    on_the_play: Dict[str, Dict[int, float]]
+    on_the_draw: Dict[str, Dict[int, float]]
+
+
+class DrawOdds(BaseModel):
+    deck_size: int
+    lands: int
+    # Exact (hypergeometric) odds, without mulligans
+    opening_hand_lands: Dict[int, float]
+    keepable_hand: float
+    land_drops: Dict[str, Dict[int, float]]
+    # Monte Carlo estimates including mulligans and on-curve plays
+    simulation: Optional[DrawSimulation] = None
+
+
+class SpellManaCheck(BaseModel):
+    name: str
+    mana_cost: str
+    turn: int
+    # Colored pips per color (or hybrid pair like 'B/G'), the deck's lands
+    # that can pay them, and the chance of enough of those by `turn`
+    requirements: Dict[str, int]
+    sources: Dict[str, int]
+    probability: Dict[str, float]
+    on_curve: float
+
+
+class ColorSources(BaseModel):
+    sources: int
+    spells: int
+    worst_probability: float
+    # Sources needed for every spell of this color to reach the target
+    recommended_sources: int
+
+
+class ManaBase(BaseModel):
+    lands: int
+    target: float
+    sources: Dict[str, int]
+    colors: Dict[str, ColorSources]
+    spells: List[SpellManaCheck]
+    # Spells whose mana cost isn't known, left out of the checks
+    unknown_costs: List[str] = []
+
+
+# charts=none skips rendering, svg returns base64 encoded SVG instead of PNG
+ChartFormat = Literal['none', 'svg', 'png']
+
+
 class DeckAnalysisResponse(BaseModel):
     cards: List[CardResponse]
     color_distribution: Dict[str, int]
     color_percentages: Dict[str, float]
     mana_curve: Dict[int, int]
-    color_chart_base64: str
-    mana_curve_chart_base64: str
-    color_breakdown_chart_base64: str
+    # Misspelled names that were matched to a card, and likely names for the
+    # ones that couldn't be matched
+    corrections: Dict[str, str] = {}
+    suggestions: Dict[str, List[str]] = {}
+    # Opening hand and draw probabilities, None for decks under 13 cards
+    draw_odds: Optional[DrawOdds] = None
+    # Colored sources of the lands against the pips of the spells
+    mana_base: Optional[ManaBase] = None
+    chart_format: ChartFormat = 'png'
+    # Charts are served from GET /charts/{hash}.{format}, or inlined as
+    # base64 with ?inline_charts=true
+    color_chart_url: str = ""
+    mana_curve_chart_url: str = ""
+    color_breakdown_chart_url: str = ""
+    color_chart_base64: str = ""
+    mana_curve_chart_base64: str = ""
+    color_breakdown_chart_base64: str = ""
+
+
+class DeckSessionResponse(DeckAnalysisResponse):
+    session_id: str
+    # Card names whose quantity differs from the session's previous list
+    added: List[str] = []
+    removed: List[str] = []
+    changed: List[str] = []
+    # Names looked up for this edit, and the charts that had to be redrawn
+    fetched: int = 0
+    rerendered_charts: List[str] = []
+
+
+class BatchDecklistInput(BaseModel):
+    decklists: List[str]
+
+
+class BatchDeckResult(BaseModel):
+    index: int
+    # Why the deck wasn't analyzed (too large), its other fields are empty then
+    error: Optional[str] = None
+    cards: List[CardResponse] = []
+    skipped: List[str] = []
+    color_distribution: Dict[str, int] = {}
+    color_percentages: Dict[str, float] = {}
+    mana_curve: Dict[int, int] = {}
+    color_chart_url: str = ""
+    mana_curve_chart_url: str = ""
+    color_breakdown_chart_url: str = ""
+    color_chart_base64: str = ""
+    mana_curve_chart_base64: str = ""
+    color_breakdown_chart_base64: str = ""
+
+
+class CardInclusion(BaseModel):
+    name: str
+    decks: int
+    inclusion_rate: float
+    average_copies: float
 
 
-def fetchData(cardname):
-    """
-    makes the api call to scryfall to get json data back
-    """
-    apiurl = "https://api.scryfall.com/cards/named"
-    params = {"exact": cardname}
+class FieldSummary(BaseModel):
+    deck_count: int
+    unique_cards: int
+    card_inclusion: List[CardInclusion]
+    average_color_distribution: Dict[str, float]
+    average_mana_curve: Dict[int, float]
 
-    try:
-        response = requests.get(apiurl, params=params)
-        response.raise_for_status()  # For error checking
-        carddata = response.json()
-
-        # Grabs all the data I want from the json file
-        return {
-            'name': carddata.get('name'),
-            'color_identity': carddata.get('color_identity', []),
-            'type_line': carddata.get('type_line'),
-            'cmc': carddata.get('cmc')
-        }
-    # Returns error if failed (usually due to typo in card name)
-    except requests.RequestException as error:
-        print(f"Error fetching data for '{cardname}': {error}")
-        return None
 
+class BatchAnalysisResponse(BaseModel):
+    decks: List[BatchDeckResult]
+    field: FieldSummary
+    chart_format: ChartFormat = 'none'
 
-def analyzeDecklist(decklist_text):
-    """
-    Modified version of your original function to work with text input instead of file
-    """
-    cardData = []
-    lines = decklist_text.strip().split('\n')
 
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
+# Most decklists accepted by one /analyze-decks call
+MAX_BATCH_DECKS = int(os.environ.get("MTG_MAX_BATCH_DECKS", 1000))
 
-        match = re.match(r'(\d+)\s+(.*)', line)
-        if match:
-            quantity = int(match.group(1))
-            cardName = match.group(2).strip()
-        else:
-            quantity = 1
-            cardName = line.strip()
 
+# Chart worker pool, configured by MTG_CHART_WORKERS / MTG_CHART_QUEUE_SIZE
+chartRenderer = ChartRenderer.from_env()
+
+# Finished analyses keyed by normalized decklist, configured by MTG_RESPONSE_CACHE_*
+responseCache = ResponseCache.from_env()
+
+# Background analysis jobs, configured by MTG_JOB_WORKERS / MTG_JOB_QUEUE_SIZE
+jobQueue = JobQueue.from_env()
+
+# Deck editing sessions, configured by MTG_SESSION_TTL / MTG_MAX_SESSIONS
+sessionStore = SessionStore.from_env()
+
+# Longest a GET /jobs/{id} long-poll may wait for the job to finish
+MAX_JOB_WAIT = float(os.environ.get("MTG_MAX_JOB_WAIT", 30))
+
+# Chart images never change once rendered, they're named by their content hash
+CHART_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def chartFields(chartImages, inline):
+    """
+    Response fields for {kind: image} rendered charts: base64 images when
+    inline, otherwise the URLs of the stored images
+    """
+    if inline:
+        return {f'{kind}_chart_base64': image for kind, image in chartImages.items()}
+    return {f'{kind}_chart_url': f"/charts/{name}" if name else ""
+            for kind, name in chartImages.items()}
+
+def buildCardData(entries, resolved):
+    """
+    Maps resolved cards back onto the decklist lines in their original order
+    """
+    cardData = []
+    for cardName, quantity in entries:
         print(f"Processing: {cardName} (x{quantity})")
-        data = fetchData(cardName)
+        data = resolved.get(normalizeCardName(cardName))
         if data:
+            data = dict(data)
             data['quantity'] = quantity
+            if data.get('corrected'):
+                print(f"Matched '{cardName}' to '{data['name']}'")
             cardData.append(data)
         else:
             print(f"Skipping '{cardName} due to fetch error or not found")
-        time.sleep(0.05)  # Scryfall asks to rate limit
-    return cardData
+    return mergeCards(cardData)
 
 
-def countColorIdentity(dataFrame):
+def mergeCards(cardData):
     """
-    Counts total color identity of the deck
+    Merges cards that resolved to the same card (e.g. a misspelled line
+    corrected to a card that's also listed correctly), adding up quantities
     """
-    colorCounts = {'W': 0, 'U': 0, 'B': 0, 'R': 0, 'G': 0, 'C': 0}
-
-    for index, row in dataFrame.iterrows():
-        quantity = row['quantity']
-        identity = row['color_identity']
-
-        if not identity:
-            if not (row['type_line'] and "Land" in row['type_line']):
-                colorCounts['C'] += quantity
+    merged = {}
+    for data in cardData:
+        if data['name'] in merged:
+            merged[data['name']]['quantity'] += data['quantity']
         else:
-            for color in identity:
-                if color in colorCounts:
-                    colorCounts[color] += quantity
-                else:
-                    print(f"Warning: Unexpected color identity '{color}'")
-    return colorCounts
+            merged[data['name']] = data
+    return list(merged.values())
 
 
-def create_color_pie_chart_base64(filteredIDCount):
+def deckSizeError(entries):
     """
-    Creates color pie chart but returns base64 string
+    Why a decklist with more than MAX_DECK_CARDS cards can't be analyzed, or
+    None when it can
     """
-    if not filteredIDCount:
-        return ""
+    cards = deckSize(entries)
+    if cards > MAX_DECK_CARDS:
+        return f"Decklist has {cards} cards, at most {MAX_DECK_CARDS} can be analyzed"
+    return None
 
-    labels = filteredIDCount.keys()
-    sizes = filteredIDCount.values()
 
-    colorMap = {
-        'W': '#F9FAF9', 'U': '#ADD8E6', 'B': '#36454F', 'R': '#DC143C', 'G': '#7CFC00',
-        'C': '#A9A9A9'
-    }
+def checkDeckSize(entries):
+    """
+    Turns away decklists with more than MAX_DECK_CARDS cards with a 400
+    """
+    error = deckSizeError(entries)
+    if error is not None:
+        raise HTTPException(status_code=400, detail=error)
 
-    plotColors = [colorMap.get(label, '#CCCCCC') for label in labels]
 
-    plt.figure(figsize=(10, 8))
-    plt.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=90, colors=plotColors,
-            wedgeprops={'edgecolor': 'black', 'linewidth': 0.5},
-            textprops={'fontsize': 12})
-    plt.title(
-        'Deck Color Identity Distribution (Per Nonland Card)', fontsize=16)
-    plt.axis('equal')
+async def resolveEntriesAsync(entries, failed=None):
+    """
+    Resolves the unique names of parsed decklist entries concurrently,
+    returning {normalized name: card data} for buildCardData
+    """
+    checkDeckSize(entries)
+    with metrics.stage('resolve'):
+        return await fetchManyAsync(
+            [normalizeCardName(cardName) for cardName, _ in entries], failed)
 
-    # Convert to base64
-    buffer = io.BytesIO()
-    plt.savefig(buffer, format='png', bbox_inches='tight', dpi=150)
-    buffer.seek(0)
-    imageBase64 = base64.b64encode(buffer.getvalue()).decode()
-    plt.close()
 
-    return imageBase64
+async def nameCorrections(entries, resolved):
+    """
+    Splits decklist names that didn't match exactly into ({typed name: matched
+    card name}, {unresolved name: suggested names})
+    """
+    corrections = {}
+    unresolved = []
+    for cardName, _ in entries:
+        data = resolved.get(normalizeCardName(cardName))
+        if data is None:
+            unresolved.append(cardName)
+        elif data.get('corrected'):
+            corrections[cardName] = data['name']
+    if not unresolved:
+        return corrections, {}
+    return corrections, await asyncio.to_thread(suggestNames, dict.fromkeys(unresolved))
+
+
+def computeDrawOdds(cards):
+    """
+    drawodds.drawOdds timed as its own stage, meant to run in a thread
+    """
+    with metrics.stage('draw_odds'):
+        return drawodds.drawOdds(cards)
 
 
-def create_mana_curve_chart_base64(cmcIntDict):
+def computeManaBase(cards):
     """
-    Creates your original mana curve chart but returns base64 string
+    manabase.analyzeManaBase timed as its own stage, meant to run in a thread
     """
-    if not cmcIntDict:
-        return ""
+    with metrics.stage('mana_base'):
+        return manabase.analyzeManaBase(cards)
 
-    # Creates new Panda frame from cmcintdict
-    manaCurveData = pd.DataFrame(
-        list(cmcIntDict.items()), columns=['CMC', 'Count'])
-    manaCurveData['CMC'] = pd.Categorical(manaCurveData['CMC'],
-                                          categories=sorted(
-                                              manaCurveData['CMC'].unique()),
-                                          ordered=True)
-    manaCurveData = manaCurveData.sort_values('CMC')
 
-    plt.figure(figsize=(12, 6))
-    sns.barplot(x='CMC', y='Count', data=manaCurveData,
-                palette='coolwarm', edgecolor='black')
-    plt.title(
-        'Mana Curve (Converted Mana Cost Distribution of Spells)', fontsize=16)
-    plt.xlabel('Converted Mana Cost (CMC)', fontsize=14)
-    plt.ylabel('Number of Spells', fontsize=14)
-    plt.xticks(rotation=0)
-    plt.grid(axis='y', linestyle='--', alpha=0.7)  # Added grid back
-    plt.tight_layout()
+# API Routes
 
-    # Convert to base64
-    buffer = io.BytesIO()
-    plt.savefig(buffer, format='png', bbox_inches='tight', dpi=150)
-    buffer.seek(0)
-    imageBase64 = base64.b64encode(buffer.getvalue()).decode()
-    plt.close()
 
-    return imageBase64
+@app.get("/")
+async def root():
+    return {"message": "MTG Deck Analyzer API"}
+
+
+@app.get("/cache-stats")
+async def cache_stats():
+    """Hit/miss counters for the card and chart caches"""
+    return {
+        'cards': cardCache.stats(),
+        'charts': chartRenderer.cache.stats(),
+        'responses': responseCache.stats(),
+        'index': cardIndex.stats() if cardIndex is not None else None,
+        'coalescing': cardFlights.stats(),
+        'upstream': dict(scryfall.upstreamStats),
+        'jobs': jobQueue.stats(),
+        'sessions': sessionStore.stats(),
+        'warmup': cardWarmer.stats(),
+    }
 
 
-def create_color_breakdown_chart_base64(IDPercentage):
+def statsMetrics():
     """
-    Creates your original color breakdown chart but returns base64 string
+    Cache, coalescing, upstream and job counters as Prometheus lines
     """
-    if not IDPercentage:
-        return ""
-
-    colorMap = {
-        'W': '#F9FAF9', 'U': '#ADD8E6', 'B': '#36454F', 'R': '#DC143C', 'G': '#7CFC00',
-        'C': '#A9A9A9'
-    }
+    cards = cardCache.stats()
+    responses = responseCache.stats()
+    chartCache = chartRenderer.cache.stats()
+    jobs = jobQueue.stats()
+    lines = []
+    lines += metrics.formatSamples(
+        "mtg_scryfall_requests_total", "Scryfall requests sent, retries included", 'counter',
+        [({}, scryfall.upstreamStats['requests'])])
+    lines += metrics.formatSamples(
+        "mtg_scryfall_retries_total", "Scryfall requests retried", 'counter',
+        [({}, scryfall.upstreamStats['retries'])])
+    lines += metrics.formatSamples(
+        "mtg_scryfall_throttled_total", "Scryfall 429 responses", 'counter',
+        [({}, scryfall.upstreamStats['throttled'])])
+    lines += metrics.formatSamples(
+        "mtg_scryfall_errors_total", "Scryfall requests that failed after retrying", 'counter',
+        [({}, scryfall.upstreamStats['errors'])])
+    lines += metrics.formatSamples(
+        "mtg_cache_hits_total", "Cache hits", 'counter',
+        [({'cache': 'cards_memory'}, cards['memory_hits']),
+         ({'cache': 'cards_disk'}, cards['disk_hits']),
+         ({'cache': 'responses'}, responses['hits']),
+         ({'cache': 'charts'}, chartCache['hits'])])
+    lines += metrics.formatSamples(
+        "mtg_cache_misses_total", "Cache misses", 'counter',
+        [({'cache': 'cards'}, cards['misses']),
+         ({'cache': 'responses'}, responses['misses']),
+         ({'cache': 'charts'}, chartCache['misses'])])
+    lines += metrics.formatSamples(
+        "mtg_coalesced_lookups_total", "Card lookups that waited on another request's fetch",
+        'counter', [({}, cardFlights.stats()['coalesced'])])
+    lines += metrics.formatSamples(
+        "mtg_jobs_queued", "Analysis jobs waiting for a worker", 'gauge',
+        [({}, jobs['queued'])])
+    lines += metrics.formatSamples(
+        "mtg_jobs_total", "Finished or rejected analysis jobs", 'counter',
+        [({'outcome': 'completed'}, jobs['completed']),
+         ({'outcome': 'failed'}, jobs['failed']),
+         ({'outcome': 'rejected'}, jobs['rejected'])])
+    return lines
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Latency histograms and counters in Prometheus text format"""
+    return Response(content=metrics.render(statsMetrics()),
+                    media_type='text/plain; version=0.0.4')
+
+
+async def buildAnalysis(entries, charts, inline=False, failed=None):
+    """
+    Runs the full fetch -> aggregate -> render pipeline for parsed decklist
+    entries, adding names that couldn't be fetched to `failed`
+    """
+    resolved = await resolveEntriesAsync(entries, failed)
+    with metrics.stage('build'):
+        allCardData = buildCardData(entries, resolved)
+        corrections, suggestions = await nameCorrections(entries, resolved)
 
-    IDPercentagedf = pd.DataFrame([IDPercentage])
+    if not allCardData:
+        raise HTTPException(
+            status_code=400, detail="No valid cards found in decklist")
 
-    orderedCol = [c for c in ['W', 'U', 'B', 'R',
-                              'G', 'C'] if c in IDPercentagedf.columns]
-    IDPercentagedf = IDPercentagedf[orderedCol]
+    # Color identity of the nonland cards, its percentages, and the mana
+    # curve, computed over the compact card arrays
+    with metrics.stage('aggregate'):
+        filteredIDCount, IDPercentage, cmcIntDict = aggregate.analyzeCards(
+            allCardData)
+    # A new deck size builds its source table, which takes a moment
+    manaBase = await asyncio.to_thread(computeManaBase, allCardData)
 
-    currentPlotColors = [colorMap.get(
-        col, '#CCCCCC') for col in IDPercentagedf.columns]
+    # Draw odds are simulated on a thread while the charts render
+    oddsTask = asyncio.ensure_future(asyncio.to_thread(computeDrawOdds, allCardData))
 
-    plt.figure(figsize=(10, 4))  # Adjust figure size for a single bar
-    # Plot as a stacked horizontal bar chart
-    IDPercentagedf.plot(
-        kind='barh',
-        stacked=True,
-        ax=plt.gca(),  # Get current axes to plot on
-        color=currentPlotColors,
-        edgecolor='black',
-        linewidth=0.5
+    # Generate charts using your original styling, rendered in parallel
+    # on the chart worker pool
+    try:
+        with metrics.stage('charts'):
+            chartImages = await chartRenderer.renderAll({
+                'color': filteredIDCount,
+                'mana_curve': cmcIntDict,
+                'color_breakdown': IDPercentage,
+            }, fmt=charts, inline=inline)
+    finally:
+        odds = await oddsTask
+
+    # Convert card data to response format
+    cards = [CardResponse(**card) for card in allCardData]
+
+    return DeckAnalysisResponse(
+        cards=cards,
+        color_distribution=filteredIDCount,
+        color_percentages=IDPercentage,
+        mana_curve=cmcIntDict,
+        corrections=corrections,
+        suggestions=suggestions,
+        draw_odds=odds,
+        mana_base=manaBase,
+        chart_format=charts,
+        **chartFields(chartImages, inline)
     )
-    plt.title(
-        'Color Identity Breakdown (Percentage of Total Identity)', fontsize=16)
-    plt.xlabel('Percentage of Deck Color Identity', fontsize=14)
-    plt.ylabel('')  # No y-label needed for a single stacked bar
-    # Set x-ticks from 0-100 in steps of 10
-    plt.xticks(np.arange(0, 101, 10))
-    plt.xlim(0, 100)  # Ensure x-axis goes exactly from 0 to 100
-    plt.legend(title='Color', bbox_to_anchor=(1.05, 1),
-               loc='upper left')  # Move legend outside
-    plt.tight_layout()
 
-    # Convert to base64
-    buffer = io.BytesIO()
-    plt.savefig(buffer, format='png', bbox_inches='tight', dpi=150)
-    buffer.seek(0)
-    imageBase64 = base64.b64encode(buffer.getvalue()).decode()
-    plt.close()
 
-    return imageBase64
+async def storeAnalysis(entries, charts, inline, key):
+    """
+    Builds and serializes an analysis, keeping it in the response cache unless
+    some of its cards couldn't be fetched (they'd stay missing for the TTL)
+    """
+    failed = set()
+    analysis = await buildAnalysis(entries, charts, inline, failed)
+    with metrics.stage('serialize'):
+        body = analysis.model_dump_json().encode()
+    if failed:
+        print(f"Not caching the analysis, {len(failed)} cards couldn't be fetched")
+    else:
+        chartNames = [url.rsplit('/', 1)[-1] for url in (
+            analysis.color_chart_url, analysis.mana_curve_chart_url,
+            analysis.color_breakdown_chart_url) if url]
+        responseCache.put(key, body, chartNames)
+    return body
+
+
+async def cachedBody(key):
+    """
+    The cached analysis body for key, or None. An analysis linking to a chart
+    that can't be served any more is dropped, so its URLs don't 410
+    """
+    entry = responseCache.lookup(key)
+    if entry is None:
+        return None
+    body, chartNames = entry
+    if chartNames and await chartRenderer.expired(chartNames):
+        responseCache.drop(key)
+        return None
+    return body
 
-    # API Routes
 
+async def analysisBody(entries, charts, inline=False):
+    """
+    Serialized analysis for parsed decklist entries, from the response cache
+    when the same (normalized) decklist was analyzed recently
+    """
+    key = decklistKey(entries, charts, inline)
+    body = await cachedBody(key)
+    if body is None:
+        body = await storeAnalysis(entries, charts, inline, key)
+    return body
 
-@app.get("/")
-async def root():
-    return {"message": "MTG Deck Analyzer API"}
+
+async def cachedAnalysis(entries, charts, inline, request):
+    """
+    Serves an analysis with its ETag, answering 304 if the client has it already
+    """
+    body = await analysisBody(entries, charts, inline)
+    etag = responseCache.etagFor(body)
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if responseCache.etagMatches(request.headers.get('if-none-match'), etag):
+        responseCache.notModified += 1
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=body, media_type='application/json', headers=headers)
 
 
 @app.post("/analyze-deck", response_model=DeckAnalysisResponse)
-async def analyze_deck(deck_input: DecklistInput):
+async def analyze_deck(deck_input: DecklistInput, request: Request,
+                       charts: ChartFormat = Query('png'),
+                       inline_charts: bool = Query(False)):
     """
     API endpoint that uses your original analysis logic
+
+    ?charts=none returns only the data, ?charts=svg returns vector charts.
+    Charts are returned as URLs unless ?inline_charts=true asks for base64.
+    Repeat decklists are served from cache with an ETag (If-None-Match -> 304)
+    """
+    try:
+        with metrics.stage('parse'):
+            entries = parseDecklist(deck_input.decklist)
+        return await cachedAnalysis(entries, charts, inline_charts, request)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"Error analyzing deck: {str(e)}")
+
+
+@app.post("/upload-decklist")
+async def upload_decklist(request: Request, file: UploadFile = File(...),
+                          charts: ChartFormat = Query('png'),
+                          inline_charts: bool = Query(False)):
+    """
+    Upload a decklist file and return analysis
+
+    The file is parsed in chunks as it's read (up to MTG_MAX_UPLOAD_BYTES) and
+    only the deck's distinct cards are passed on to the analysis
     """
     try:
-        # Use your original analyzeDecklist function (modified for text input)
-        allCardData = analyzeDecklist(deck_input.decklist)
+        with metrics.stage('parse'):
+            parser = await parseUpload(file)
+        return await cachedAnalysis(parser.entries(), charts, inline_charts, request)
+
+    except DecklistTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"Error processing file: {str(e)}")
+
+async def analyzeSession(session, decklist_text, charts, inline):
+    """
+    Moves a deck session to a new version of its list: only names the session
+    hasn't seen are resolved, the aggregates are updated by the quantity
+    changes, and only charts whose data changed are rendered
+    """
+    with metrics.stage('parse'):
+        entries = parseDecklist(decklist_text)
+    checkDeckSize(entries)
+
+    async with session.lock:
+        # Nothing is stored in the session until the whole analysis went
+        # through, so a failed request leaves it as it was
+        unknown = session.unknownNames(entries)
+        failed = set()
+        with metrics.stage('resolve'):
+            resolved = await fetchManyAsync(unknown, failed) if unknown else {}
+        with metrics.stage('aggregate'):
+            state, changes = session.update(entries, resolved, failed)
+            filteredIDCount, IDPercentage, cmcIntDict = state['totals'].results()
+        with metrics.stage('build'):
+            allCardData = buildCardData(entries, state['resolved'])
+            corrections, suggestions = await nameCorrections(entries, state['resolved'])
 
         if not allCardData:
             raise HTTPException(
                 status_code=400, detail="No valid cards found in decklist")
 
-        df = pd.DataFrame(allCardData)
+        manaBase = await asyncio.to_thread(computeManaBase, allCardData)
+
+        # Draw odds only depend on the lands and mana values, so swapping a
+        # card for one of the same kind keeps the previous estimate
+        key = oddsKey(allCardData)
+        odds = session.odds
+        oddsTask = None
+        if key != session.oddsKey:
+            oddsTask = asyncio.ensure_future(
+                asyncio.to_thread(computeDrawOdds, allCardData))
+
+        chartData = {
+            'color': filteredIDCount,
+            'mana_curve': cmcIntDict,
+            'color_breakdown': IDPercentage,
+        }
+        stale = session.staleCharts(chartData, (charts, inline))
+        try:
+            with metrics.stage('charts'):
+                chartImages = await chartRenderer.renderAll(
+                    {kind: chartData[kind] for kind in stale}, fmt=charts, inline=inline)
+        finally:
+            if oddsTask is not None:
+                odds = await oddsTask
+
+        session.commit(state)
+        session.odds, session.oddsKey = odds, key
+        session.storeCharts(chartData, (charts, inline), chartImages)
+
+        return DeckSessionResponse(
+            session_id=session.id,
+            cards=[CardResponse(**card) for card in allCardData],
+            color_distribution=filteredIDCount,
+            color_percentages=IDPercentage,
+            mana_curve=cmcIntDict,
+            corrections=corrections,
+            suggestions=suggestions,
+            draw_odds=odds,
+            mana_base=manaBase,
+            chart_format=charts,
+            fetched=len(unknown),
+            rerendered_charts=stale if charts != 'none' else [],
+            **changes,
+            **chartFields(session.chartImages, inline)
+        )
 
-        if 'quantity' not in df.columns:
-            print(f"Warning: 'quantity' not found in DataFrame, making all quantities 1")
-            df['quantity'] = 1
 
-        # splits the dataframe into two separate copies (your original logic)
-        nonlandDf = df[~df['type_line'].str.contains('Land',
-                                                     na=False)].copy()
+@app.post("/sessions", response_model=DeckSessionResponse, status_code=201)
+async def create_session(deck_input: DecklistInput,
+                         charts: ChartFormat = Query('png'),
+                         inline_charts: bool = Query(False)):
+    """
+    Analyzes a decklist and keeps the result around for edits: PUT the
+    edited list to /sessions/{session_id} to have it re-analyzed incrementally
+    """
+    session = sessionStore.create()
+    try:
+        return await analyzeSession(session, deck_input.decklist, charts, inline_charts)
 
-        landDf = df[df['type_line'].str.contains('Land',
-                                                 na=False)].copy()
+    except HTTPException:
+        sessionStore.delete(session.id)
+        raise
+    except Exception as e:
+        sessionStore.delete(session.id)
+        raise HTTPException(
+            status_code=500, detail=f"Error analyzing deck: {str(e)}")
 
-        # Getting color identity based on all nonland cards (your original logic)
-        deckColorIDCount = countColorIdentity(nonlandDf)
-        filteredIDCount = {
-            k: v for k, v in deckColorIDCount.items() if v > 0}
 
-        # Calculates percentages of each color from nonland cards (your original logic)
-        totalIDPoints = sum(filteredIDCount.values())
-        IDPercentage = {}
-        if totalIDPoints > 0:
-            IDPercentage = {
-                k: (v / totalIDPoints) * 100 for k, v in filteredIDCount.items()}
+@app.put("/sessions/{session_id}", response_model=DeckSessionResponse)
+async def update_session(session_id: str, deck_input: DecklistInput,
+                         charts: ChartFormat = Query('png'),
+                         inline_charts: bool = Query(False)):
+    """
+    Re-analyzes an edited decklist, reusing everything the session already
+    resolved and rendered. The response lists what changed
+    """
+    session = sessionStore.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired session")
+    try:
+        return await analyzeSession(session, deck_input.decklist, charts, inline_charts)
 
-        # Getting CMC per group in decklist (your original logic)
-        # Learning Pandas functionality
-        cmcDataSeries = nonlandDf.groupby('cmc')['quantity'].sum()
-        cmcDict = cmcDataSeries.to_dict()
-        # Convert keys to int for plotting and readablity
-        cmcIntDict = {int(k): v for k, v in cmcDict.items()}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"Error analyzing deck: {str(e)}")
 
-        # Generate charts using your original styling
-        sns.set_theme(style="darkgrid", palette="pastel")
 
-        color_chart_base64 = create_color_pie_chart_base64(filteredIDCount)
-        mana_curve_chart_base64 = create_mana_curve_chart_base64(cmcIntDict)
-        color_breakdown_chart_base64 = create_color_breakdown_chart_base64(
-            IDPercentage)
+@app.delete("/sessions/{session_id}", status_code=204)
+async def delete_session(session_id: str):
+    if not sessionStore.delete(session_id):
+        raise HTTPException(status_code=404, detail="Unknown or expired session")
+    return Response(status_code=204)
 
-        # Convert card data to response format
-        cards = [CardResponse(**card) for card in allCardData]
 
-        return DeckAnalysisResponse(
-            cards=cards,
-            color_distribution=filteredIDCount,
-            color_percentages=IDPercentage,
-            mana_curve=cmcIntDict,
-            color_chart_base64=color_chart_base64,
-            mana_curve_chart_base64=mana_curve_chart_base64,
-            color_breakdown_chart_base64=color_breakdown_chart_base64
+@app.post("/analyze-decks", response_model=BatchAnalysisResponse)
+async def analyze_decks(batch_input: BatchDecklistInput,
+                        charts: ChartFormat = Query('none'),
+                        inline_charts: bool = Query(False)):
+    """
+    Analyzes many decklists at once (e.g. a whole tournament field)
+
+    The union of card names across all decks is resolved once, aggregates for
+    every deck are computed in a single vectorized pass, and the response adds
+    field-wide card inclusion rates and averages. Charts are off by default.
+    Decks over the upload or card limits get an error of their own and are
+    left out of the field summary, the rest of the batch is still analyzed.
+    """
+    if len(batch_input.decklists) > MAX_BATCH_DECKS:
+        raise HTTPException(
+            status_code=400, detail=f"At most {MAX_BATCH_DECKS} decklists per batch")
+
+    try:
+        with metrics.stage('parse'):
+            errors = {}
+            deckEntries = {}
+            for index, text in enumerate(batch_input.decklists):
+                if len(text.encode()) > MAX_UPLOAD_BYTES:
+                    errors[index] = str(DecklistTooLarge(MAX_UPLOAD_BYTES))
+                    continue
+                entries = parseDecklist(text)
+                error = deckSizeError(entries)
+                if error is not None:
+                    errors[index] = error
+                else:
+                    deckEntries[index] = entries
+        with metrics.stage('resolve'):
+            resolved = await fetchManyAsync(
+                [normalizeCardName(cardName)
+                 for entries in deckEntries.values() for cardName, _ in entries])
+
+        decks = []
+        skippedByDeck = []
+        for entries in deckEntries.values():
+            cards = []
+            skipped = []
+            for cardName, quantity in entries:
+                data = resolved.get(normalizeCardName(cardName))
+                if data:
+                    cards.append(dict(data, quantity=quantity))
+                else:
+                    skipped.append(cardName)
+            decks.append(mergeCards(cards))
+            skippedByDeck.append(skipped)
+
+        with metrics.stage('aggregate'):
+            arrays = aggregate.DeckArrays.fromDecks(decks)
+            colorMatrix = aggregate.colorIdentityMatrix(arrays)
+            curveMatrix = aggregate.manaCurveMatrix(arrays)
+
+        results = [BatchDeckResult(index=index, error=error) for index, error in errors.items()]
+        for row, (index, cards) in enumerate(zip(deckEntries, decks)):
+            filteredIDCount = aggregate.colorCountsDict(colorMatrix[row])
+            IDPercentage = aggregate.colorPercentages(filteredIDCount)
+            cmcIntDict = aggregate.manaCurveDict(curveMatrix[row])
+
+            chartImages = {}
+            if charts != 'none' and cards:
+                chartImages = await chartRenderer.renderAll({
+                    'color': filteredIDCount,
+                    'mana_curve': cmcIntDict,
+                    'color_breakdown': IDPercentage,
+                }, fmt=charts, inline=inline_charts)
+
+            results.append(BatchDeckResult(
+                index=index,
+                cards=[CardResponse(**card) for card in cards],
+                skipped=skippedByDeck[row],
+                color_distribution=filteredIDCount,
+                color_percentages=IDPercentage,
+                mana_curve=cmcIntDict,
+                **chartFields(chartImages, inline_charts)
+            ))
+
+        results.sort(key=lambda result: result.index)
+
+        inclusion = aggregate.cardInclusion(decks)
+        field = FieldSummary(
+            deck_count=len(decks),
+            unique_cards=len(inclusion),
+            card_inclusion=inclusion,
+            average_color_distribution=aggregate.averageRow(
+                colorMatrix, aggregate.COLORS),
+            average_mana_curve=aggregate.averageRow(
+                curveMatrix, range(curveMatrix.shape[1])),
         )
+        return BatchAnalysisResponse(decks=results, field=field, chart_format=charts)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
-            status_code=500, detail=f"Error analyzing deck: {str(e)}")
+            status_code=500, detail=f"Error analyzing decks: {str(e)}")
 
 
-@app.post("/upload-decklist")
-async def upload_decklist(file: UploadFile = File(...)):
-    """Upload a decklist file and return analysis"""
+async def analysisEvents(decklist_text, charts, inline=False):
+    """
+    Runs the analysis pipeline as a stream of events: each card as it
+    resolves, then the aggregates, then each chart as it finishes rendering
+    """
+    with metrics.stage('parse'):
+        entries = parseDecklist(decklist_text)
     try:
-        content = await file.read()
-        decklist_text = content.decode('utf-8')
+        checkDeckSize(entries)
+    except HTTPException as e:
+        yield {'type': 'error', 'detail': e.detail}
+        return
+    linesByName = {}
+    for lineNumber, (cardName, quantity) in enumerate(entries):
+        linesByName.setdefault(normalizeCardName(cardName), []).append(
+            (lineNumber, cardName, quantity))
+
+    cardsByLine = {}
+    async for chunk in iterManyAsync(list(linesByName)):
+        for key, data in chunk.items():
+            for lineNumber, cardName, quantity in linesByName.pop(key):
+                card = dict(data, quantity=quantity)
+                cardsByLine[lineNumber] = card
+                event = {'type': 'card', 'line': lineNumber,
+                         'card': CardResponse(**card).model_dump()}
+                if data.get('corrected'):
+                    event['corrected_from'] = cardName
+                yield event
+
+    skipped = [line for lines in linesByName.values() for line in lines]
+    suggestions = await asyncio.to_thread(
+        suggestNames, dict.fromkeys(cardName for _, cardName, _ in skipped)) if skipped else {}
+    for lineNumber, cardName, quantity in skipped:
+        yield {'type': 'skipped', 'line': lineNumber, 'name': cardName,
+               'suggestions': suggestions[cardName]}
+
+    allCardData = mergeCards(
+        [cardsByLine[lineNumber] for lineNumber in sorted(cardsByLine)])
+    if not allCardData:
+        yield {'type': 'error', 'detail': "No valid cards found in decklist"}
+        return
+
+    filteredIDCount, IDPercentage, cmcIntDict = aggregate.analyzeCards(allCardData)
+    yield {
+        'type': 'aggregates',
+        'color_distribution': filteredIDCount,
+        'color_percentages': IDPercentage,
+        'mana_curve': cmcIntDict,
+        'chart_format': charts,
+    }
+
+    manaBase = await asyncio.to_thread(computeManaBase, allCardData)
+    yield {'type': 'mana_base',
+           'mana_base': ManaBase(**manaBase).model_dump() if manaBase else None}
+
+    odds = await asyncio.to_thread(computeDrawOdds, allCardData)
+    yield {'type': 'draw_odds',
+           'draw_odds': DrawOdds(**odds).model_dump() if odds else None}
+
+    if charts != 'none':
+        async for kind, image in chartRenderer.iterRender({
+            'color': filteredIDCount,
+            'mana_curve': cmcIntDict,
+            'color_breakdown': IDPercentage,
+        }, fmt=charts, inline=inline):
+            event = {'type': 'chart', 'kind': kind, 'format': charts}
+            if inline:
+                event['base64'] = image
+            else:
+                event['url'] = f"/charts/{image}" if image else ""
+            yield event
+
+    yield {'type': 'done'}
 
-        deck_input = DecklistInput(decklist=decklist_text)
-        return await analyze_deck(deck_input)
 
+async def encodeEvents(events, sse):
+    """
+    Encodes analysis events as NDJSON lines, or as server-sent events
+    """
+    try:
+        async for event in events:
+            payload = json.dumps(event)
+            if sse:
+                yield f"event: {event['type']}\ndata: {payload}\n\n"
+            else:
+                yield payload + "\n"
     except Exception as e:
+        payload = json.dumps({'type': 'error', 'detail': f"Error analyzing deck: {str(e)}"})
+        yield f"event: error\ndata: {payload}\n\n" if sse else payload + "\n"
+
+
+@app.post("/analyze-deck/stream")
+async def analyze_deck_stream(deck_input: DecklistInput, request: Request,
+                              charts: ChartFormat = Query('png'),
+                              inline_charts: bool = Query(False)):
+    """
+    Streaming version of /analyze-deck. Returns NDJSON by default, or
+    server-sent events when the client accepts text/event-stream
+    """
+    sse = 'text/event-stream' in request.headers.get('accept', '')
+    events = encodeEvents(analysisEvents(deck_input.decklist, charts, inline_charts), sse)
+    return StreamingResponse(
+        events,
+        media_type='text/event-stream' if sse else 'application/x-ndjson',
+        # Stop proxies from buffering the stream
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.post("/jobs/analyze-deck", status_code=202)
+async def submit_analysis_job(deck_input: DecklistInput,
+                              charts: ChartFormat = Query('png'),
+                              inline_charts: bool = Query(False)):
+    """
+    Queues a decklist for analysis and returns a job id to poll at
+    GET /jobs/{job_id}. Answers 503 with Retry-After when the queue is full
+    """
+    entries = parseDecklist(deck_input.decklist)
+    try:
+        job = jobQueue.submit(
+            lambda: analysisBody(entries, charts, inline_charts))
+    except QueueFull as e:
         raise HTTPException(
-            status_code=500, detail=f"Error processing file: {str(e)}")
+            status_code=503, detail="Too many queued analyses, try again later",
+            headers={'Retry-After': str(e.retryAfter)})
+
+    return {'job_id': job.id, 'status': job.status,
+            'status_url': f"/jobs/{job.id}"}
+
+
+@app.get("/jobs/{job_id}")
+async def get_analysis_job(job_id: str, wait: float = Query(0, ge=0)):
+    """
+    Status of a queued analysis, with the analysis once it's done.
+    ?wait=N long-polls for up to N seconds (capped by MTG_MAX_JOB_WAIT)
+    """
+    job = await jobQueue.wait(job_id, min(wait, MAX_JOB_WAIT))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+
+    if job.status == 'done':
+        # The result is already serialized JSON, splice it in as is
+        body = b'{"job_id":"%s","status":"done","result":%s}' % (
+            job.id.encode(), job.result)
+        return Response(content=body, media_type='application/json')
+
+    content = {'job_id': job.id, 'status': job.status}
+    if job.status == 'failed':
+        content['error'] = job.error
+        content['error_status'] = job.errorStatus
+    return JSONResponse(content=content)
+
+
+@app.get("/charts/{name}")
+async def get_chart(name: str, request: Request):
+    """
+    A rendered chart by content hash, e.g. /charts/<sha256>.svg
+
+    The URL changes whenever the chart does, so it can be cached forever.
+    Images that were pruned from the store are drawn again from their spec;
+    once that's gone too the URL has expired (410). SVGs are sent gzipped to
+    clients that accept it (PNGs are compressed already)
+    """
+    if not IMAGE_NAME.match(name):
+        raise HTTPException(status_code=404, detail="Unknown chart")
+
+    key, fmt = name.rsplit('.', 1)
+    gzipped = fmt == 'svg' and 'gzip' in request.headers.get('accept-encoding', '')
+    # Each encoding is a different representation, with its own ETag
+    etag = f'"{key}-gzip"' if gzipped else f'"{key}"'
+    headers = {'ETag': etag, 'Cache-Control': CHART_CACHE_CONTROL,
+               'Vary': 'Accept-Encoding'}
+    if ResponseCache.etagMatches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+
+    image = await chartRenderer.loadOrRender(name)
+    if image is None:
+        raise HTTPException(
+            status_code=410, detail="Chart expired, analyze the deck again for a new URL")
+
+    if gzipped:
+        image = chartRenderer.compress(name, image)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(content=image, media_type=CONTENT_TYPES[fmt], headers=headers)
+
 
 if __name__ == "__main__":
     import uvicorn
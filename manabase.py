@@ -0,0 +1,175 @@
+"""
+Mana base sufficiency.
+
+For every colored spell, how likely is it that enough lands producing each of
+its colored pips are among the cards seen by the turn it's meant to be cast
+(its mana value, on the play)? The answers come from hypergeometric tables of
+P(at least k sources among n cards | s sources in the deck), built once per
+deck size and kept around, so a deck's analysis is just table lookups.
+"""
+import re
+from functools import lru_cache
+
+import numpy as np
+
+from aggregate import COLORS, isLandType
+from decklist import MAX_DECK_CARDS
+from drawodds import OPENING_HAND, hypergeometric
+
+
+MANA_COLORS = COLORS[:5]
+
+# Spells are checked on turns 1-10 (anything costing more counts as turn 10)
+MAX_TURN = 10
+# Most colored pips of one color a requirement is checked for
+MAX_PIPS = 7
+
+# Chance of casting on curve a mana base should reach for every spell
+DEFAULT_TARGET = 0.9
+
+# Deck sizes whose tables are built at import: limited, constructed, commander
+COMMON_DECK_SIZES = (40, 60, 99, 100)
+
+_SYMBOL = re.compile(r'\{([^}]+)\}')
+
+
+@lru_cache(maxsize=32)
+def sourceTable(deckSize):
+    """
+    (deckSize + 1, MAX_TURN + 1, MAX_PIPS + 1) array: [sources, turn, pips] is
+    the chance of at least `pips` of the deck's `sources` lands among the
+    cards seen by `turn` on the play
+    """
+    table = np.zeros((deckSize + 1, MAX_TURN + 1, MAX_PIPS + 1))
+    for turn in range(1, MAX_TURN + 1):
+        seen = min(deckSize, OPENING_HAND + turn - 1)
+        for sources in range(deckSize + 1):
+            pmf = [hypergeometric(deckSize, sources, seen, hits)
+                   for hits in range(MAX_PIPS + 1)]
+            # P(at least k) = 1 - P(fewer than k)
+            table[sources, turn] = 1.0 - np.concatenate([[0.0], np.cumsum(pmf)[:-1]])
+    table.setflags(write=False)
+    return table
+
+
+for _deckSize in COMMON_DECK_SIZES:
+    sourceTable(_deckSize)
+
+
+def parsePips(manaCost):
+    """
+    Colored requirements of a mana cost as {requirement: pips}
+
+    A requirement is a color ('G') or, for hybrid pips, the colors that can pay
+    it ('B/G'). Generic, colorless, X, snow, two-or-generic hybrid and
+    Phyrexian pips are left out since they don't need a colored source.
+    Split and double-faced cards use their first half's cost.
+    """
+    requirements = {}
+    frontCost = (manaCost or '').split(' // ')[0]
+    for symbol in _SYMBOL.findall(frontCost):
+        parts = symbol.split('/')
+        if 'P' in parts or not all(part in MANA_COLORS for part in parts):
+            continue
+        key = '/'.join(parts)
+        requirements[key] = requirements.get(key, 0) + 1
+    return requirements
+
+
+def landSources(card):
+    """
+    Colors a land can produce: Scryfall's produced_mana, or its color identity
+    for cards cached without it
+    """
+    produced = card.get('produced_mana')
+    if produced is None:
+        produced = card.get('color_identity') or []
+    return {color for color in produced if color in MANA_COLORS}
+
+
+def minimumSources(table, turn, pips, target):
+    """
+    Fewest sources that reach `target`, or None if even an all-source deck can't
+    """
+    reaching = np.nonzero(table[:, turn, pips] >= target)[0]
+    return int(reaching[0]) if reaching.size else None
+
+
+def analyzeManaBase(cards, target=DEFAULT_TARGET):
+    """
+    Mana base report for a resolved card list (with quantities)
+
+    Returns None for empty decks and decks over MAX_DECK_CARDS. Spells are
+    listed worst first; a spell's on_curve chance is that of its scarcest
+    requirement, so for gold cards it's an upper bound on having every color
+    at once
+    """
+    deckSize = sum(card.get('quantity', 1) for card in cards)
+    if deckSize == 0 or deckSize > MAX_DECK_CARDS:
+        return None
+    table = sourceTable(deckSize)
+
+    lands = [card for card in cards if isLandType(card.get('type_line'))]
+    sources = {color: 0 for color in MANA_COLORS}
+    for land in lands:
+        for color in landSources(land):
+            sources[color] += land.get('quantity', 1)
+
+    def sourcesFor(requirement):
+        colors = set(requirement.split('/'))
+        return sum(land.get('quantity', 1) for land in lands
+                   if landSources(land) & colors)
+
+    spells = []
+    unknown = []
+    colorSummary = {}
+    for card in cards:
+        if isLandType(card.get('type_line')):
+            continue
+        if 'mana_cost' not in card:
+            unknown.append(card['name'])
+            continue
+        requirements = parsePips(card['mana_cost'])
+        if not requirements:
+            continue
+
+        turn = min(MAX_TURN, max(1, int(card.get('cmc') or 0)))
+        probability = {}
+        spellSources = {}
+        for requirement, pips in requirements.items():
+            pips = min(pips, MAX_PIPS)
+            spellSources[requirement] = sourcesFor(requirement)
+            probability[requirement] = float(
+                table[spellSources[requirement], turn, pips])
+
+            if requirement in MANA_COLORS:
+                summary = colorSummary.setdefault(requirement, {
+                    'sources': sources[requirement], 'spells': 0,
+                    'worst_probability': 1.0, 'recommended_sources': 0})
+                summary['spells'] += card.get('quantity', 1)
+                summary['worst_probability'] = min(
+                    summary['worst_probability'], probability[requirement])
+                needed = minimumSources(table, turn, pips, target)
+                summary['recommended_sources'] = max(
+                    summary['recommended_sources'],
+                    needed if needed is not None else deckSize)
+
+        spells.append({
+            'name': card['name'],
+            'mana_cost': card['mana_cost'],
+            'turn': turn,
+            'requirements': requirements,
+            'sources': spellSources,
+            'probability': probability,
+            'on_curve': min(probability.values()),
+        })
+
+    spells.sort(key=lambda spell: (spell['on_curve'], spell['name']))
+    return {
+        'lands': sum(land.get('quantity', 1) for land in lands),
+        'target': target,
+        'sources': sources,
+        'colors': colorSummary,
+        'spells': spells,
+        'unknown_costs': unknown,
+    }
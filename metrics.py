@@ -0,0 +1,163 @@
+"""
+Timing instrumentation for the analysis pipeline.
+
+Code wraps each pipeline stage in `with metrics.stage('name'):`. The duration is
+recorded in a process-wide latency histogram (exported in Prometheus text format
+at /metrics), and also added to the timings of the request currently being
+served, which the HTTP middleware returns as a Server-Timing header. Stages
+that run more than once per request (e.g. one upstream call per batch, charts
+rendered in parallel) add up, so their Server-Timing value is cumulative.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Seconds, from sub-millisecond cache hits up to slow upstream retries
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# {stage: seconds} for the request being served, None outside of a request
+_requestTimings = contextvars.ContextVar('requestTimings', default=None)
+
+
+def formatLabels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels)
+    return "{" + pairs + "}"
+
+
+def formatSamples(name, help, kind, samples):
+    """
+    Prometheus text lines for a metric given as [(labels dict, value)]
+    """
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{formatLabels(sorted(labels.items()))} {value}")
+    return lines
+
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            samples = [(dict(key), value) for key, value in self._values.items()]
+        return formatSamples(self.name, self.help, 'counter', samples)
+
+
+class Histogram:
+    """
+    Cumulative-bucket latency histogram, one series per label set
+    """
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][position] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(key, list(counts), total, count)
+                      for key, (counts, total, count) in self._series.items()]
+        for key, counts, total, count in sorted(series):
+            cumulative = 0
+            for bound, bucketCount in zip(self.buckets, counts):
+                cumulative += bucketCount
+                lines.append(f"{self.name}_bucket"
+                             f"{formatLabels(key + (('le', repr(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{formatLabels(key + (('le', '+Inf'),))} {count}")
+            lines.append(f"{self.name}_sum{formatLabels(key)} {total}")
+            lines.append(f"{self.name}_count{formatLabels(key)} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "mtg_stage_seconds", "Time spent in each analysis pipeline stage")
+REQUEST_SECONDS = Histogram(
+    "mtg_request_seconds", "HTTP request latency by route")
+UPSTREAM_SECONDS = Histogram(
+    "mtg_upstream_request_seconds", "Scryfall request latency by endpoint and status")
+CARD_LOOKUPS = Counter(
+    "mtg_card_lookups_total", "Card name lookups by where they were resolved")
+
+
+def startRequest():
+    """
+    Starts collecting stage timings for the current request, returns them
+    """
+    timings = {}
+    _requestTimings.set(timings)
+    return timings
+
+
+def record(name, seconds):
+    """
+    Records a stage duration that was measured elsewhere (e.g. in a worker process)
+    """
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timings = _requestTimings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name):
+    """
+    Times the body of the with block as pipeline stage `name`
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+def serverTiming(timings, total=None):
+    """
+    Server-Timing header value for a request's {stage: seconds}
+    """
+    parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items()]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+def render(extraLines=()):
+    """
+    Every metric in Prometheus text exposition format
+    """
+    lines = []
+    for metric in (REQUEST_SECONDS, STAGE_SECONDS, UPSTREAM_SECONDS, CARD_LOOKUPS):
+        lines.extend(metric.render())
+    lines.extend(extraLines)
+    return "\n".join(lines) + "\n"
@@ -1,21 +1,45 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File
+import time
+startupStarted = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, UploadFile, File, Query
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List, Dict, Optional
+from typing import List, Dict, Literal
 import io
 import base64
-import json
 import os
 
 import requests
-import pandas as pd
-import time
-import re
-import matplotlib
-matplotlib.use('Agg')  # Use non-interactive backend for Vercel
-import matplotlib.pyplot as plt
-import seaborn as sns
-import numpy as np
+
+# A copy of the main API's decklist.py, bundled with the function (the
+# underscore keeps Vercel from deploying it as an endpoint of its own)
+from _decklist import DecklistTooLarge, formatDecklist, parseDecklist, parseUpload
+
+# pandas, matplotlib and seaborn take seconds to import on a cold serverless
+# instance, so they're only loaded by loadPlotting() when a chart is drawn
+_plotting = None
+
+
+def loadPlotting():
+    """
+    Imports and configures the plotting stack the first time a chart is
+    rendered, returns (pd, plt, sns)
+    """
+    global _plotting
+    if _plotting is None:
+        started = time.perf_counter()
+        import matplotlib
+        matplotlib.use('Agg')  # Use non-interactive backend for Vercel
+        matplotlib.rcParams['svg.fonttype'] = 'none'  # Keeps SVG charts small
+        import matplotlib.pyplot as plt
+        import pandas as pd
+        import seaborn as sns
+
+        # Set theme for charts, once per instance
+        sns.set_theme(style="darkgrid", palette="pastel")
+        _plotting = (pd, plt, sns)
+        print(f"Loaded plotting libraries in {time.perf_counter() - started:.2f}s")
+    return _plotting
 
 app = FastAPI(title="MTG Deck Analyzer", version="1.0.0")
 
@@ -39,79 +63,98 @@ class CardResponse(BaseModel):
     cmc: float
     quantity: int
 
+# charts=none skips rendering, svg returns base64 encoded SVG instead of PNG
+ChartFormat = Literal['none', 'svg', 'png']
+
 class DeckAnalysisResponse(BaseModel):
     cards: List[CardResponse]
     color_distribution: Dict[str, int]
     color_percentages: Dict[str, float]
     mana_curve: Dict[int, int]
+    chart_format: ChartFormat = 'png'
     color_chart_base64: str
     mana_curve_chart_base64: str
     color_breakdown_chart_base64: str
 
-def fetchData(cardname):
+SCRYFALL_API_URL = os.environ.get("SCRYFALL_API_URL", "https://api.scryfall.com").rstrip("/")
+COLLECTION_BATCH_SIZE = 75  # Scryfall's limit for /cards/collection
+
+def cardSummary(carddata):
+    return {
+        'name': carddata.get('name'),
+        'color_identity': carddata.get('color_identity', []),
+        'type_line': carddata.get('type_line'),
+        'cmc': carddata.get('cmc')
+    }
+
+def fetchCollection(cardnames):
     """
-    makes the api call to scryfall to get json data back
+    Resolves card names in batches of 75 with POST /cards/collection.
+    Returns a dict of requested name -> card data, not found names are left out
     """
-    apiurl = "https://api.scryfall.com/cards/named"
-    params = {"exact": cardname}
+    found = {}
+    apiurl = f"{SCRYFALL_API_URL}/cards/collection"
+
+    for start in range(0, len(cardnames), COLLECTION_BATCH_SIZE):
+        batch = cardnames[start:start + COLLECTION_BATCH_SIZE]
+        if start > 0:
+            time.sleep(0.1)  # Rate limiting for Scryfall API
+
+        try:
+            response = requests.post(apiurl, json={"identifiers": [{"name": n} for n in batch]},
+                                     timeout=30)
+            response.raise_for_status()
+            payload = response.json()
+        except requests.RequestException as error:
+            print(f"Error fetching card batch ({len(batch)} cards): {error}")
+            continue
 
-    try:
-        response = requests.get(apiurl, params=params, timeout=10)
-        response.raise_for_status()
-        carddata = response.json()
-
-        return {
-            'name': carddata.get('name'),
-            'color_identity': carddata.get('color_identity', []),
-            'type_line': carddata.get('type_line'),
-            'cmc': carddata.get('cmc')
-        }
-    except requests.RequestException as error:
-        print(f"Error fetching data for '{cardname}': {error}")
-        return None
+        missing = {ident.get('name', '').casefold() for ident in payload.get('not_found', [])}
+        # Found cards come back in identifier order with the not_found ones left out
+        cards = iter(payload.get('data', []))
+        for name in batch:
+            if name.casefold() in missing:
+                continue
+            carddata = next(cards, None)
+            if carddata is not None:
+                found[name] = cardSummary(carddata)
+    return found
 
 def analyzeDecklist(decklist_text):
     """
-    Modified version to work with text input
+    Modified version to work with text input, unique names are resolved in batches
     """
     cardData = []
-    lines = decklist_text.strip().split('\n')
-
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-
-        match = re.match(r'(\d+)\s+(.*)', line)
-        if match:
-            quantity = int(match.group(1))
-            cardName = match.group(2).strip()
-        else:
-            quantity = 1
-            cardName = line.strip()
+    entries = parseDecklist(decklist_text)
+    uniqueNames = list(dict.fromkeys(cardName.casefold() for cardName, _ in entries))
+    resolved = fetchCollection(uniqueNames)
 
+    for cardName, quantity in entries:
         print(f"Processing: {cardName} (x{quantity})")
-        data = fetchData(cardName)
+        data = resolved.get(cardName.casefold())
         if data:
+            data = dict(data)
             data['quantity'] = quantity
             cardData.append(data)
         else:
             print(f"Skipping '{cardName}' due to fetch error or not found")
-        time.sleep(0.1)  # Rate limiting for Scryfall API
     return cardData
 
-def countColorIdentity(dataFrame):
+def isLand(card):
+    return bool(card['type_line']) and 'Land' in card['type_line']
+
+def countColorIdentity(cards):
     """
-    Counts total color identity of the deck
+    Counts total color identity of the deck (a list of card dicts)
     """
     colorCounts = {'W': 0, 'U': 0, 'B': 0, 'R': 0, 'G': 0, 'C': 0}
 
-    for index, row in dataFrame.iterrows():
+    for row in cards:
         quantity = row['quantity']
         identity = row['color_identity']
 
         if not identity:
-            if not (row['type_line'] and "Land" in row['type_line']):
+            if not isLand(row):
                 colorCounts['C'] += quantity
         else:
             for color in identity:
@@ -121,7 +164,17 @@ def countColorIdentity(dataFrame):
                     print(f"Warning: Unexpected color identity '{color}'")
     return colorCounts
 
-def create_color_pie_chart_base64(filteredIDCount):
+def manaCurve(cards):
+    """
+    Number of cards at each (whole) converted mana cost
+    """
+    cmcIntDict = {}
+    for card in cards:
+        cmc = int(card['cmc'] or 0)
+        cmcIntDict[cmc] = cmcIntDict.get(cmc, 0) + card['quantity']
+    return dict(sorted(cmcIntDict.items()))
+
+def create_color_pie_chart_base64(filteredIDCount, fmt='png'):
     """
     Creates color pie chart but returns base64 string
     """
@@ -138,6 +191,7 @@ def create_color_pie_chart_base64(filteredIDCount):
 
     plotColors = [colorMap.get(label, '#CCCCCC') for label in labels]
 
+    pd, plt, sns = loadPlotting()
     plt.figure(figsize=(10, 8))
     plt.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=90, colors=plotColors,
             wedgeprops={'edgecolor': 'black', 'linewidth': 0.5},
@@ -146,20 +200,21 @@ def create_color_pie_chart_base64(filteredIDCount):
     plt.axis('equal')
 
     buffer = io.BytesIO()
-    plt.savefig(buffer, format='png', bbox_inches='tight', dpi=150)
+    plt.savefig(buffer, format=fmt, bbox_inches='tight', dpi=150)
     buffer.seek(0)
     imageBase64 = base64.b64encode(buffer.getvalue()).decode()
     plt.close()
 
     return imageBase64
 
-def create_mana_curve_chart_base64(cmcIntDict):
+def create_mana_curve_chart_base64(cmcIntDict, fmt='png'):
     """
     Creates mana curve chart and returns base64 string
     """
     if not cmcIntDict:
         return ""
 
+    pd, plt, sns = loadPlotting()
     manaCurveData = pd.DataFrame(
         list(cmcIntDict.items()), columns=['CMC', 'Count'])
     manaCurveData['CMC'] = pd.Categorical(manaCurveData['CMC'],
@@ -178,14 +233,14 @@ def create_mana_curve_chart_base64(cmcIntDict):
     plt.tight_layout()
 
     buffer = io.BytesIO()
-    plt.savefig(buffer, format='png', bbox_inches='tight', dpi=150)
+    plt.savefig(buffer, format=fmt, bbox_inches='tight', dpi=150)
     buffer.seek(0)
     imageBase64 = base64.b64encode(buffer.getvalue()).decode()
     plt.close()
 
     return imageBase64
 
-def create_color_breakdown_chart_base64(IDPercentage):
+def create_color_breakdown_chart_base64(IDPercentage, fmt='png'):
     """
     Creates color breakdown chart and returns base64 string
     """
@@ -197,6 +252,7 @@ def create_color_breakdown_chart_base64(IDPercentage):
         'C': '#A9A9A9'
     }
 
+    pd, plt, sns = loadPlotting()
     IDPercentagedf = pd.DataFrame([IDPercentage])
     orderedCol = [c for c in ['W', 'U', 'B', 'R', 'G', 'C'] if c in IDPercentagedf.columns]
     IDPercentagedf = IDPercentagedf[orderedCol]
@@ -214,13 +270,13 @@ def create_color_breakdown_chart_base64(IDPercentage):
     plt.title('Color Identity Breakdown (Percentage of Total Identity)', fontsize=16)
     plt.xlabel('Percentage of Deck Color Identity', fontsize=14)
     plt.ylabel('')
-    plt.xticks(np.arange(0, 101, 10))
+    plt.xticks(range(0, 101, 10))
     plt.xlim(0, 100)
     plt.legend(title='Color', bbox_to_anchor=(1.05, 1), loc='upper left')
     plt.tight_layout()
 
     buffer = io.BytesIO()
-    plt.savefig(buffer, format='png', bbox_inches='tight', dpi=150)
+    plt.savefig(buffer, format=fmt, bbox_inches='tight', dpi=150)
     buffer.seek(0)
     imageBase64 = base64.b64encode(buffer.getvalue()).decode()
     plt.close()
@@ -234,9 +290,11 @@ async def root():
     return {"message": "MTG Deck Analyzer API"}
 
 @app.post("/api/analyze-deck", response_model=DeckAnalysisResponse)
-async def analyze_deck(deck_input: DecklistInput):
+async def analyze_deck(deck_input: DecklistInput, charts: ChartFormat = Query('png')):
     """
     API endpoint that analyzes the deck
+
+    ?charts=none returns only the data, ?charts=svg returns vector charts
     """
     try:
         allCardData = analyzeDecklist(deck_input.decklist)
@@ -244,16 +302,11 @@ async def analyze_deck(deck_input: DecklistInput):
         if not allCardData:
             raise HTTPException(status_code=400, detail="No valid cards found in decklist")
 
-        df = pd.DataFrame(allCardData)
-
-        if 'quantity' not in df.columns:
-            print(f"Warning: 'quantity' not found in DataFrame, making all quantities 1")
-            df['quantity'] = 1
-
-        nonlandDf = df[~df['type_line'].str.contains('Land', na=False)].copy()
-        landDf = df[df['type_line'].str.contains('Land', na=False)].copy()
+        # Plain lists instead of DataFrames, so data-only requests never
+        # have to import pandas
+        nonlandCards = [card for card in allCardData if not isLand(card)]
 
-        deckColorIDCount = countColorIdentity(nonlandDf)
+        deckColorIDCount = countColorIdentity(nonlandCards)
         filteredIDCount = {k: v for k, v in deckColorIDCount.items() if v > 0}
 
         totalIDPoints = sum(filteredIDCount.values())
@@ -261,16 +314,15 @@ async def analyze_deck(deck_input: DecklistInput):
         if totalIDPoints > 0:
             IDPercentage = {k: (v / totalIDPoints) * 100 for k, v in filteredIDCount.items()}
 
-        cmcDataSeries = nonlandDf.groupby('cmc')['quantity'].sum()
-        cmcDict = cmcDataSeries.to_dict()
-        cmcIntDict = {int(k): v for k, v in cmcDict.items()}
+        cmcIntDict = manaCurve(nonlandCards)
 
-        # Set theme for charts
-        sns.set_theme(style="darkgrid", palette="pastel")
-
-        color_chart_base64 = create_color_pie_chart_base64(filteredIDCount)
-        mana_curve_chart_base64 = create_mana_curve_chart_base64(cmcIntDict)
-        color_breakdown_chart_base64 = create_color_breakdown_chart_base64(IDPercentage)
+        color_chart_base64 = ""
+        mana_curve_chart_base64 = ""
+        color_breakdown_chart_base64 = ""
+        if charts != 'none':
+            color_chart_base64 = create_color_pie_chart_base64(filteredIDCount, charts)
+            mana_curve_chart_base64 = create_mana_curve_chart_base64(cmcIntDict, charts)
+            color_breakdown_chart_base64 = create_color_breakdown_chart_base64(IDPercentage, charts)
 
         cards = [CardResponse(**card) for card in allCardData]
 
@@ -279,6 +331,7 @@ async def analyze_deck(deck_input: DecklistInput):
             color_distribution=filteredIDCount,
             color_percentages=IDPercentage,
             mana_curve=cmcIntDict,
+            chart_format=charts,
             color_chart_base64=color_chart_base64,
             mana_curve_chart_base64=mana_curve_chart_base64,
             color_breakdown_chart_base64=color_breakdown_chart_base64
@@ -288,16 +341,23 @@ async def analyze_deck(deck_input: DecklistInput):
         raise HTTPException(status_code=500, detail=f"Error analyzing deck: {str(e)}")
 
 @app.post("/api/upload-decklist")
-async def upload_decklist(file: UploadFile = File(...)):
+async def upload_decklist(file: UploadFile = File(...), charts: ChartFormat = Query('png')):
     """Upload a decklist file and return analysis"""
     try:
-        content = await file.read()
-        decklist_text = content.decode('utf-8')
-        deck_input = DecklistInput(decklist=decklist_text)
-        return await analyze_deck(deck_input)
+        parser = await parseUpload(file)
+        deck_input = DecklistInput(decklist=formatDecklist(parser.entries()))
+        return await analyze_deck(deck_input, charts)
+    except DecklistTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
 
+# Import time of this module, what a cold start costs before the first request
+startupSeconds = time.perf_counter() - startupStarted
+print(f"API module loaded in {startupSeconds:.2f}s")
+
 # For Vercel serverless functions
 def handler(request):
     return app
\ No newline at end of file
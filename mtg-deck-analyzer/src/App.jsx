@@ -1,6 +1,22 @@
 import React, { useState } from 'react';
 import { Upload, BarChart3, PieChart, TrendingUp, FileText, Loader2 } from 'lucide-react';
 
+const API_URL = 'http://localhost:8000';
+
+// Charts come back as URLs (or inline base64 with ?inline_charts=true)
+const chartSrc = (analysis, kind) => {
+  const url = analysis[`${kind}_chart_url`];
+  if (url) {
+    return `${API_URL}${url}`;
+  }
+  const image = analysis[`${kind}_chart_base64`];
+  if (!image) {
+    return '';
+  }
+  const mime = analysis.chart_format === 'svg' ? 'image/svg+xml' : 'image/png';
+  return `data:${mime};base64,${image}`;
+};
+
 const MTGDeckAnalyzer = () => {
   const [decklist, setDecklist] = useState('');
   const [analysis, setAnalysis] = useState(null);
@@ -18,7 +34,7 @@ const MTGDeckAnalyzer = () => {
     setError('');
 
     try {
-      const response = await fetch('http://localhost:8000/analyze-deck', {
+      const response = await fetch(`${API_URL}/analyze-deck`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -52,7 +68,7 @@ const MTGDeckAnalyzer = () => {
       const formData = new FormData();
       formData.append('file', file);
 
-      const response = await fetch('http://localhost:8000/upload-decklist', {
+      const response = await fetch(`${API_URL}/upload-decklist`, {
         method: 'POST',
         body: formData,
       });
@@ -279,12 +295,12 @@ const MTGDeckAnalyzer = () => {
             {/* Charts Grid */}
             <div className="grid grid-cols-1 lg:grid-cols-2 gap-8">
               {/* Color Distribution Chart */}
-              {analysis.color_chart_base64 && (
+              {chartSrc(analysis, 'color') && (
                 <div className="bg-gray-900/90 backdrop-blur-sm rounded border-2 border-green-500/60 p-6 shadow-2xl shadow-green-500/10">
                   <h3 className="text-xl font-bold text-green-400 mb-4 font-mono">COLOR DISTRIBUTION</h3>
                   <div className="flex justify-center">
                     <img
-                      src={`data:image/png;base64,${analysis.color_chart_base64}`}
+                      src={chartSrc(analysis, 'color')}
                       alt="Color Distribution Chart"
                       className="max-w-full h-auto rounded border border-green-500/30"
                     />
@@ -293,12 +309,12 @@ const MTGDeckAnalyzer = () => {
               )}
 
               {/* Mana Curve Chart */}
-              {analysis.mana_curve_chart_base64 && (
+              {chartSrc(analysis, 'mana_curve') && (
                 <div className="bg-gray-900/90 backdrop-blur-sm rounded border-2 border-green-500/60 p-6 shadow-2xl shadow-green-500/10">
                   <h3 className="text-xl font-bold text-green-400 mb-4 font-mono">MANA CURVE</h3>
                   <div className="flex justify-center">
                     <img
-                      src={`data:image/png;base64,${analysis.mana_curve_chart_base64}`}
+                      src={chartSrc(analysis, 'mana_curve')}
                       alt="Mana Curve Chart"
                       className="max-w-full h-auto rounded border border-green-500/30"
                     />
@@ -308,12 +324,12 @@ const MTGDeckAnalyzer = () => {
             </div>
 
             {/* Color Breakdown Chart */}
-            {analysis.color_breakdown_chart_base64 && (
+            {chartSrc(analysis, 'color_breakdown') && (
               <div className="bg-gray-900/90 backdrop-blur-sm rounded border-2 border-green-500/60 p-6 shadow-2xl shadow-green-500/10">
                 <h3 className="text-xl font-bold text-green-400 mb-4 font-mono">COLOR BREAKDOWN PERCENTAGE</h3>
                 <div className="flex justify-center">
                   <img
-                    src={`data:image/png;base64,${analysis.color_breakdown_chart_base64}`}
+                    src={chartSrc(analysis, 'color_breakdown')}
                     alt="Color Breakdown Chart"
                     className="max-w-full h-auto rounded border border-green-500/30"
                   />
@@ -0,0 +1,136 @@
+"""
+Rate limiting for outgoing Scryfall requests.
+
+TokenBucket limits a single process. SharedTokenBucket keeps the bucket in a
+small state file guarded by an exclusive file lock, so every uvicorn worker on
+the machine draws from the same budget. Both can be told to stop sending
+altogether for a while (penalize) when Scryfall answers 429.
+"""
+import asyncio
+import os
+import struct
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows, fall back to a per-process bucket
+    fcntl = None
+
+
+def takeTokens(state, now, rate, capacity, tokens):
+    """
+    Refills a (tokens, updated, blockedUntil) bucket state and tries to take
+    tokens from it. Returns (new state, seconds to wait before retrying)
+    """
+    available, updated, blockedUntil = state
+    if now < blockedUntil:
+        return (available, updated, blockedUntil), blockedUntil - now
+
+    available = min(capacity, available + max(0.0, now - updated) * rate)
+    if available >= tokens:
+        return (available - tokens, now, blockedUntil), 0.0
+    return (available, now, blockedUntil), (tokens - available) / rate
+
+
+class TokenBucket:
+    """
+    Token bucket shared by the blocking and the asyncio fetch paths.
+
+    Tokens refill at `rate` per second up to `capacity`; each request takes one.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._state = (self.capacity, time.time(), 0.0)
+        self._lock = threading.Lock()
+
+    def _update(self, change):
+        """
+        Applies change(state, now) -> (state, result) atomically, returns result
+        """
+        with self._lock:
+            self._state, result = change(self._state, time.time())
+            return result
+
+    def _take(self, tokens):
+        """
+        Takes tokens if they are available, otherwise returns how long to wait
+        """
+        return self._update(lambda state, now: takeTokens(
+            state, now, self.rate, self.capacity, tokens))
+
+    def penalize(self, seconds):
+        """
+        Stops handing out tokens for `seconds`, e.g. after a 429 Retry-After
+        """
+        def block(state, now):
+            _, updated, blockedUntil = state
+            return (0.0, updated, max(blockedUntil, now + seconds)), None
+        self._update(block)
+
+    def acquire(self, tokens=1):
+        """Blocks the calling thread until a request is allowed"""
+        wait = self._take(tokens)
+        while wait > 0:
+            time.sleep(wait)
+            wait = self._take(tokens)
+
+    async def acquireAsync(self, tokens=1):
+        """Waits without blocking the event loop until a request is allowed"""
+        wait = self._take(tokens)
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = self._take(tokens)
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    Token bucket whose state lives in a file shared by every process using the
+    same path, updated under an exclusive flock
+    """
+
+    STATE = struct.Struct("<ddd")  # tokens, updated, blocked until
+
+    def __init__(self, rate, capacity=None, path=None):
+        super().__init__(rate, capacity)
+        self.path = path or os.path.join(tempfile.gettempdir(), "mtg-scryfall-rate.state")
+        self._fd = None
+        self._pid = None
+
+    def _file(self):
+        # Each process needs its own open file description, flock doesn't
+        # exclude processes that inherited the same descriptor through fork
+        if self._fd is None or self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        return self._fd
+
+    def _update(self, change):
+        with self._lock:
+            fd = self._file()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                raw = os.pread(fd, self.STATE.size, 0)
+                if len(raw) == self.STATE.size:
+                    state = self.STATE.unpack(raw)
+                else:
+                    state = (self.capacity, time.time(), 0.0)
+                state, result = change(state, time.time())
+                os.pwrite(fd, self.STATE.pack(*state), 0)
+                return result
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def limiterFromEnv(rate, capacity):
+    """
+    A bucket shared across worker processes where file locks are available
+    (unless SCRYFALL_SHARED_RATE_LIMIT=0), a per-process bucket otherwise
+    """
+    if fcntl is not None and os.environ.get("SCRYFALL_SHARED_RATE_LIMIT", "1") != "0":
+        return SharedTokenBucket(rate, capacity,
+                                 path=os.environ.get("SCRYFALL_RATE_STATE_PATH"))
+    return TokenBucket(rate, capacity)
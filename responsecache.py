@@ -0,0 +1,81 @@
+"""
+Whole-response cache for deck analyses.
+
+Responses are stored as encoded JSON keyed by the normalized decklist hash
+(see decklist.decklistKey). Their ETag is a hash of the body itself, so it
+changes whenever the analysis does. Each entry also lists the chart images the
+body links to, so it can be dropped once those have expired.
+"""
+import hashlib
+import os
+import time
+
+from cardcache import LRUCache
+
+
+class ResponseCache:
+    """
+    LRU of encoded analysis responses with a TTL, bounded by total bytes
+    """
+
+    def __init__(self, ttl=3600, maxBytes=128 * 1024 * 1024, maxEntries=10000):
+        self.ttl = ttl
+        self.entries = LRUCache(maxEntries, maxBytes=maxBytes,
+                                sizeOf=lambda entry: len(entry[1]))
+        self.notModified = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            ttl=float(os.environ.get("MTG_RESPONSE_CACHE_TTL", 3600)),
+            maxBytes=int(os.environ.get(
+                "MTG_RESPONSE_CACHE_BYTES", 128 * 1024 * 1024)),
+        )
+
+    @staticmethod
+    def etagFor(body):
+        return f'"{hashlib.sha256(body).hexdigest()}"'
+
+    def lookup(self, key):
+        """
+        Returns (cached body, chart names it links to) for key, or None if
+        missing or expired
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        createdAt, body, charts = entry
+        if time.time() - createdAt >= self.ttl:
+            self.entries.pop(key)
+            return None
+        return body, charts
+
+    def get(self, key):
+        """
+        Returns the cached body for key, or None if missing or expired
+        """
+        entry = self.lookup(key)
+        return entry[0] if entry is not None else None
+
+    def put(self, key, body, charts=()):
+        self.entries.put(key, (time.time(), body, tuple(charts)))
+
+    def drop(self, key):
+        self.entries.pop(key)
+
+    @staticmethod
+    def etagMatches(ifNoneMatch, etag):
+        """
+        Checks an If-None-Match header (possibly a list, possibly weak) against etag
+        """
+        if not ifNoneMatch:
+            return False
+        if ifNoneMatch.strip() == '*':
+            return True
+        candidates = [tag.strip() for tag in ifNoneMatch.split(',')]
+        return any(tag.removeprefix('W/') == etag for tag in candidates)
+
+    def stats(self):
+        stats = self.entries.stats()
+        stats['not_modified'] = self.notModified
+        return stats
@@ -0,0 +1,309 @@
+"""
+Helpers for talking to the Scryfall API.
+
+The base URL can be pointed at a local stand-in server with SCRYFALL_API_URL,
+which is how the batch resolver is exercised without hitting api.scryfall.com.
+"""
+import asyncio
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+
+import metrics
+from aggregate import compactFields
+from ratelimit import limiterFromEnv
+
+
+SCRYFALL_API_URL = os.environ.get(
+    "SCRYFALL_API_URL", "https://api.scryfall.com").rstrip("/")
+
+# Scryfall caps /cards/collection at 75 identifiers per request
+COLLECTION_BATCH_SIZE = 75
+
+# Scryfall asks for 50-100ms between requests, i.e. about 10 per second
+RATE_LIMIT = float(os.environ.get("SCRYFALL_RATE_LIMIT", 10))
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("SCRYFALL_MAX_CONCURRENCY", 4))
+
+# Scryfall asks API clients to identify themselves
+HEADERS = {"User-Agent": "MTGDeckAnalyzer/1.0", "Accept": "application/json"}
+
+# Responses worth retrying, with jittered exponential backoff (or Retry-After)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = int(os.environ.get("SCRYFALL_MAX_RETRIES", 4))
+BACKOFF_BASE = 0.5
+
+# One limiter for every request this machine makes, sync or async, shared by
+# all worker processes where possible
+limiter = limiterFromEnv(rate=RATE_LIMIT, capacity=2)
+
+# Upstream call counters for this process
+upstreamStats = {'requests': 0, 'retries': 0, 'throttled': 0, 'errors': 0}
+
+session = requests.Session()
+session.headers.update(HEADERS)
+
+_asyncClient = None
+_asyncSemaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+
+def cardSummary(carddata):
+    """
+    Grabs all the data we use from a scryfall card object, plus the compact
+    color mask / land flag used for aggregation
+    """
+    faces = carddata.get('card_faces') or [{}]
+    summary = {
+        'name': carddata.get('name'),
+        'color_identity': carddata.get('color_identity', []),
+        'type_line': carddata.get('type_line'),
+        'cmc': carddata.get('cmc'),
+        # Double-faced cards only have costs on their faces, use the front's
+        'mana_cost': carddata.get('mana_cost', faces[0].get('mana_cost', '')),
+        'produced_mana': carddata.get('produced_mana', []),
+    }
+    summary.update(compactFields(summary))
+    return summary
+
+
+def parseRetryAfter(value):
+    """
+    Retry-After is either a number of seconds or an HTTP date
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retryDelay(attempt, retryAfter=None):
+    """
+    How long to wait before retry number `attempt`, with up to 50% jitter so
+    workers that were throttled together don't retry together
+    """
+    base = retryAfter if retryAfter is not None else BACKOFF_BASE * (2 ** attempt)
+    return base + random.uniform(0, base * 0.5)
+
+
+def shouldRetry(statusCode, headers, attempt):
+    """
+    Decides whether a response is retried, returning the delay or None.
+    A 429 also pauses the shared limiter so every worker backs off.
+    """
+    if statusCode not in RETRY_STATUSES or attempt >= MAX_RETRIES:
+        return None
+    retryAfter = parseRetryAfter(headers.get('Retry-After'))
+    if statusCode == 429:
+        upstreamStats['throttled'] += 1
+        limiter.penalize(retryAfter if retryAfter is not None else 1.0)
+    upstreamStats['retries'] += 1
+    return retryDelay(attempt, retryAfter)
+
+
+def recordUpstream(url, status, started):
+    """
+    Records the latency of one upstream request, status is 'error' when it failed
+    """
+    seconds = time.perf_counter() - started
+    metrics.UPSTREAM_SECONDS.observe(seconds, endpoint=urlsplit(url).path, status=status)
+    metrics.record('upstream', seconds)
+
+
+def requestWithRetry(method, url, **kwargs):
+    """
+    Sends a rate-limited request with the shared session, retrying throttled,
+    failed and 5xx responses instead of giving up on the first one
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        with metrics.stage('rate_limit_wait'):
+            limiter.acquire()
+        upstreamStats['requests'] += 1
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.ConnectionError:
+            recordUpstream(url, 'error', started)
+            if attempt >= MAX_RETRIES:
+                upstreamStats['errors'] += 1
+                raise
+            upstreamStats['retries'] += 1
+            time.sleep(retryDelay(attempt))
+            continue
+
+        recordUpstream(url, response.status_code, started)
+        delay = shouldRetry(response.status_code, response.headers, attempt)
+        if delay is None:
+            return response
+        print(f"Scryfall returned {response.status_code}, retrying in {delay:.2f}s")
+        time.sleep(delay)
+
+
+async def requestWithRetryAsync(client, method, url, **kwargs):
+    """
+    Async version of requestWithRetry for the pooled httpx client
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        with metrics.stage('rate_limit_wait'):
+            await limiter.acquireAsync()
+        upstreamStats['requests'] += 1
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.TransportError:
+            recordUpstream(url, 'error', started)
+            if attempt >= MAX_RETRIES:
+                upstreamStats['errors'] += 1
+                raise
+            upstreamStats['retries'] += 1
+            await asyncio.sleep(retryDelay(attempt))
+            continue
+
+        recordUpstream(url, response.status_code, started)
+        delay = shouldRetry(response.status_code, response.headers, attempt)
+        if delay is None:
+            return response
+        print(f"Scryfall returned {response.status_code}, retrying in {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def collectionPayload(batch):
+    return {"identifiers": [{"name": name} for name in batch]}
+
+
+def mapCollection(batch, payload, found, notFound):
+    """
+    Maps a /cards/collection response back onto the names that were requested
+    """
+    missing = {ident.get('name', '').casefold()
+               for ident in payload.get('not_found', [])}
+
+    # Scryfall returns found cards in the same order as the identifiers,
+    # with the not_found ones left out
+    cards = iter(payload.get('data', []))
+    for name in batch:
+        if name.casefold() in missing:
+            notFound.append(name)
+            continue
+        carddata = next(cards, None)
+        if carddata is None:
+            notFound.append(name)
+            continue
+        found[name] = cardSummary(carddata)
+
+
+def fetchCollection(cardnames, batchSize=COLLECTION_BATCH_SIZE):
+    """
+    Resolves many card names with POST /cards/collection, up to 75 per request.
+
+    Returns (found, notFound, failed) where found maps each requested name to
+    its card summary, notFound lists the requested names scryfall didn't
+    recognise and failed the ones that couldn't be fetched because the request
+    failed (even after retrying), which may well be real cards.
+    """
+    found = {}
+    notFound = []
+    failed = []
+    apiurl = f"{SCRYFALL_API_URL}/cards/collection"
+
+    for batch in chunked(list(cardnames), batchSize):
+        try:
+            response = requestWithRetry(
+                'POST', apiurl, json=collectionPayload(batch), timeout=30)
+            response.raise_for_status()
+            payload = response.json()
+        except requests.RequestException as error:
+            print(f"Error fetching card batch ({len(batch)} cards): {error}")
+            failed.extend(batch)
+            continue
+        mapCollection(batch, payload, found, notFound)
+
+    return found, notFound, failed
+
+
+def getAsyncClient():
+    """
+    Returns the process-wide pooled async HTTP client, creating it on first use
+    """
+    global _asyncClient
+    if _asyncClient is None or _asyncClient.is_closed:
+        _asyncClient = httpx.AsyncClient(
+            base_url=SCRYFALL_API_URL,
+            headers=HEADERS,
+            timeout=30,
+            limits=httpx.Limits(max_connections=MAX_CONCURRENT_REQUESTS,
+                                max_keepalive_connections=MAX_CONCURRENT_REQUESTS))
+    return _asyncClient
+
+
+async def closeAsyncClient():
+    global _asyncClient
+    if _asyncClient is not None:
+        await _asyncClient.aclose()
+        _asyncClient = None
+
+
+async def fetchBatchAsync(client, batch):
+    """
+    Fetches one /cards/collection batch, returns (found, notFound, failed)
+    """
+    found = {}
+    notFound = []
+    async with _asyncSemaphore:
+        try:
+            response = await requestWithRetryAsync(
+                client, 'POST', "/cards/collection", json=collectionPayload(batch))
+            response.raise_for_status()
+            payload = response.json()
+        except httpx.HTTPError as error:
+            print(f"Error fetching card batch ({len(batch)} cards): {error}")
+            return found, notFound, list(batch)
+    mapCollection(batch, payload, found, notFound)
+    return found, notFound, []
+
+
+async def iterCollectionAsync(cardnames, batchSize=COLLECTION_BATCH_SIZE):
+    """
+    Sends all batches concurrently and yields (found, notFound, failed) for each one
+    as soon as it completes
+    """
+    client = getAsyncClient()
+    tasks = [asyncio.ensure_future(fetchBatchAsync(client, batch))
+             for batch in chunked(list(cardnames), batchSize)]
+    try:
+        for nextBatch in asyncio.as_completed(tasks):
+            yield await nextBatch
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def fetchCollectionAsync(cardnames, batchSize=COLLECTION_BATCH_SIZE):
+    """
+    Async version of fetchCollection. Batches are sent concurrently, bounded by
+    MAX_CONCURRENT_REQUESTS and the shared token bucket, so the event loop keeps
+    serving other requests while cards resolve.
+    """
+    found = {}
+    notFound = []
+    failed = []
+    async for batchFound, batchNotFound, batchFailed in iterCollectionAsync(
+            cardnames, batchSize):
+        found.update(batchFound)
+        notFound.extend(batchNotFound)
+        failed.extend(batchFailed)
+    return found, notFound, failed
@@ -0,0 +1,165 @@
+"""
+Deck editing sessions.
+
+A session remembers what the last analysis of a deck worked out: the resolved
+cards, the running color and mana curve totals, and the rendered charts. When
+an edited list comes in, only names that weren't looked up before are
+resolved, the totals are adjusted by the quantity changes, and charts whose
+data didn't change are reused.
+
+Sessions live in the memory of the worker that created them, so with several
+workers the client needs sticky routing (or starts a new session on a 404).
+"""
+import asyncio
+import os
+import time
+import uuid
+
+from aggregate import RunningTotals, isLandType
+from cardcache import LRUCache
+from decklist import normalizeDecklist
+
+
+class DeckSession:
+    def __init__(self, sessionId):
+        self.id = sessionId
+        # Edits of one session are applied one at a time
+        self.lock = asyncio.Lock()
+        # {normalized name: copies} of the current list
+        self.quantities = {}
+        # {normalized name: card data}, None for names that weren't found
+        self.resolved = {}
+        self.totals = RunningTotals()
+        # Last rendered charts, with the (format, inline) they were rendered for
+        self.chartOptions = None
+        self.chartData = {}
+        self.chartImages = {}
+        self.oddsKey = None
+        self.odds = None
+        self.updatedAt = time.time()
+
+    def unknownNames(self, entries):
+        """
+        Normalized names in `entries` that this session hasn't looked up yet
+        """
+        return [name for name, _ in normalizeDecklist(entries)
+                if name not in self.resolved]
+
+    def update(self, entries, resolved, failed=()):
+        """
+        Works out the session's state for the list in `entries` given the newly
+        resolved cards, adjusting the totals by the quantity changes, without
+        changing the session: pass the state to commit() once the rest of the
+        analysis went through
+
+        Names in `failed` (Scryfall couldn't be reached) aren't recorded, so
+        the next update looks them up again
+
+        Returns (state, the names that were added, removed or changed quantity)
+        """
+        newQuantities = dict(normalizeDecklist(entries))
+        newResolved = dict(self.resolved)
+        for name in newQuantities:
+            if name not in newResolved and name not in failed:
+                newResolved[name] = resolved.get(name)
+        totals = self.totals.copy()
+
+        def displayName(name):
+            card = newResolved.get(name)
+            return card['name'] if card else name
+
+        changes = {'added': [], 'removed': [], 'changed': []}
+        for name in sorted(newQuantities.keys() | self.quantities.keys()):
+            card = newResolved.get(name)
+            if card and name not in self.resolved:
+                # Copies kept from an update that couldn't fetch the card
+                totals.add(card, self.quantities.get(name, 0))
+            delta = newQuantities.get(name, 0) - self.quantities.get(name, 0)
+            if delta == 0:
+                continue
+            if name not in self.quantities:
+                changes['added'].append(displayName(name))
+            elif name not in newQuantities:
+                changes['removed'].append(displayName(name))
+            else:
+                changes['changed'].append(displayName(name))
+            if card:
+                totals.add(card, delta)
+
+        state = {'quantities': newQuantities, 'resolved': newResolved, 'totals': totals}
+        return state, changes
+
+    def commit(self, state):
+        self.quantities = state['quantities']
+        self.resolved = state['resolved']
+        self.totals = state['totals']
+        self.updatedAt = time.time()
+
+    def staleCharts(self, chartData, options):
+        """
+        Kinds of chart whose data differs from the last render (all of them
+        when the chart format changed)
+        """
+        if options != self.chartOptions:
+            return list(chartData)
+        return [kind for kind, data in chartData.items()
+                if self.chartData.get(kind) != data]
+
+    def storeCharts(self, chartData, options, images):
+        if options != self.chartOptions:
+            self.chartImages = {}
+        self.chartOptions = options
+        self.chartData = chartData
+        self.chartImages.update(images)
+
+
+def oddsKey(cards):
+    """
+    What the draw odds depend on: how many copies there are of each (is land,
+    mana value) pair
+    """
+    counts = {}
+    for card in cards:
+        key = (isLandType(card.get('type_line')), card.get('cmc'))
+        counts[key] = counts.get(key, 0) + card.get('quantity', 1)
+    return tuple(sorted(counts.items(), key=repr))
+
+
+class SessionStore:
+    """
+    LRU of deck sessions, dropped after `ttl` seconds without an edit
+    """
+
+    def __init__(self, ttl=1800, maxSessions=1000):
+        self.ttl = ttl
+        self.sessions = LRUCache(maxSessions)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            ttl=float(os.environ.get("MTG_SESSION_TTL", 1800)),
+            maxSessions=int(os.environ.get("MTG_MAX_SESSIONS", 1000)),
+        )
+
+    def create(self):
+        session = DeckSession(uuid.uuid4().hex)
+        self.sessions.put(session.id, session)
+        return session
+
+    def get(self, sessionId):
+        """
+        Returns the session, or None if it's unknown or expired
+        """
+        session = self.sessions.get(sessionId)
+        if session is None:
+            return None
+        if time.time() - session.updatedAt >= self.ttl:
+            self.sessions.pop(sessionId)
+            return None
+        return session
+
+    def delete(self, sessionId):
+        return self.sessions.pop(sessionId) is not None
+
+    def stats(self):
+        return self.sessions.stats()
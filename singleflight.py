@@ -0,0 +1,82 @@
+"""
+Request coalescing for card lookups.
+
+When several requests need the same card at the same time only the first one
+(the leader) goes upstream; the others wait on the leader's future and share
+its result. A leader that gives up without a result (e.g. its request was
+cancelled) hands its waiters RETRY instead, and they claim the key themselves.
+"""
+import asyncio
+
+
+# Result for waiters whose leader went away without fetching the key
+RETRY = object()
+# Result for waiters whose leader tried and failed to fetch the key
+FAILED = object()
+
+
+class SingleFlight:
+    """
+    Tracks in-flight lookups by key for the running event loop
+    """
+
+    def __init__(self):
+        self._inFlight = {}
+        self.started = 0
+        self.coalesced = 0
+
+    def claim(self, keys):
+        """
+        Splits keys into (owned, waiting): owned keys weren't in flight and
+        must be fetched by the caller, who then resolves them; waiting maps
+        keys someone else is already fetching to their futures
+        """
+        loop = asyncio.get_running_loop()
+        owned = []
+        waiting = {}
+        for key in dict.fromkeys(keys):
+            future = self._inFlight.get(key)
+            if future is None:
+                self._inFlight[key] = loop.create_future()
+                owned.append(key)
+                self.started += 1
+            else:
+                waiting[key] = future
+                self.coalesced += 1
+        return owned, waiting
+
+    def resolve(self, key, value):
+        """
+        Hands the result for key to everyone waiting on it
+        """
+        future = self._inFlight.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(value)
+
+    def release(self, keys):
+        """
+        Resolves any of keys still in flight with RETRY, e.g. after the
+        leader was cancelled, so the waiters fetch them themselves
+        """
+        for key in keys:
+            self.resolve(key, RETRY)
+
+    async def wait(self, waiting):
+        """
+        Waits for the futures returned by claim, returns {key: value}
+
+        Futures are shielded so a waiter going away doesn't cancel the
+        result for everyone else
+        """
+        values = await asyncio.gather(
+            *(asyncio.shield(future) for future in waiting.values()))
+        return dict(zip(waiting, values))
+
+    def stats(self):
+        total = self.started + self.coalesced
+        return {
+            'in_flight': len(self._inFlight),
+            'upstream_lookups': self.started,
+            'coalesced': self.coalesced,
+            'coalesced_rate': (self.coalesced / total) if total else 0.0,
+        }
@@ -0,0 +1,17 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Keep the server module's caches and stores out of the real ones, and away
+# from the real Scryfall
+_tmpDir = tempfile.mkdtemp(prefix="mtg-tests-")
+os.environ.setdefault("SCRYFALL_API_URL", "http://127.0.0.1:9")
+os.environ.setdefault("SCRYFALL_MAX_RETRIES", "0")
+os.environ.setdefault("SCRYFALL_RATE_STATE_PATH", os.path.join(_tmpDir, "rate.state"))
+os.environ.setdefault("MTG_CARD_CACHE_PATH", os.path.join(_tmpDir, "cards.sqlite3"))
+os.environ.setdefault("MTG_CARD_INDEX_PATH", os.path.join(_tmpDir, "no_index.bin"))
+os.environ.setdefault("MTG_CHART_DIR", os.path.join(_tmpDir, "charts"))
+os.environ.setdefault("MTG_CHART_WORKERS", "0")
@@ -0,0 +1,31 @@
+from fastapi.testclient import TestClient
+
+import main
+from decklist import MAX_DECK_CARDS
+
+
+SERUM_VISIONS = {'name': 'Serum Visions', 'type_line': 'Sorcery', 'cmc': 1.0,
+                 'mana_cost': '{U}', 'color_identity': ['U'], 'produced_mana': []}
+
+
+def test_oversized_deck_gets_its_own_error(monkeypatch):
+    async def iterCollection(cardnames):
+        yield {name: dict(SERUM_VISIONS) for name in cardnames}, [], []
+
+    monkeypatch.setattr(main.scryfall, 'iterCollectionAsync', iterCollection)
+    response = TestClient(main.app).post('/analyze-decks', json={'decklists': [
+        f"{MAX_DECK_CARDS + 1} Serum Visions", "4 Serum Visions"]})
+    assert response.status_code == 200
+    oversized, deck = response.json()['decks']
+    assert oversized['index'] == 0 and str(MAX_DECK_CARDS) in oversized['error']
+    assert deck['index'] == 1 and deck['error'] is None
+    assert deck['mana_curve'] == {'1': 4}
+    assert response.json()['field']['deck_count'] == 1
+
+
+def test_batch_of_only_oversized_decks():
+    response = TestClient(main.app).post('/analyze-decks', json={'decklists': [
+        "4 Serum Visions\n" * 80000]})
+    assert response.status_code == 200
+    assert 'bytes' in response.json()['decks'][0]['error']
+    assert response.json()['field']['deck_count'] == 0
@@ -0,0 +1,29 @@
+from cardcache import CardCache
+
+
+def card(name):
+    return {'name': name, 'type_line': 'Instant', 'cmc': 1.0, 'mana_cost': '{R}'}
+
+
+def test_memory_hits_keep_cards_from_eviction(tmp_path):
+    cache = CardCache(str(tmp_path / "cards.sqlite3"), maxEntries=2, evictEvery=1)
+    cache.put('Lightning Bolt', card('Lightning Bolt'))
+    cache.put('Shock', card('Shock'))
+    # Served from memory, never read from the file again
+    assert cache.get('Lightning Bolt') is not None
+
+    cache.put('Lava Spike', card('Lava Spike'))
+    cache.memory.clear()
+    assert cache.get('Lightning Bolt') is not None
+    assert cache.get('Shock') is None
+    assert cache.get('Lava Spike') is not None
+
+
+def test_row_count_is_checked_every_few_stores(tmp_path):
+    cache = CardCache(str(tmp_path / "cards.sqlite3"), maxEntries=2, evictEvery=3)
+    for name in ('Opt', 'Shock', 'Ponder'):
+        cache.put(name, card(name))
+    assert cache.stats()['disk_size'] == 2
+    cache.put('Preordain', card('Preordain'))
+    assert cache.stats()['disk_size'] == 3
+    assert cache.evictions == 1
@@ -0,0 +1,84 @@
+import io
+import json
+
+import pytest
+
+from cardindex import CardIndex, buildIndex, iterJsonArray
+
+
+BULK = [
+    {'name': 'Lightning Bolt', 'layout': 'normal', 'type_line': 'Instant', 'cmc': 1.0,
+     'mana_cost': '{R}', 'color_identity': ['R'], 'produced_mana': []},
+    {'name': 'Fire // Ice', 'layout': 'split', 'type_line': 'Instant // Instant',
+     'cmc': 4.0, 'mana_cost': '{1}{R} // {1}{U}', 'color_identity': ['R', 'U'],
+     'card_faces': [{'name': 'Fire', 'mana_cost': '{1}{R}'},
+                    {'name': 'Ice', 'mana_cost': '{1}{U}'}]},
+    {'name': 'Delver of Secrets // Insectile Aberration', 'layout': 'transform',
+     'cmc': 1.0, 'color_identity': ['U'],
+     'card_faces': [{'name': 'Delver of Secrets', 'type_line': 'Creature — Human Wizard',
+                     'mana_cost': '{U}'},
+                    {'name': 'Insectile Aberration', 'type_line': 'Creature — Human Insect',
+                     'mana_cost': ''}]},
+    {'name': 'Breeding Pool', 'layout': 'normal', 'type_line': 'Land — Forest Island',
+     'cmc': 0.0, 'mana_cost': '', 'color_identity': ['G', 'U'],
+     'produced_mana': ['G', 'U']},
+    # Same name as a real card, but not one
+    {'name': 'Lightning Bolt', 'layout': 'art_series', 'type_line': 'Card // Card'},
+    {'name': 'Ice', 'layout': 'token', 'type_line': 'Token Creature'},
+]
+
+
+@pytest.fixture
+def index(tmp_path):
+    bulkPath = tmp_path / "oracle-cards.json"
+    bulkPath.write_text(json.dumps(BULK))
+    indexPath = str(tmp_path / "card_index.bin")
+    assert buildIndex(str(bulkPath), indexPath) == 4
+    return CardIndex(indexPath)
+
+
+def test_lookup_round_trip(index):
+    assert index.get('lightning bolt') == {
+        'name': 'Lightning Bolt', 'color_identity': ['R'], 'type_line': 'Instant',
+        'cmc': 1.0, 'mana_cost': '{R}', 'produced_mana': [], 'color_mask': 1 << 3,
+        'is_land': False,
+    }
+    land = index.get('Breeding Pool')
+    assert land['is_land']
+    assert land['produced_mana'] == ['U', 'G']
+    assert index.get('Counterspell') is None
+    assert index.stats() == {'cards': 4, 'keys': 8, 'hits': 2, 'misses': 1}
+
+
+def test_face_names_find_the_whole_card(index):
+    assert index.get('Fire')['name'] == 'Fire // Ice'
+    # Face names don't lose to the token that shares one of them
+    assert index.get('ice')['name'] == 'Fire // Ice'
+    assert index.get('Fire // Ice')['color_identity'] == ['U', 'R']
+
+    delver = index.get('Insectile Aberration')
+    assert delver['name'] == 'Delver of Secrets // Insectile Aberration'
+    # Faces without a card-level type line or cost take them from the faces
+    assert delver['type_line'] == 'Creature — Human Wizard // Creature — Human Insect'
+    assert delver['mana_cost'] == '{U}'
+    assert index.get('delver of secrets') == delver
+
+
+def test_key_names_cover_faces(index):
+    keys = dict(index.keyNames())
+    assert keys['fire'] == 'Fire // Ice'
+    assert keys['insectile aberration'] == 'Delver of Secrets // Insectile Aberration'
+    assert list(keys) == sorted(keys)
+
+
+def test_json_array_is_read_in_chunks():
+    text = json.dumps(BULK, indent=2)
+    assert list(iterJsonArray(io.StringIO(text), chunkSize=7)) == BULK
+    assert list(iterJsonArray(io.StringIO("[]"))) == []
+
+
+def test_older_index_is_ignored(tmp_path, monkeypatch):
+    path = tmp_path / "card_index.bin"
+    path.write_bytes(b"MTGIDX\x00\x00" + b"\x01\x00\x00\x00" + b"\x00" * 8)
+    monkeypatch.setenv("MTG_CARD_INDEX_PATH", str(path))
+    assert CardIndex.from_env() is None
@@ -0,0 +1,56 @@
+from fastapi.testclient import TestClient
+
+import cardlookup
+import main
+
+
+SHOCK = {'name': 'Shock', 'type_line': 'Instant', 'cmc': 1.0, 'mana_cost': '{R}',
+         'color_identity': ['R'], 'produced_mana': []}
+HELIX = {'name': 'Lightning Helix', 'type_line': 'Instant', 'cmc': 2.0, 'mana_cost': '{R}{W}',
+         'color_identity': ['R', 'W'], 'produced_mana': []}
+NEW_CARD = {'name': 'Shockwave Tyrant', 'type_line': 'Creature — Dragon', 'cmc': 5.0,
+            'mana_cost': '{3}{R}{R}', 'color_identity': ['R'], 'produced_mana': []}
+
+
+class OfflineIndex:
+    """
+    Stands in for a bulk data index that predates a card
+    """
+
+    def get(self, cardname):
+        return dict(SHOCK) if cardname == 'shock' else None
+
+    def keyNames(self):
+        return [('shock', 'Shock')]
+
+
+def fakeScryfall(monkeypatch, cards):
+    requested = []
+
+    async def iterCollection(cardnames):
+        requested.extend(cardnames)
+        found = {name: dict(cards[name]) for name in cardnames if name in cards}
+        yield found, [name for name in cardnames if name not in found], []
+
+    monkeypatch.setattr(main.scryfall, 'iterCollectionAsync', iterCollection)
+    return requested
+
+
+def test_names_missing_from_the_index_are_asked_for(monkeypatch):
+    monkeypatch.setattr(cardlookup, 'cardIndex', OfflineIndex())
+    requested = fakeScryfall(monkeypatch, {'shockwave tyrant': NEW_CARD})
+
+    response = TestClient(main.app).post(
+        '/analyze-deck?charts=none', json={'decklist': "4 Shock\n2 Shockwave Tyrant"})
+    assert requested == ['shockwave tyrant']
+    assert [card['name'] for card in response.json()['cards']] == ['Shock', 'Shockwave Tyrant']
+    assert response.json()['corrections'] == {}
+
+
+def test_corrected_line_merges_with_the_same_card(monkeypatch):
+    fakeScryfall(monkeypatch, {'lightning helix': HELIX})
+    response = TestClient(main.app).post(
+        '/analyze-deck?charts=none', json={'decklist': "2 Lightning Helix\n2 Lightnig Helix"})
+    assert [(card['name'], card['quantity']) for card in response.json()['cards']] \
+        == [('Lightning Helix', 4)]
+    assert response.json()['corrections'] == {'Lightnig Helix': 'Lightning Helix'}
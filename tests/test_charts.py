@@ -0,0 +1,68 @@
+import asyncio
+import os
+
+from fastapi.testclient import TestClient
+
+import main
+from charts import SPEC_DIR
+
+
+def renderCurve():
+    return asyncio.run(main.chartRenderer.renderImage('mana_curve', {1: 4, 2: 3}, 'svg'))
+
+
+def evict(name):
+    main.chartRenderer.cache.pop(name)
+    os.remove(os.path.join(main.chartRenderer.storeDir, name))
+
+
+def expire(name):
+    evict(name)
+    main.chartRenderer.specs.pop(name)
+    os.remove(os.path.join(main.chartRenderer.storeDir, SPEC_DIR, f"{name}.json"))
+
+
+def test_pruned_chart_is_drawn_again():
+    name, image = renderCurve()
+    evict(name)
+    response = TestClient(main.app).get(f'/charts/{name}',
+                                        headers={'Accept-Encoding': 'identity'})
+    assert response.status_code == 200
+    assert response.content == image
+
+
+def test_expired_chart_is_gone():
+    name, _ = renderCurve()
+    expire(name)
+    assert TestClient(main.app).get(f'/charts/{name}').status_code == 410
+
+
+def test_encodings_have_their_own_etags():
+    name, _ = renderCurve()
+    client = TestClient(main.app)
+    gzipped = client.get(f'/charts/{name}', headers={'Accept-Encoding': 'gzip'})
+    identity = client.get(f'/charts/{name}', headers={'Accept-Encoding': 'identity'})
+    assert gzipped.headers['content-encoding'] == 'gzip'
+    assert gzipped.headers['etag'] != identity.headers['etag']
+    notModified = client.get(f'/charts/{name}', headers={
+        'Accept-Encoding': 'identity', 'If-None-Match': gzipped.headers['etag']})
+    assert notModified.status_code == 200
+
+
+def test_cached_analysis_with_expired_charts_is_rebuilt(monkeypatch):
+    bolt = {'name': 'Lightning Bolt', 'type_line': 'Instant', 'cmc': 1.0, 'mana_cost': '{R}',
+            'color_identity': ['R'], 'produced_mana': []}
+
+    async def iterCollection(cardnames):
+        yield {name: dict(bolt) for name in cardnames}, [], []
+
+    monkeypatch.setattr(main.scryfall, 'iterCollectionAsync', iterCollection)
+    client = TestClient(main.app)
+    decklist = {'decklist': "4 Lightning Bolt"}
+    first = client.post('/analyze-deck?charts=svg', json=decklist).json()
+    chartUrl = first['mana_curve_chart_url']
+    expire(chartUrl.rsplit('/', 1)[-1])
+
+    second = client.post('/analyze-deck?charts=svg', json=decklist).json()
+    assert second['mana_curve_chart_url'] == chartUrl
+    assert client.get(chartUrl).status_code == 200
@@ -0,0 +1,43 @@
+import json
+import os
+
+import corpus
+import main
+
+
+def card(name):
+    return {'name': name, 'type_line': 'Sorcery', 'cmc': 2.0, 'mana_cost': '{1}{G}',
+            'color_identity': ['G'], 'produced_mana': []}
+
+
+def test_chunks_with_unreachable_cards_are_redone(tmp_path, monkeypatch):
+    decks = tmp_path / "decks"
+    decks.mkdir()
+    (decks / "a.txt").write_text("4 Corpus Growth\n4 Corpus Harvest\n")
+    (decks / "b.txt").write_text("4 Corpus Growth\n")
+    output = str(tmp_path / "output")
+    upstreamDown = True
+    requested = []
+
+    def fetchCollection(cardnames):
+        requested.append(list(cardnames))
+        if upstreamDown:
+            found = {name: card(name.title()) for name in cardnames
+                     if name != 'corpus harvest'}
+        else:
+            found = {name: card(name.title()) for name in cardnames}
+        return found, [], [name for name in cardnames if name not in found]
+
+    monkeypatch.setattr(main.scryfall, 'fetchCollection', fetchCollection)
+    monkeypatch.setattr(corpus, 'RESOLVE_RETRY_PAUSE', 0)
+
+    assert corpus.analyzeCorpus(str(decks), output, workers=1, chunkSize=1) == 2
+    # The first try and both retries
+    assert requested[1:] == [['corpus harvest'], ['corpus harvest']]
+    with open(os.path.join(output, corpus.CHECKPOINT_FILE)) as checkpointFile:
+        assert json.load(checkpointFile)['completed'] == [1]
+
+    upstreamDown = False
+    assert corpus.analyzeCorpus(str(decks), output, workers=1, chunkSize=1) == 1
+    with open(os.path.join(output, corpus.CHECKPOINT_FILE)) as checkpointFile:
+        assert json.load(checkpointFile)['completed'] == [0, 1]
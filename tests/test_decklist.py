@@ -0,0 +1,58 @@
+import os
+
+from decklist import DecklistParser, deckSize, parseDecklist
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def parseFixture(fileName):
+    with open(os.path.join(FIXTURES, fileName), 'r', encoding='utf-8') as deckFile:
+        return DecklistParser().feed(deckFile.read()).close()
+
+
+def test_mtgo_export_sideboard_after_blank_line():
+    parser = parseFixture("mtgo_mono_red.txt")
+    main = dict(parser.entries())
+    assert deckSize(parser.entries()) == 60
+    assert main['Play with Fire'] == 4
+    assert 'Abrade' not in main
+    assert deckSize(parser.entries(('sideboard',))) == 15
+
+
+def test_mtga_export_matches_mtgo_export():
+    mtga = parseFixture("mtga_mono_red.txt")
+    mtgo = parseFixture("mtgo_mono_red.txt")
+    assert mtga.entries() == mtgo.entries()
+    assert mtga.entries(('sideboard',)) == mtgo.entries(('sideboard',))
+
+
+def test_mtga_brawl_export_keeps_commander():
+    entries = dict(parseFixture("mtga_brawl.txt").entries())
+    assert entries['Korvold, Fae-Cursed King'] == 1
+    assert entries['Mayhem Devil'] == 1
+    assert deckSize(entries.items()) == 47
+
+
+def test_mtgo_commander_export_keeps_commander():
+    main = "35 Forest\n" + "".join(f"1 Card {number}\n" for number in range(64))
+    entries = dict(parseDecklist(main + "\n1 Omnath, Locus of Creation\n"))
+    assert entries['Omnath, Locus of Creation'] == 1
+    assert deckSize(entries.items()) == 100
+
+
+def test_grouped_list_without_headers_is_all_main_deck():
+    text = "4 Lightning Bolt\n4 Goblin Guide\n\n4 Lava Spike\n4 Rift Bolt\n\n20 Mountain\n"
+    assert deckSize(parseDecklist(text)) == 36
+
+
+def test_count_prefixed_section_headers():
+    text = "4 Lightning Bolt\n56 Mountain\n15 Sideboard\n3 Smash to Smithereens\n1 Sideboard\n"
+    assert parseDecklist(text) == [('Lightning Bolt', 4), ('Mountain', 56)]
+
+
+def test_serverless_copy_matches():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with open(os.path.join(root, "decklist.py"), 'rb') as original, \
+            open(os.path.join(root, "mtg-deck-analyzer", "api", "_decklist.py"), 'rb') as copy:
+        assert copy.read() == original.read()
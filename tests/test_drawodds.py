@@ -0,0 +1,38 @@
+import pytest
+
+import drawodds
+
+
+def deck(lands, size=60):
+    spells = size - lands
+    return [{'name': 'Forest', 'type_line': 'Basic Land — Forest', 'cmc': 0.0,
+             'quantity': lands},
+            {'name': 'Grizzly Bears', 'type_line': 'Creature — Bear', 'cmc': 2.0,
+             'quantity': spells // 2},
+            {'name': 'Centaur Courser', 'type_line': 'Creature — Centaur', 'cmc': 3.0,
+             'quantity': spells - spells // 2}]
+
+
+def test_opening_hand_matches_known_values():
+    # 24 lands in 60 cards, the usual reference numbers
+    odds = drawodds.exactOdds(60, 24)
+    assert odds['opening_hand_lands'][2] == pytest.approx(0.2694, abs=1e-4)
+    assert odds['opening_hand_lands'][3] == pytest.approx(0.3087, abs=1e-4)
+    assert sum(odds['opening_hand_lands'].values()) == pytest.approx(1.0)
+    # On the draw a land drop each turn needs one more card than on the play
+    assert odds['land_drops']['on_the_draw'][4] > odds['land_drops']['on_the_play'][4]
+
+
+def test_simulation_without_mulligans_matches_exact_odds(monkeypatch):
+    monkeypatch.setattr(drawodds, 'MAX_MULLIGANS', 0)
+    odds = drawodds.drawOdds(deck(24), samples=60000, timeBudget=60)
+    assert odds['simulation']['samples'] == 60000
+    for play in ('on_the_play', 'on_the_draw'):
+        for turn, exact in odds['land_drops'][play].items():
+            assert odds['simulation'][play]['land_drops'][turn] == pytest.approx(exact, abs=0.01)
+
+
+def test_simulation_stays_within_its_budget():
+    odds = drawodds.drawOdds(deck(100, size=250), samples=10 ** 7, timeBudget=0.05)
+    assert odds['simulation']['seconds'] < 0.1
+    assert odds['simulation']['samples'] < 10 ** 7
@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+from fastapi.testclient import TestClient
+
+import main
+from jobs import JobQueue, QueueFull
+
+
+def test_full_queue_answers_503_with_retry_after(monkeypatch):
+    # No workers, so nothing leaves the queue
+    jobQueue = JobQueue(workers=0, queueSize=1)
+    asyncio.run(jobQueue.start())
+    jobQueue.averageSeconds = 7.0
+    monkeypatch.setattr(main, 'jobQueue', jobQueue)
+    client = TestClient(main.app)
+    decklist = {'decklist': "4 Mind Stone"}
+
+    accepted = client.post('/jobs/analyze-deck?charts=none', json=decklist)
+    assert accepted.status_code == 202
+    assert accepted.json()['status'] == 'queued'
+
+    rejected = client.post('/jobs/analyze-deck?charts=none', json=decklist)
+    assert rejected.status_code == 503
+    assert rejected.headers['Retry-After'] == '7'
+    assert jobQueue.stats()['rejected'] == 1
+    assert list(jobQueue.jobs) == [accepted.json()['job_id']]
+
+
+def test_retry_after_grows_with_the_backlog():
+    jobQueue = JobQueue(workers=2, queueSize=4)
+    jobQueue._queue = asyncio.Queue(maxsize=4)
+    jobQueue.averageSeconds = 3.0
+
+    async def work():
+        return b'{}'
+
+    for _ in range(4):
+        jobQueue.submit(work)
+    try:
+        jobQueue.submit(work)
+    except QueueFull as e:
+        assert e.retryAfter == 6
+    else:
+        raise AssertionError("the fifth job should not fit")
+
+
+def test_finished_results_expire():
+    jobQueue = JobQueue(workers=1, queueSize=4, resultTTL=0.05)
+
+    async def work():
+        return b'{"ok":true}'
+
+    async def run():
+        await jobQueue.start()
+        try:
+            job = jobQueue.submit(work)
+            finished = await jobQueue.wait(job.id, timeout=1)
+            assert finished.status == 'done'
+            assert finished.result == b'{"ok":true}'
+
+            # Still there until the TTL runs out
+            jobQueue.submit(work)
+            assert job.id in jobQueue.jobs
+            await asyncio.sleep(0.1)
+            jobQueue.submit(work)
+            return job.id
+        finally:
+            await jobQueue.stop()
+
+    jobId = asyncio.run(run())
+    assert jobId not in jobQueue.jobs
+    assert asyncio.run(jobQueue.wait(jobId, timeout=0)) is None
+
+
+def test_expired_job_is_404(monkeypatch):
+    jobQueue = JobQueue(workers=0, queueSize=1, resultTTL=60)
+    monkeypatch.setattr(main, 'jobQueue', jobQueue)
+    client = TestClient(main.app)
+
+    response = client.get('/jobs/0123456789abcdef')
+    assert response.status_code == 404
+    assert response.json()['detail'] == "Unknown or expired job"
+
+
+def test_failed_job_reports_its_status():
+    jobQueue = JobQueue(workers=1, queueSize=1)
+
+    async def work():
+        raise ValueError("no cards")
+
+    async def run():
+        await jobQueue.start()
+        try:
+            job = jobQueue.submit(work)
+            return await jobQueue.wait(job.id, timeout=1)
+        finally:
+            await jobQueue.stop()
+
+    job = asyncio.run(run())
+    assert (job.status, job.error, job.errorStatus) == ('failed', "no cards", 500)
+    assert job.finishedAt <= time.time()
+    assert jobQueue.stats()['failed'] == 1
@@ -0,0 +1,19 @@
+from fastapi.testclient import TestClient
+
+import main
+import manabase
+from decklist import MAX_DECK_CARDS
+
+
+def test_oversized_deck_is_skipped():
+    mountains = [{'name': 'Mountain', 'type_line': 'Basic Land — Mountain',
+                  'produced_mana': ['R'], 'quantity': MAX_DECK_CARDS + 1}]
+    assert manabase.analyzeManaBase(mountains) is None
+
+
+def test_oversized_decklist_is_rejected():
+    client = TestClient(main.app)
+    response = client.post('/analyze-deck?charts=none',
+                           json={'decklist': "30000 Mountain"})
+    assert response.status_code == 400
+    assert str(MAX_DECK_CARDS) in response.json()['detail']
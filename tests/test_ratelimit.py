@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import httpx
+
+import scryfall
+from ratelimit import SharedTokenBucket, TokenBucket, takeTokens
+
+
+def test_bucket_refills_at_rate_up_to_capacity():
+    state = (0.0, 100.0, 0.0)
+    state, wait = takeTokens(state, 100.0, rate=10, capacity=2, tokens=1)
+    assert wait == 0.1
+
+    # Half a second later the bucket holds five tokens' worth, capped at two
+    state, wait = takeTokens(state, 100.5, rate=10, capacity=2, tokens=1)
+    assert wait == 0.0
+    assert state[0] == 1.0
+
+    state, wait = takeTokens(state, 100.5, rate=10, capacity=2, tokens=1)
+    assert wait == 0.0
+    state, wait = takeTokens(state, 100.5, rate=10, capacity=2, tokens=1)
+    assert wait == 0.1
+
+
+def test_penalty_blocks_until_it_runs_out():
+    state, wait = takeTokens((2.0, 100.0, 105.0), 101.0, rate=10, capacity=2, tokens=1)
+    assert wait == 4.0
+    assert state == (2.0, 100.0, 105.0)
+
+    # Once the penalty is over the bucket refills from where it was
+    state, wait = takeTokens(state, 105.0, rate=10, capacity=2, tokens=1)
+    assert wait == 0.0
+
+
+def test_penalize_empties_the_bucket():
+    bucket = TokenBucket(rate=1000, capacity=5)
+    assert bucket._take(1) == 0.0
+
+    bucket.penalize(0.2)
+    assert 0.1 < bucket._take(1) <= 0.2
+
+    started = time.perf_counter()
+    bucket.acquire()
+    assert time.perf_counter() - started >= 0.15
+
+
+def test_shared_bucket_state_is_seen_by_other_instances(tmp_path):
+    path = str(tmp_path / "rate.state")
+    first = SharedTokenBucket(rate=1, capacity=1, path=path)
+    second = SharedTokenBucket(rate=1, capacity=1, path=path)
+
+    assert first._take(1) == 0.0
+    # The other worker's token is gone too
+    assert second._take(1) > 0.5
+
+    second.penalize(30)
+    assert first._take(1) > 29
+
+
+def test_429_backs_off_the_shared_limiter(monkeypatch):
+    limiter = TokenBucket(rate=1000, capacity=2)
+    monkeypatch.setattr(scryfall, 'limiter', limiter)
+    monkeypatch.setattr(scryfall, 'MAX_RETRIES', 2)
+    monkeypatch.setattr(scryfall, 'upstreamStats', dict.fromkeys(scryfall.upstreamStats, 0))
+    responses = [httpx.Response(429, headers={'Retry-After': '0.2'}),
+                 httpx.Response(200, json={'data': []})]
+
+    def handler(request):
+        return responses.pop(0)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await scryfall.requestWithRetryAsync(
+                client, 'GET', 'http://scryfall.test/cards/named')
+
+    started = time.time()
+    response = asyncio.run(run())
+    elapsed = time.time() - started
+    assert response.status_code == 200
+    assert elapsed >= 0.2
+    assert scryfall.upstreamStats == {'requests': 2, 'retries': 1, 'throttled': 1, 'errors': 0}
+    # Every other request on this machine waited out the Retry-After as well
+    assert limiter._state[2] >= started + 0.2
+
+
+def test_retry_after_header_formats():
+    assert scryfall.parseRetryAfter('3') == 3.0
+    assert scryfall.parseRetryAfter('-1') == 0.0
+    assert scryfall.parseRetryAfter('soon') is None
+    assert scryfall.parseRetryAfter(None) is None
+    future = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(time.time() + 60))
+    assert 55 < scryfall.parseRetryAfter(future) <= 60
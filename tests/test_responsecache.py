@@ -0,0 +1,39 @@
+from fastapi.testclient import TestClient
+
+import main
+
+
+CARDS = {
+    'lightning bolt': {'name': 'Lightning Bolt', 'type_line': 'Instant', 'cmc': 1.0,
+                       'mana_cost': '{R}', 'color_identity': ['R'], 'produced_mana': []},
+    'counterspell': {'name': 'Counterspell', 'type_line': 'Instant', 'cmc': 2.0,
+                     'mana_cost': '{U}{U}', 'color_identity': ['U'], 'produced_mana': []},
+}
+
+
+def test_partial_analysis_is_not_cached(monkeypatch):
+    upstreamDown = True
+
+    async def iterCollection(cardnames):
+        found = {name: dict(CARDS[name]) for name in cardnames
+                 if not (upstreamDown and name == 'counterspell')}
+        yield found, [], [name for name in cardnames if name not in found]
+
+    monkeypatch.setattr(main.scryfall, 'iterCollectionAsync', iterCollection)
+    client = TestClient(main.app)
+    decklist = {'decklist': "4 Lightning Bolt\n4 Counterspell"}
+
+    partial = client.post('/analyze-deck?charts=none', json=decklist)
+    assert partial.status_code == 200
+    assert [card['name'] for card in partial.json()['cards']] == ['Lightning Bolt']
+
+    upstreamDown = False
+    full = client.post('/analyze-deck?charts=none', json=decklist,
+                       headers={'If-None-Match': partial.headers['etag']})
+    assert full.status_code == 200
+    assert [card['name'] for card in full.json()['cards']] == ['Lightning Bolt', 'Counterspell']
+    assert full.headers['etag'] != partial.headers['etag']
+
+    cached = client.post('/analyze-deck?charts=none', json=decklist,
+                         headers={'If-None-Match': full.headers['etag']})
+    assert cached.status_code == 304
@@ -0,0 +1,84 @@
+from fastapi.testclient import TestClient
+
+import main
+from sessions import DeckSession
+
+
+CARDS = {
+    'opt': {'name': 'Opt', 'type_line': 'Instant', 'cmc': 1.0, 'mana_cost': '{U}',
+            'color_identity': ['U'], 'produced_mana': []},
+    'preordain': {'name': 'Preordain', 'type_line': 'Sorcery', 'cmc': 1.0,
+                  'mana_cost': '{U}', 'color_identity': ['U'], 'produced_mana': []},
+    'divination': {'name': 'Divination', 'type_line': 'Sorcery', 'cmc': 3.0,
+                   'mana_cost': '{2}{U}', 'color_identity': ['U'], 'produced_mana': []},
+}
+
+
+def fakeScryfall(monkeypatch, down=()):
+    async def iterCollection(cardnames):
+        found = {name: dict(CARDS[name]) for name in cardnames if name not in down}
+        yield found, [], [name for name in cardnames if name not in found]
+
+    monkeypatch.setattr(main.scryfall, 'iterCollectionAsync', iterCollection)
+
+
+def test_session_retries_cards_that_failed(monkeypatch):
+    fakeScryfall(monkeypatch, down={'preordain'})
+    client = TestClient(main.app)
+    decklist = {'decklist': "4 Opt\n4 Preordain"}
+
+    created = client.post('/sessions?charts=none', json=decklist)
+    assert created.status_code == 201
+    assert [card['name'] for card in created.json()['cards']] == ['Opt']
+    assert created.json()['mana_curve'] == {'1': 4}
+
+    fakeScryfall(monkeypatch)
+    updated = client.put(f"/sessions/{created.json()['session_id']}?charts=none",
+                         json=decklist)
+    assert updated.status_code == 200
+    assert updated.json()['fetched'] == 1
+    assert [card['name'] for card in updated.json()['cards']] == ['Opt', 'Preordain']
+    assert updated.json()['mana_curve'] == {'1': 8}
+
+
+def test_failed_update_leaves_session_unchanged(monkeypatch):
+    fakeScryfall(monkeypatch)
+    client = TestClient(main.app)
+    created = client.post('/sessions?charts=none', json={'decklist': "4 Opt"})
+    sessionId = created.json()['session_id']
+
+    def failingManaBase(cards):
+        raise RuntimeError("mana base failed")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(main, 'computeManaBase', failingManaBase)
+        failed = client.put(f"/sessions/{sessionId}?charts=none",
+                            json={'decklist': "4 Opt\n2 Divination"})
+    assert failed.status_code == 500
+    session = main.sessionStore.get(sessionId)
+    assert session.quantities == {'opt': 4}
+    assert 'divination' not in session.resolved
+
+    retried = client.put(f"/sessions/{sessionId}?charts=none",
+                         json={'decklist': "4 Opt\n2 Divination"})
+    assert retried.json()['added'] == ['Divination']
+    assert retried.json()['mana_curve'] == {'1': 4, '3': 2}
+
+
+def test_update_only_changes_the_session_on_commit():
+    session = DeckSession('unit')
+    entries = [('Opt', 4), ('Preordain', 4)]
+    state, changes = session.update(entries, {'opt': CARDS['opt']}, failed={'preordain'})
+    assert session.quantities == {} and session.resolved == {}
+    assert session.totals.results()[2] == {}
+    session.commit(state)
+    assert changes['added'] == ['Opt', 'preordain']
+    assert 'preordain' not in session.resolved
+    assert session.unknownNames(entries) == ['preordain']
+    assert session.totals.results()[2] == {1: 4}
+
+    # Once it resolves, the copies held since the failed update are counted
+    state, changes = session.update(entries, {'preordain': CARDS['preordain']})
+    assert changes == {'added': [], 'removed': [], 'changed': []}
+    session.commit(state)
+    assert session.totals.results()[2] == {1: 8}
@@ -0,0 +1,45 @@
+import asyncio
+
+import main
+from singleflight import RETRY, SingleFlight
+
+
+PONDER = {'name': 'Ponder', 'type_line': 'Sorcery', 'cmc': 1.0,
+          'mana_cost': '{U}', 'color_identity': ['U'], 'produced_mana': []}
+
+
+def test_release_hands_waiters_retry():
+    async def scenario():
+        flights = SingleFlight()
+        owned, _ = flights.claim(['lightning bolt'])
+        _, waiting = flights.claim(['lightning bolt'])
+        flights.release(owned)
+        return await flights.wait(waiting)
+
+    assert asyncio.run(scenario()) == {'lightning bolt': RETRY}
+
+
+def test_waiter_fetches_cards_itself_when_leader_is_cancelled(monkeypatch):
+    calls = []
+
+    async def iterCollection(cardnames):
+        calls.append(list(cardnames))
+        if len(calls) == 1:
+            # The leader's request hangs until it's cancelled
+            await asyncio.Event().wait()
+        yield {name: dict(PONDER) for name in cardnames}, [], []
+
+    monkeypatch.setattr(main.scryfall, 'iterCollectionAsync', iterCollection)
+
+    async def scenario():
+        leader = asyncio.create_task(main.fetchManyAsync(['ponder']))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(main.fetchManyAsync(['ponder']))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await asyncio.wait_for(waiter, 5)
+
+    resolved = asyncio.run(scenario())
+    assert resolved['ponder']['name'] == 'Ponder'
+    assert calls == [['ponder'], ['ponder']]
+    assert main.cardFlights.stats()['in_flight'] == 0
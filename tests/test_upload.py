@@ -0,0 +1,62 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+import main
+from decklist import MAX_UPLOAD_BYTES
+
+
+BOUNDARY = "deckboundary"
+
+
+def multipartChunks(size, chunkSize=64 * 1024):
+    yield (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"file\"; "
+           f"filename=\"deck.txt\"\r\nContent-Type: text/plain\r\n\r\n").encode()
+    line = b"4 Lightning Bolt\n"
+    sent = 0
+    while sent < size:
+        chunk = line * (chunkSize // len(line))
+        sent += len(chunk)
+        yield chunk
+    yield f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+def test_chunked_upload_over_the_limit_is_rejected_while_streaming():
+    chunks = multipartChunks(MAX_UPLOAD_BYTES * 4)
+    received = []
+    sent = []
+
+    async def receive():
+        # Let the app run between chunks, like a socket would
+        await asyncio.sleep(0)
+        chunk = next(chunks, None)
+        if chunk is None:
+            return {'type': 'http.disconnect'}
+        received.append(len(chunk))
+        return {'type': 'http.request', 'body': chunk, 'more_body': True}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            message = dict(message, received=sum(received))
+        sent.append(message)
+
+    # No Content-Length, like a chunked upload
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'POST', 'scheme': 'http', 'path': '/upload-decklist',
+        'raw_path': b'/upload-decklist', 'root_path': '', 'query_string': b'charts=none',
+        'headers': [(b'content-type', f'multipart/form-data; boundary={BOUNDARY}'.encode())],
+        'client': ('127.0.0.1', 1234), 'server': ('testserver', 80),
+    }
+    asyncio.run(asyncio.wait_for(main.app(scope, receive, send), 10))
+
+    assert sent[0]['status'] == 413
+    # Answered before the rest of the body was read
+    assert sent[0]['received'] < MAX_UPLOAD_BYTES + 128 * 1024
+
+
+def test_declared_size_over_the_limit_is_rejected():
+    response = TestClient(main.app).post(
+        '/upload-decklist?charts=none',
+        files={'file': ('deck.txt', b"4 Lightning Bolt\n" * (MAX_UPLOAD_BYTES // 8))})
+    assert response.status_code == 413
@@ -0,0 +1,60 @@
+import asyncio
+import json
+import time
+
+from cardcache import CardCache
+from warmup import CardWarmer
+
+
+BOLT = {'name': 'Lightning Bolt', 'type_line': 'Instant', 'cmc': 1.0, 'mana_cost': '{R}',
+        'color_identity': ['R'], 'produced_mana': []}
+
+
+def makeWarmer(tmp_path, snapshot, **kwargs):
+    snapshotPath = tmp_path / "snapshot.json"
+    snapshotPath.write_text(json.dumps(snapshot))
+    cardCache = CardCache(str(tmp_path / "cards.sqlite3"), ttl=7 * 24 * 60 * 60)
+    return CardWarmer(cardCache, cards=[], snapshotPath=str(snapshotPath), top=0, **kwargs)
+
+
+def test_snapshot_cards_keep_their_age(tmp_path):
+    fetchedAt = time.time() - 3 * 24 * 60 * 60
+    warmer = makeWarmer(tmp_path, [dict(BOLT, fetched_at=fetchedAt), dict(BOLT, name='Shock')])
+
+    async def resolve(names):
+        return {name: warmer.cardCache.get(name) for name in names}
+
+    asyncio.run(warmer.warm(resolve))
+    stored = warmer.cardCache.fetchedAt(['lightning bolt', 'shock'])
+    assert stored['lightning bolt'] == fetchedAt
+    assert 'fetched_at' not in warmer.cardCache.get('lightning bolt')
+    # Without a fetch time the card is served but refreshed on the next pass
+    assert warmer.cardCache.get('shock') is not None
+    assert warmer.expiring(['lightning bolt', 'shock']) == ['shock']
+
+
+def test_warmup_keeps_lookups_of_requests(tmp_path):
+    warmer = makeWarmer(tmp_path, ['Lightning Bolt'])
+    requestServed = asyncio.Event()
+
+    async def resolve(names):
+        for name in names:
+            warmer.recordLookup(name)
+        await requestServed.wait()
+        return {name: BOLT for name in names}
+
+    async def run():
+        warming = asyncio.create_task(warmer.warm(resolve))
+        await asyncio.sleep(0)
+        # A request served while the warmup is resolving
+        warmer.recordLookup('lightning bolt')
+        requestServed.set()
+        await warming
+
+    asyncio.run(run())
+    assert warmer.lookups == {'lightning bolt': 1}
+
+
+def test_refresh_ahead_stays_below_ttl(tmp_path):
+    warmer = makeWarmer(tmp_path, [], refreshAhead=30 * 24 * 60 * 60)
+    assert warmer.refreshAhead < warmer.cardCache.ttl
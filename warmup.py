@@ -0,0 +1,257 @@
+"""
+Card cache warmup and background refresh.
+
+At startup the hot cards are loaded into the card cache's memory, fetching the
+ones it doesn't have, so the first requests after a deploy don't wait on
+Scryfall for staples. Hot cards are:
+
+- MTG_WARMUP_CARDS, a comma-separated list (basic lands and common staples by
+  default)
+- the cards in MTG_WARMUP_SNAPSHOT, a JSON list of card names, or of card
+  dicts which are stored without asking Scryfall at all, as of their
+  fetched_at time (write one with `python warmup.py snapshot.json`)
+- the MTG_WARMUP_TOP most looked up cards of the last MTG_WARMUP_WINDOW
+  seconds, counted in the card cache file by previous runs
+
+A background task then keeps the hot cards fresh: every
+MTG_WARMUP_REFRESH_INTERVAL seconds it refetches those that expire within
+MTG_WARMUP_REFRESH_AHEAD seconds, a small batch at a time and only while this
+worker isn't waiting on Scryfall for a request, so hot cards are never fetched
+on the request path.
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import random
+import time
+
+import scryfall
+from cardcache import CardCache, normalizeCardName
+
+
+DEFAULT_HOT_CARDS = ("Plains", "Island", "Swamp", "Mountain", "Forest", "Wastes",
+                     "Sol Ring", "Command Tower", "Arcane Signet", "Lightning Bolt")
+
+# Cards refreshed per Scryfall request, and the pause between two requests
+REFRESH_BATCH_SIZE = 75
+REFRESH_PAUSE_SECONDS = 2.0
+# How often lookup counts are written to the card cache file
+FLUSH_INTERVAL_SECONDS = 60.0
+
+# Set while the warmup itself resolves the hot cards, whose lookups aren't real
+# uses. Requests served meanwhile run in their own context and still count
+_warming = contextvars.ContextVar('warming', default=False)
+
+
+def loadSnapshot(path):
+    """
+    (card names, {name: card data}) from a snapshot file, card data may carry
+    the time it was fetched as fetched_at
+    """
+    with open(path, 'r', encoding='utf-8') as snapshotFile:
+        entries = json.load(snapshotFile)
+    names = []
+    cards = {}
+    for entry in entries:
+        if isinstance(entry, str):
+            names.append(entry)
+        else:
+            names.append(entry['name'])
+            cards[entry['name']] = entry
+    return names, cards
+
+
+class CardWarmer:
+    """
+    Warms the card cache with the hot cards at startup and refreshes them in
+    the background before they expire
+    """
+
+    def __init__(self, cardCache, cards=DEFAULT_HOT_CARDS, snapshotPath=None, top=500,
+                 window=30 * 24 * 60 * 60, refreshInterval=600,
+                 refreshAhead=24 * 60 * 60):
+        self.cardCache = cardCache
+        self.cards = list(cards)
+        self.snapshotPath = snapshotPath
+        self.top = top
+        self.window = window
+        self.refreshInterval = refreshInterval
+        # Refreshing a whole TTL ahead would refetch every hot card every time
+        self.refreshAhead = min(refreshAhead, cardCache.ttl / 2)
+        # Lookups since the last flush, {normalized name: count}
+        self.lookups = {}
+        # Hot names Scryfall doesn't know, not worth asking for again
+        self.unknown = set()
+        self.warmed = 0
+        self.refreshed = 0
+        self.lastFlush = time.monotonic()
+        self._task = None
+
+    @classmethod
+    def from_env(cls, cardCache):
+        cards = os.environ.get("MTG_WARMUP_CARDS")
+        return cls(
+            cardCache,
+            cards=[name.strip() for name in cards.split(',') if name.strip()]
+            if cards is not None else DEFAULT_HOT_CARDS,
+            snapshotPath=os.environ.get("MTG_WARMUP_SNAPSHOT") or None,
+            top=int(os.environ.get("MTG_WARMUP_TOP", 500)),
+            window=float(os.environ.get("MTG_WARMUP_WINDOW", 30 * 24 * 60 * 60)),
+            refreshInterval=float(os.environ.get("MTG_WARMUP_REFRESH_INTERVAL", 600)),
+            refreshAhead=float(os.environ.get("MTG_WARMUP_REFRESH_AHEAD", 24 * 60 * 60)),
+        )
+
+    def recordLookup(self, cardname):
+        """
+        Counts a lookup of a card that was found, called on the request path
+        """
+        if _warming.get():
+            return
+        self.lookups[cardname] = self.lookups.get(cardname, 0) + 1
+
+    def flush(self):
+        lookups, self.lookups = self.lookups, {}
+        self.lastFlush = time.monotonic()
+        self.cardCache.recordUses(lookups)
+        self.cardCache.flushTouched()
+
+    def hotNames(self):
+        """
+        Normalized names of the hot cards, and snapshot cards to store as is
+        """
+        names = list(self.cards)
+        snapshotCards = {}
+        if self.snapshotPath and os.path.exists(self.snapshotPath):
+            snapshotNames, snapshotCards = loadSnapshot(self.snapshotPath)
+            names += snapshotNames
+        if self.top > 0:
+            names += self.cardCache.hotKeys(self.top, since=time.time() - self.window)
+        return list(dict.fromkeys(normalizeCardName(name) for name in names)), snapshotCards
+
+    async def warm(self, resolve):
+        """
+        Loads the hot cards: snapshot cards missing from the cache are stored
+        directly, everything else goes through `resolve` (the regular async
+        lookup, which reads the cache into memory and fetches what's missing)
+        """
+        started = time.perf_counter()
+        names, snapshotCards = await asyncio.to_thread(self.hotNames)
+        # Snapshot cards without a fetch time are stored as already due for a
+        # refresh, they may be as old as the snapshot file
+        now = time.time()
+        dueAt = now - (self.cardCache.ttl - self.refreshAhead)
+        for name, data in snapshotCards.items():
+            fetchedAt = data.pop('fetched_at', None)
+            if self.cardCache.get(name) is None:
+                self.cardCache.put(name, data, fetchedAt=dueAt if fetchedAt is None
+                                   else min(fetchedAt, now))
+        # Warming isn't a real use, don't let it count towards the hot set
+        token = _warming.set(True)
+        try:
+            resolved = await resolve(names) if names else {}
+        finally:
+            _warming.reset(token)
+        self.unknown = set(names) - set(resolved)
+        self.warmed = len(resolved)
+        print(f"Warmed {self.warmed} of {len(names)} hot cards in "
+              f"{time.perf_counter() - started:.2f}s")
+        return names
+
+    def expiring(self, names):
+        """
+        Hot cards whose cache entry is missing or expires within refreshAhead
+        """
+        fetchedAt = self.cardCache.fetchedAt(names)
+        cutoff = time.time() - (self.cardCache.ttl - self.refreshAhead)
+        return [name for name in names
+                if name not in self.unknown and fetchedAt.get(name, 0.0) < cutoff]
+
+    async def refresh(self, names, busy):
+        """
+        Refetches the expiring hot cards in small batches, pausing while
+        `busy()` says requests are waiting on Scryfall
+        """
+        stale = await asyncio.to_thread(self.expiring, names)
+        refreshed = 0
+        for start in range(0, len(stale), REFRESH_BATCH_SIZE):
+            while busy():
+                await asyncio.sleep(REFRESH_PAUSE_SECONDS)
+            batch = stale[start:start + REFRESH_BATCH_SIZE]
+            found, _, _ = await scryfall.fetchCollectionAsync(batch)
+            for name, data in found.items():
+                self.cardCache.put(name, data, aliases=[data['name']])
+            refreshed += len(found)
+            await asyncio.sleep(REFRESH_PAUSE_SECONDS)
+        self.refreshed += refreshed
+        if stale:
+            print(f"Refreshed {refreshed} hot cards before they expire")
+
+    async def run(self, resolve, busy):
+        try:
+            await self.warm(resolve)
+        except Exception as error:
+            print(f"Card warmup failed: {error}")
+
+        # Workers started together shouldn't all refresh at the same moment
+        refreshing = self.refreshInterval > 0
+        nextRefresh = time.monotonic() + self.refreshInterval * random.uniform(0.5, 1.0)
+        while True:
+            await asyncio.sleep(min(FLUSH_INTERVAL_SECONDS, self.refreshInterval)
+                                if refreshing else FLUSH_INTERVAL_SECONDS)
+            try:
+                if time.monotonic() - self.lastFlush >= FLUSH_INTERVAL_SECONDS:
+                    await asyncio.to_thread(self.flush)
+                if refreshing and time.monotonic() >= nextRefresh:
+                    names, _ = await asyncio.to_thread(self.hotNames)
+                    await self.refresh(names, busy)
+                    nextRefresh = time.monotonic() + self.refreshInterval
+            except Exception as error:
+                print(f"Card refresh failed: {error}")
+
+    def start(self, resolve, busy=lambda: False):
+        """
+        Starts warming up in the background, then keeps refreshing
+        """
+        self._task = asyncio.create_task(self.run(resolve, busy))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.flush()
+
+    def stats(self):
+        return {
+            'warmed': self.warmed,
+            'refreshed': self.refreshed,
+            'pending_lookups': len(self.lookups),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write the most looked up cards of the card cache to a warmup snapshot")
+    parser.add_argument("snapshot_file")
+    parser.add_argument("--top", type=int, default=500)
+    args = parser.parse_args()
+
+    cardCache = CardCache.from_env()
+    keys = cardCache.hotKeys(args.top)
+    fetchedAt = cardCache.fetchedAt(keys)
+    cards = []
+    for key in keys:
+        data = cardCache.get(key)
+        if data is not None:
+            # So loading the snapshot keeps the card's age
+            data['fetched_at'] = fetchedAt.get(key)
+            cards.append(data)
+    with open(args.snapshot_file, 'w', encoding='utf-8') as snapshotFile:
+        json.dump(cards, snapshotFile)
+    print(f"Wrote {len(cards)} cards to {args.snapshot_file}")
+
+
+if __name__ == "__main__":
+    main()